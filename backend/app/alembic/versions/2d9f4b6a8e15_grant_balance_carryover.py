@@ -0,0 +1,176 @@
+"""Grant balance carryover of detached years
+
+Revision ID: 2d9f4b6a8e15
+Revises: 7f2a9c4e1d83
+Create Date: 2026-10-20 09:12:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2d9f4b6a8e15'
+down_revision: Union[str, None] = '7f2a9c4e1d83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+DETACH_SQL = """-- Detach a year and keep it as the table grant_expense_archive_y<year>.
+-- Detaching only touches the catalog, the rows are not scanned. The
+-- balances of the year's grants keep its spend, so it is folded into
+-- grant_balance_carryover first, the allocations and approvals of its
+-- expenses move to <table>_archive_y<year> tables and its finalized
+-- reservations let go of their expenses. The triggers of those tables are
+-- off meanwhile, the ledger must not see the rows as deleted. A year
+-- counting towards an active budget rule is refused, the rule's aggregate
+-- would lose it.
+CREATE OR REPLACE FUNCTION grant_expense_detach_partition(p_year INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    archive TEXT := 'grant_expense_archive_y' || p_year;
+    lower_bound TIMESTAMPTZ := make_timestamptz(p_year, 1, 1, 0, 0, 0, 'UTC');
+    upper_bound TIMESTAMPTZ := make_timestamptz(p_year + 1, 1, 1, 0, 0, 0, 'UTC');
+    referencing TEXT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(7302, 0);
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'grant_expense'::regclass
+            AND c.relname = partition_name
+    ) THEN
+        RETURN NULL;
+    END IF;
+    -- Taken by the detach anyway, no expense may change from here on
+    LOCK TABLE grant_expense IN ACCESS EXCLUSIVE MODE;
+    IF EXISTS (
+        SELECT 1 FROM rule r
+        WHERE r.is_active AND r.rule_type = 'BUDGET'
+            AND r.grant_id IN (
+                SELECT grant_id FROM grant_expense_share
+                WHERE date >= lower_bound AND date < upper_bound
+            )
+    ) THEN
+        RAISE EXCEPTION USING
+            ERRCODE = 'object_in_use',
+            MESSAGE = 'Expenses of ' || p_year
+                || ' count towards an active budget rule',
+            HINT = 'Deactivate the budget rules of their grants first.';
+    END IF;
+
+    INSERT INTO grant_balance_carryover (
+        grant_id, year, committed_amount, pending_amount, spent_amount,
+        created_at
+    )
+    SELECT
+        s.grant_id,
+        p_year,
+        COALESCE(SUM(s.amount) FILTER (WHERE a.status::TEXT = 'APPROVED'), 0),
+        COALESCE(SUM(s.amount) FILTER (WHERE a.id IS NULL), 0),
+        COALESCE(SUM(s.amount), 0),
+        now()
+    FROM grant_expense_share s
+    LEFT JOIN grant_approval a ON a.expense_id = s.expense_id
+    WHERE s.date >= lower_bound AND s.date < upper_bound
+    GROUP BY s.grant_id;
+    -- The expenses no longer count as owned, and the projections change
+    UPDATE grant_balance b SET
+        expense_count = b.expense_count - (
+            SELECT COUNT(*) FROM grant_expense e
+            WHERE e.grant_id = b.grant_id
+                AND e.date >= lower_bound AND e.date < upper_bound
+        ),
+        version = b.version + 1,
+        updated_at = now()
+    FROM grant_balance_carryover c
+    WHERE c.grant_id = b.grant_id AND c.year = p_year;
+
+    FOREACH referencing IN ARRAY ARRAY['grant_expense_allocation', 'grant_approval']
+    LOOP
+        EXECUTE 'CREATE TABLE '
+            || quote_ident(referencing || '_archive_y' || p_year)
+            || ' (LIKE ' || quote_ident(referencing) || ' INCLUDING DEFAULTS)';
+        EXECUTE 'ALTER TABLE ' || quote_ident(referencing)
+            || ' DISABLE TRIGGER USER';
+        EXECUTE 'WITH moved AS (DELETE FROM ' || quote_ident(referencing)
+            || ' WHERE expense_id IN (SELECT id FROM grant_expense'
+            || ' WHERE date >= $1 AND date < $2) RETURNING *)'
+            || ' INSERT INTO '
+            || quote_ident(referencing || '_archive_y' || p_year)
+            || ' SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+        EXECUTE 'ALTER TABLE ' || quote_ident(referencing)
+            || ' ENABLE TRIGGER USER';
+    END LOOP;
+    -- A finalized reservation outlives the expense it was turned into
+    ALTER TABLE grant_reservation DISABLE TRIGGER USER;
+    UPDATE grant_reservation SET expense_id = NULL
+    WHERE expense_id IN (
+        SELECT id FROM grant_expense
+        WHERE date >= lower_bound AND date < upper_bound
+    );
+    ALTER TABLE grant_reservation ENABLE TRIGGER USER;
+
+    EXECUTE 'ALTER TABLE grant_expense DETACH PARTITION '
+        || quote_ident(partition_name);
+    EXECUTE 'ALTER TABLE ' || quote_ident(partition_name)
+        || ' RENAME TO ' || quote_ident(archive);
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_DETACH_SQL = """-- Detach a year and keep it as the table grant_expense_archive_y<year>.
+-- Detaching only touches the catalog, the rows are not scanned.
+CREATE OR REPLACE FUNCTION grant_expense_detach_partition(p_year INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    archive TEXT := 'grant_expense_archive_y' || p_year;
+BEGIN
+    PERFORM pg_advisory_xact_lock(7302, 0);
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'grant_expense'::regclass
+            AND c.relname = partition_name
+    ) THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE 'ALTER TABLE grant_expense DETACH PARTITION '
+        || quote_ident(partition_name);
+    EXECUTE 'ALTER TABLE ' || quote_ident(partition_name)
+        || ' RENAME TO ' || quote_ident(archive);
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('grant_balance_carryover',
+    sa.Column('grant_id', sa.Uuid(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('committed_amount', sa.Float(), nullable=False),
+    sa.Column('pending_amount', sa.Float(), nullable=False),
+    sa.Column('spent_amount', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['grant_id'], ['grant.id'], ),
+    sa.PrimaryKeyConstraint('grant_id', 'year')
+    )
+    # ### end Alembic commands ###
+    op.execute(DETACH_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(PREVIOUS_DETACH_SQL)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('grant_balance_carryover')
+    # ### end Alembic commands ###
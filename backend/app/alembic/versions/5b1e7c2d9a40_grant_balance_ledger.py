@@ -0,0 +1,165 @@
+"""Grant balance ledger
+
+Revision ID: 5b1e7c2d9a40
+Revises: 834de18c19ae
+Create Date: 2026-10-19 09:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e7c2d9a40'
+down_revision: Union[str, None] = '834de18c19ae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+LEDGER_SQL = """
+CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b
+        (grant_id, committed_amount, pending_amount, spent_amount, updated_at)
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance
+        (grant_id, committed_amount, pending_amount, spent_amount, updated_at)
+    VALUES (NEW.id, 0, 0, 0, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        PERFORM grant_balance_apply(OLD.grant_id, -OLD.amount, review, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        PERFORM grant_balance_apply(NEW.grant_id, NEW.amount, review, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    expense_amount DOUBLE PRECISION;
+BEGIN
+    -- Move the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -expense_amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(expense_grant_id, expense_amount, NULL, 0);
+        END IF;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(expense_grant_id, -expense_amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                expense_grant_id, expense_amount, NEW.status::TEXT, 0);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OF amount, grant_id OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+BACKFILL_SQL = """
+INSERT INTO grant_balance
+    (grant_id, committed_amount, pending_amount, spent_amount, updated_at)
+SELECT
+    g.id,
+    COALESCE(SUM(e.amount) FILTER (WHERE a.status = 'APPROVED'), 0),
+    COALESCE(SUM(e.amount) FILTER (WHERE e.id IS NOT NULL AND a.id IS NULL), 0),
+    COALESCE(SUM(e.amount), 0),
+    now()
+FROM "grant" g
+LEFT JOIN grant_expense e ON e.grant_id = g.id
+LEFT JOIN grant_approval a ON a.expense_id = e.id
+GROUP BY g.id;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('grant_balance',
+    sa.Column('grant_id', sa.Uuid(), nullable=False),
+    sa.Column('committed_amount', sa.Float(), nullable=False),
+    sa.Column('pending_amount', sa.Float(), nullable=False),
+    sa.Column('spent_amount', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['grant_id'], ['grant.id'], ),
+    sa.PrimaryKeyConstraint('grant_id')
+    )
+    # ### end Alembic commands ###
+    op.execute(LEDGER_SQL)
+    op.execute(BACKFILL_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval')
+    op.execute('DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense')
+    op.execute('DROP TRIGGER IF EXISTS grant_balance_open ON "grant"')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_approval_sync()')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_expense_sync()')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_open()')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_apply(UUID, DOUBLE PRECISION, TEXT, DOUBLE PRECISION)')
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('grant_balance')
+    # ### end Alembic commands ###
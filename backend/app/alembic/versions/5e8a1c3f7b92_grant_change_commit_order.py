@@ -0,0 +1,234 @@
+"""Grant change feed commit order and split expenses
+
+Revision ID: 5e8a1c3f7b92
+Revises: 2d9f4b6a8e15
+Create Date: 2026-10-20 10:41:05.286317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a1c3f7b92'
+down_revision: Union[str, None] = '2d9f4b6a8e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHANGE_SQL = """CREATE OR REPLACE FUNCTION grant_change_record(
+    p_grant_id UUID,
+    p_entity TEXT,
+    p_entity_id UUID,
+    p_operation TEXT
+) RETURNS VOID AS $$
+DECLARE
+    change_id BIGINT;
+    changed_at TIMESTAMPTZ := now();
+BEGIN
+    INSERT INTO grant_change (
+        grant_id, entity, entity_id, operation, xact_id, created_at
+    )
+    VALUES (
+        p_grant_id, p_entity::changeentity, p_entity_id,
+        p_operation::changeoperation, pg_current_xact_id()::TEXT::BIGINT,
+        changed_at
+    )
+    RETURNING id INTO change_id;
+    PERFORM pg_notify('grant_changed', json_build_object(
+        'id', change_id,
+        'grant_id', p_grant_id,
+        'entity', p_entity,
+        'entity_id', p_entity_id,
+        'operation', p_operation,
+        'created_at', changed_at
+    )::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_change_expense() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+            PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+    END IF;
+    PERFORM grant_change_record(NEW.grant_id, 'EXPENSE', NEW.id, TG_OP);
+    -- The grants carrying an allocation of the expense see it change too
+    PERFORM grant_change_record(a.grant_id, 'EXPENSE', NEW.id, TG_OP)
+    FROM grant_expense_allocation a WHERE a.expense_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An allocation adds the expense to its grant, and changes what is left
+-- over for the expense's own grant
+CREATE OR REPLACE FUNCTION grant_change_allocation() RETURNS TRIGGER AS $$
+DECLARE
+    allocated_expense_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        allocated_expense_id := OLD.expense_id;
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.expense_id, TG_OP);
+    ELSE
+        allocated_expense_id := NEW.expense_id;
+        IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+            PERFORM grant_change_record(
+                OLD.grant_id, 'EXPENSE', OLD.expense_id, 'DELETE');
+            PERFORM grant_change_record(
+                NEW.grant_id, 'EXPENSE', NEW.expense_id, 'INSERT');
+        ELSE
+            PERFORM grant_change_record(
+                NEW.grant_id, 'EXPENSE', NEW.expense_id, TG_OP);
+        END IF;
+    END IF;
+    PERFORM grant_change_record(e.grant_id, 'EXPENSE', e.id, 'UPDATE')
+    FROM grant_expense e WHERE e.id = allocated_expense_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An approval belongs to every grant charged a share of its expense
+CREATE OR REPLACE FUNCTION grant_change_approval() RETURNS TRIGGER AS $$
+DECLARE
+    approval_id UUID;
+    approved_expense_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        approval_id := OLD.id;
+        approved_expense_id := OLD.expense_id;
+    ELSE
+        approval_id := NEW.id;
+        approved_expense_id := NEW.expense_id;
+    END IF;
+    PERFORM grant_change_record(s.grant_id, 'APPROVAL', approval_id, TG_OP)
+    FROM grant_expense_share s WHERE s.expense_id = approved_expense_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_change_expense ON grant_expense;
+CREATE TRIGGER grant_change_expense
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_change_expense();
+
+DROP TRIGGER IF EXISTS grant_change_allocation ON grant_expense_allocation;
+CREATE TRIGGER grant_change_allocation
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_change_allocation();
+
+DROP TRIGGER IF EXISTS grant_change_approval ON grant_approval;
+CREATE TRIGGER grant_change_approval
+    AFTER INSERT OR UPDATE OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_change_approval();
+"""
+
+PREVIOUS_CHANGE_SQL = """CREATE OR REPLACE FUNCTION grant_change_record(
+    p_grant_id UUID,
+    p_entity TEXT,
+    p_entity_id UUID,
+    p_operation TEXT
+) RETURNS VOID AS $$
+DECLARE
+    change_id BIGINT;
+    changed_at TIMESTAMPTZ := now();
+BEGIN
+    INSERT INTO grant_change (grant_id, entity, entity_id, operation, created_at)
+    VALUES (
+        p_grant_id, p_entity::changeentity, p_entity_id,
+        p_operation::changeoperation, changed_at
+    )
+    RETURNING id INTO change_id;
+    PERFORM pg_notify('grant_changed', json_build_object(
+        'id', change_id,
+        'grant_id', p_grant_id,
+        'entity', p_entity,
+        'entity_id', p_entity_id,
+        'operation', p_operation,
+        'created_at', changed_at
+    )::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_change_expense() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+            PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+    END IF;
+    PERFORM grant_change_record(NEW.grant_id, 'EXPENSE', NEW.id, TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An approval belongs to the grant of its expense
+CREATE OR REPLACE FUNCTION grant_change_approval() RETURNS TRIGGER AS $$
+DECLARE
+    approval_id UUID;
+    expense_grant_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        approval_id := OLD.id;
+        SELECT grant_id INTO expense_grant_id
+        FROM grant_expense WHERE id = OLD.expense_id;
+    ELSE
+        approval_id := NEW.id;
+        SELECT grant_id INTO expense_grant_id
+        FROM grant_expense WHERE id = NEW.expense_id;
+    END IF;
+    IF expense_grant_id IS NOT NULL THEN
+        PERFORM grant_change_record(expense_grant_id, 'APPROVAL', approval_id, TG_OP);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_change_expense ON grant_expense;
+CREATE TRIGGER grant_change_expense
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_change_expense();
+
+DROP TRIGGER IF EXISTS grant_change_approval ON grant_approval;
+CREATE TRIGGER grant_change_approval
+    AFTER INSERT OR UPDATE OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_change_approval();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('grant_change', sa.Column('xact_id', sa.BigInteger(), nullable=False, server_default='0'))
+    op.drop_index('ix_grant_change_grant_id_id', table_name='grant_change')
+    op.create_index('ix_grant_change_xact_id_id', 'grant_change', ['xact_id', 'id'], unique=False)
+    op.create_index('ix_grant_change_grant_id_xact_id_id', 'grant_change', ['grant_id', 'xact_id', 'id'], unique=False)
+    # ### end Alembic commands ###
+    # Changes logged before keep their id order, ahead of the new ones
+    op.alter_column('grant_change', 'xact_id', server_default=None)
+    op.execute(CHANGE_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS grant_change_allocation ON grant_expense_allocation')
+    op.execute('DROP FUNCTION IF EXISTS grant_change_allocation()')
+    op.execute(PREVIOUS_CHANGE_SQL)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_grant_change_grant_id_xact_id_id', table_name='grant_change')
+    op.drop_index('ix_grant_change_xact_id_id', table_name='grant_change')
+    op.create_index('ix_grant_change_grant_id_id', 'grant_change', ['grant_id', 'id'], unique=False)
+    op.drop_column('grant_change', 'xact_id')
+    # ### end Alembic commands ###
@@ -0,0 +1,314 @@
+"""Grant expense partitions
+
+Revision ID: 6a1c8e4f3b90
+Revises: 3b8e5f0d2a71
+Create Date: 2026-10-19 22:16:05.472193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a1c8e4f3b90'
+down_revision: Union[str, None] = '3b8e5f0d2a71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The table is rebuilt: the existing one is renamed, its rows are copied into
+# the partitioned table and its triggers (ledger and rule triggers) are
+# recreated on it
+MOVED_TABLE = 'grant_expense_moved'
+COLUMNS = 'amount, date, description, category, invoice_number, grant_id, id, created_at, updated_at, created_by'
+REFERENCING_TABLES = ['grant_expense_allocation', 'grant_approval', 'grant_reservation']
+INDEXES = [
+    ('ix_grant_expense_grant_id', ['grant_id']),
+    ('ix_grant_expense_created_at_id', ['created_at', 'id']),
+    ('ix_grant_expense_date_id', ['date', 'id']),
+    ('ix_grant_expense_grant_id_created_at_id', ['grant_id', 'created_at', 'id']),
+    ('ix_grant_expense_grant_id_date_id', ['grant_id', 'date', 'id']),
+    ('ix_grant_expense_grant_id_category_date_id', ['grant_id', 'category', 'date', 'id']),
+    ('ix_grant_expense_grant_id_amount_id', ['grant_id', 'amount', 'id']),
+]
+TRIGRAM_INDEXES = [
+    ('ix_grant_expense_description_trgm', 'description'),
+    ('ix_grant_expense_invoice_number_trgm', 'invoice_number'),
+]
+
+PARTITION_SQL = """
+CREATE TABLE IF NOT EXISTS grant_expense_default
+    PARTITION OF grant_expense DEFAULT;
+
+CREATE OR REPLACE FUNCTION grant_expense_create_partition(p_year INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    lower_bound TIMESTAMPTZ := make_timestamptz(p_year, 1, 1, 0, 0, 0, 'UTC');
+    upper_bound TIMESTAMPTZ := make_timestamptz(p_year + 1, 1, 1, 0, 0, 0, 'UTC');
+BEGIN
+    PERFORM pg_advisory_xact_lock(7302, 0);
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE 'CREATE TABLE ' || quote_ident(partition_name)
+        || ' (LIKE grant_expense INCLUDING DEFAULTS)';
+    -- Move the year's rows out of the default partition. The rows only
+    -- change partition, so the ledger, rule and reference triggers must
+    -- not see them as deleted.
+    IF EXISTS (
+        SELECT 1 FROM grant_expense_default
+        WHERE date >= lower_bound AND date < upper_bound
+    ) THEN
+        ALTER TABLE grant_expense_default DISABLE TRIGGER USER;
+        EXECUTE 'WITH moved AS (DELETE FROM grant_expense_default'
+            || ' WHERE date >= $1 AND date < $2 RETURNING *)'
+            || ' INSERT INTO ' || quote_ident(partition_name)
+            || ' SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+        ALTER TABLE grant_expense_default ENABLE TRIGGER USER;
+    END IF;
+    -- Attaching adds the indexes, constraints and triggers of grant_expense
+    EXECUTE 'ALTER TABLE grant_expense ATTACH PARTITION '
+        || quote_ident(partition_name)
+        || ' FOR VALUES FROM (' || quote_literal(lower_bound)
+        || ') TO (' || quote_literal(upper_bound) || ')';
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the partitions of the years ahead and of the years that ended up
+-- in the default partition. Returns the number of partitions created.
+CREATE OR REPLACE FUNCTION grant_expense_maintain_partitions(
+    p_years_ahead INTEGER DEFAULT 1
+) RETURNS INTEGER AS $$
+DECLARE
+    current_year INTEGER := extract(year FROM now() AT TIME ZONE 'UTC');
+    partition_years INTEGER[];
+    partition_year INTEGER;
+    created INTEGER := 0;
+BEGIN
+    -- Collected first, the default partition cannot be altered while scanned
+    partition_years := ARRAY(
+        SELECT generate_series(current_year, current_year + p_years_ahead)
+        UNION
+        SELECT extract(year FROM date AT TIME ZONE 'UTC')::INTEGER
+        FROM grant_expense_default
+    );
+    FOREACH partition_year IN ARRAY partition_years
+    LOOP
+        IF grant_expense_create_partition(partition_year) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach a year and keep it as the table grant_expense_archive_y<year>.
+-- Detaching only touches the catalog, the rows are not scanned.
+CREATE OR REPLACE FUNCTION grant_expense_detach_partition(p_year INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    archive TEXT := 'grant_expense_archive_y' || p_year;
+BEGIN
+    PERFORM pg_advisory_xact_lock(7302, 0);
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'grant_expense'::regclass
+            AND c.relname = partition_name
+    ) THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE 'ALTER TABLE grant_expense DETACH PARTITION '
+        || quote_ident(partition_name);
+    EXECUTE 'ALTER TABLE ' || quote_ident(partition_name)
+        || ' RENAME TO ' || quote_ident(archive);
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A referenced expense must exist, it is locked like a foreign key check
+-- would lock it
+CREATE OR REPLACE FUNCTION grant_expense_reference_check() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.expense_id IS NOT NULL THEN
+        PERFORM 1 FROM grant_expense WHERE id = NEW.expense_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = 'insert or update on table "' || TG_TABLE_NAME
+                    || '" violates the reference to grant_expense',
+                DETAIL = 'Key (expense_id)=(' || NEW.expense_id
+                    || ') is not present in table "grant_expense".';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A referenced expense cannot be deleted. An update moving an expense to
+-- another partition also fires the delete, the expense still exists then.
+CREATE OR REPLACE FUNCTION grant_expense_reference_restrict() RETURNS TRIGGER AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+        RETURN NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM grant_expense_allocation WHERE expense_id = OLD.id)
+        OR EXISTS (SELECT 1 FROM grant_approval WHERE expense_id = OLD.id)
+        OR EXISTS (SELECT 1 FROM grant_reservation WHERE expense_id = OLD.id)
+    THEN
+        RAISE foreign_key_violation USING
+            MESSAGE = 'delete on table "grant_expense" violates a reference'
+                || ' to the expense',
+            DETAIL = 'Key (id)=(' || OLD.id || ') is still referenced.';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_expense_allocation;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_approval;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_reservation;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_reservation
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_restrict ON grant_expense;
+CREATE TRIGGER grant_expense_reference_restrict
+    AFTER DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_restrict();
+
+SELECT grant_expense_maintain_partitions(1);
+"""
+
+SHARE_VIEW_SQL = """CREATE OR REPLACE VIEW grant_expense_share AS
+SELECT
+    e.id AS expense_id,
+    e.grant_id,
+    e.amount - COALESCE((
+        SELECT SUM(a.amount) FROM grant_expense_allocation a
+        WHERE a.expense_id = e.id
+    ), 0) AS amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense e
+UNION ALL
+SELECT
+    e.id AS expense_id,
+    a.grant_id,
+    a.amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense_allocation a
+JOIN grant_expense e ON e.id = a.expense_id;
+"""
+
+COPY_TRIGGERS_SQL = r"""
+DO $$
+DECLARE
+    definition TEXT;
+BEGIN
+    FOR definition IN
+        SELECT pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = 'grant_expense_moved'::regclass
+            AND NOT tgisinternal
+            AND tgname <> 'grant_expense_reference_restrict'
+    LOOP
+        EXECUTE regexp_replace(definition, ' ON \S+ ', ' ON grant_expense ');
+    END LOOP;
+END $$;
+"""
+
+
+def _move_table() -> None:
+    """Rename grant_expense out of the way, freeing its index names."""
+    op.rename_table('grant_expense', MOVED_TABLE)
+    op.execute(f'ALTER TABLE {MOVED_TABLE} RENAME CONSTRAINT grant_expense_pkey TO {MOVED_TABLE}_pkey')
+    for name, _ in INDEXES + TRIGRAM_INDEXES:
+        op.drop_index(name, table_name=MOVED_TABLE)
+
+
+def _create_table(**kw) -> None:
+    op.create_table('grant_expense',
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('date', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('description', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('category', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('invoice_number', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('grant_id', sa.Uuid(), nullable=False),
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('created_by', sa.Uuid(), nullable=False),
+    sa.ForeignKeyConstraint(['category'], ['grant_category.code'], ),
+    sa.ForeignKeyConstraint(['created_by'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['grant_id'], ['grant.id'], ),
+    **kw
+    )
+    for name, columns in INDEXES:
+        op.create_index(name, 'grant_expense', columns, unique=False)
+    for name, column in TRIGRAM_INDEXES:
+        op.create_index(name, 'grant_expense', [column], unique=False, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def _copy_rows() -> None:
+    op.execute(f'INSERT INTO grant_expense ({COLUMNS}) SELECT {COLUMNS} FROM {MOVED_TABLE}')
+    # Triggers are recreated after the copy, so the rows are not counted twice
+    op.execute(COPY_TRIGGERS_SQL)
+    op.execute(SHARE_VIEW_SQL)
+    op.drop_table(MOVED_TABLE)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in REFERENCING_TABLES:
+        op.drop_constraint(f'{table}_expense_id_fkey', table, type_='foreignkey')
+    _move_table()
+    _create_table(
+        sa.PrimaryKeyConstraint('id', 'date'),
+        postgresql_partition_by='RANGE (date)',
+    )
+    op.execute(PARTITION_SQL)
+    op.execute(
+        'SELECT grant_expense_create_partition(year) FROM ('
+        " SELECT DISTINCT extract(year FROM date AT TIME ZONE 'UTC')::INTEGER AS year"
+        f' FROM {MOVED_TABLE}) years'
+    )
+    _copy_rows()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in REFERENCING_TABLES:
+        op.execute(f'DROP TRIGGER IF EXISTS grant_expense_reference_check ON {table}')
+    op.execute('DROP FUNCTION IF EXISTS grant_expense_reference_check()')
+    _move_table()
+    _create_table(sa.PrimaryKeyConstraint('id'))
+    _copy_rows()
+    op.execute('DROP FUNCTION IF EXISTS grant_expense_reference_restrict()')
+    op.execute('DROP FUNCTION IF EXISTS grant_expense_detach_partition(INTEGER)')
+    op.execute('DROP FUNCTION IF EXISTS grant_expense_maintain_partitions(INTEGER)')
+    op.execute('DROP FUNCTION IF EXISTS grant_expense_create_partition(INTEGER)')
+    for table in REFERENCING_TABLES:
+        op.create_foreign_key(f'{table}_expense_id_fkey', table, 'grant_expense', ['expense_id'], ['id'])
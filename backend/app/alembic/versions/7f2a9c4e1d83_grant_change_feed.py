@@ -0,0 +1,131 @@
+"""Grant change feed
+
+Revision ID: 7f2a9c4e1d83
+Revises: 0e7d3b5a9c48
+Create Date: 2026-10-19 23:31:52.407193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f2a9c4e1d83'
+down_revision: Union[str, None] = '0e7d3b5a9c48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHANGE_SQL = """CREATE OR REPLACE FUNCTION grant_change_record(
+    p_grant_id UUID,
+    p_entity TEXT,
+    p_entity_id UUID,
+    p_operation TEXT
+) RETURNS VOID AS $$
+DECLARE
+    change_id BIGINT;
+    changed_at TIMESTAMPTZ := now();
+BEGIN
+    INSERT INTO grant_change (grant_id, entity, entity_id, operation, created_at)
+    VALUES (
+        p_grant_id, p_entity::changeentity, p_entity_id,
+        p_operation::changeoperation, changed_at
+    )
+    RETURNING id INTO change_id;
+    PERFORM pg_notify('grant_changed', json_build_object(
+        'id', change_id,
+        'grant_id', p_grant_id,
+        'entity', p_entity,
+        'entity_id', p_entity_id,
+        'operation', p_operation,
+        'created_at', changed_at
+    )::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_change_expense() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+            PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+    END IF;
+    PERFORM grant_change_record(NEW.grant_id, 'EXPENSE', NEW.id, TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An approval belongs to the grant of its expense
+CREATE OR REPLACE FUNCTION grant_change_approval() RETURNS TRIGGER AS $$
+DECLARE
+    approval_id UUID;
+    expense_grant_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        approval_id := OLD.id;
+        SELECT grant_id INTO expense_grant_id
+        FROM grant_expense WHERE id = OLD.expense_id;
+    ELSE
+        approval_id := NEW.id;
+        SELECT grant_id INTO expense_grant_id
+        FROM grant_expense WHERE id = NEW.expense_id;
+    END IF;
+    IF expense_grant_id IS NOT NULL THEN
+        PERFORM grant_change_record(expense_grant_id, 'APPROVAL', approval_id, TG_OP);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_change_expense ON grant_expense;
+CREATE TRIGGER grant_change_expense
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_change_expense();
+
+DROP TRIGGER IF EXISTS grant_change_approval ON grant_approval;
+CREATE TRIGGER grant_change_approval
+    AFTER INSERT OR UPDATE OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_change_approval();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('grant_change',
+    sa.Column('grant_id', sa.Uuid(), nullable=False),
+    sa.Column('entity', sa.Enum('EXPENSE', 'APPROVAL', name='changeentity'), nullable=False),
+    sa.Column('entity_id', sa.Uuid(), nullable=False),
+    sa.Column('operation', sa.Enum('INSERT', 'UPDATE', 'DELETE', name='changeoperation'), nullable=False),
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_grant_change_grant_id_id', 'grant_change', ['grant_id', 'id'], unique=False)
+    op.create_index('ix_grant_change_created_at_brin', 'grant_change', ['created_at'], unique=False, postgresql_using='brin', postgresql_with={'pages_per_range': 32, 'autosummarize': 'on'})
+    # ### end Alembic commands ###
+    op.execute(CHANGE_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS grant_change_approval ON grant_approval')
+    op.execute('DROP TRIGGER IF EXISTS grant_change_expense ON grant_expense')
+    op.execute('DROP FUNCTION IF EXISTS grant_change_approval()')
+    op.execute('DROP FUNCTION IF EXISTS grant_change_expense()')
+    op.execute('DROP FUNCTION IF EXISTS grant_change_record(UUID, TEXT, UUID, TEXT)')
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_grant_change_created_at_brin', table_name='grant_change', postgresql_using='brin', postgresql_with={'pages_per_range': 32, 'autosummarize': 'on'})
+    op.drop_index('ix_grant_change_grant_id_id', table_name='grant_change')
+    op.drop_table('grant_change')
+    # ### end Alembic commands ###
+    op.execute('DROP TYPE IF EXISTS changeoperation')
+    op.execute('DROP TYPE IF EXISTS changeentity')
@@ -0,0 +1,46 @@
+"""Grant category notify
+
+Revision ID: 9d4b7e2f1c60
+Revises: 5c3e1a9f7b24
+Create Date: 2026-10-19 21:04:37.912846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4b7e2f1c60'
+down_revision: Union[str, None] = '5c3e1a9f7b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CATEGORY_SQL = """CREATE OR REPLACE FUNCTION grant_category_notify()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('grant_category_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_category_notify ON grant_category;
+CREATE TRIGGER grant_category_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON grant_category
+    FOR EACH STATEMENT EXECUTE FUNCTION grant_category_notify();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(CATEGORY_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS grant_category_notify ON grant_category")
+    op.execute("DROP FUNCTION IF EXISTS grant_category_notify()")
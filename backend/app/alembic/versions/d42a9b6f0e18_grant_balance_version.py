@@ -0,0 +1,256 @@
+"""Grant balance version
+
+Revision ID: d42a9b6f0e18
+Revises: c81d4e07b5f3
+Create Date: 2026-10-19 12:41:09.366120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd42a9b6f0e18'
+down_revision: Union[str, None] = 'c81d4e07b5f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+LEDGER_SQL = """
+CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        1,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        version = b.version + 1,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (NEW.id, 0, 0, 0, 1, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_bump() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM grant_balance_apply(NEW.id, 0, NULL, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        PERFORM grant_balance_apply(OLD.grant_id, -OLD.amount, review, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        PERFORM grant_balance_apply(NEW.grant_id, NEW.amount, review, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    expense_amount DOUBLE PRECISION;
+BEGIN
+    -- Move the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -expense_amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(expense_grant_id, expense_amount, NULL, 0);
+        END IF;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(expense_grant_id, -expense_amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                expense_grant_id, expense_amount, NEW.status::TEXT, 0);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_bump ON "grant";
+CREATE TRIGGER grant_balance_bump
+    AFTER UPDATE OF total_amount ON "grant"
+    FOR EACH ROW
+    WHEN (OLD.total_amount IS DISTINCT FROM NEW.total_amount)
+    EXECUTE FUNCTION grant_balance_bump();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+# Ledger functions as of revision 5b1e7c2d9a40, restored on downgrade
+PREVIOUS_LEDGER_SQL = """
+CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b
+        (grant_id, committed_amount, pending_amount, spent_amount, updated_at)
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance
+        (grant_id, committed_amount, pending_amount, spent_amount, updated_at)
+    VALUES (NEW.id, 0, 0, 0, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        PERFORM grant_balance_apply(OLD.grant_id, -OLD.amount, review, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        PERFORM grant_balance_apply(NEW.grant_id, NEW.amount, review, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    expense_amount DOUBLE PRECISION;
+BEGIN
+    -- Move the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -expense_amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(expense_grant_id, expense_amount, NULL, 0);
+        END IF;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(expense_grant_id, -expense_amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                expense_grant_id, expense_amount, NEW.status::TEXT, 0);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OF amount, grant_id OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('grant_balance', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    # ### end Alembic commands ###
+    op.execute(LEDGER_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS grant_balance_bump ON "grant"')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_bump()')
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_column('grant_balance', 'version')
+    # ### end Alembic commands ###
+    op.execute(PREVIOUS_LEDGER_SQL)
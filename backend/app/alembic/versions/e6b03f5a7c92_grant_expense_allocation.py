@@ -0,0 +1,375 @@
+"""Grant expense allocation
+
+Revision ID: e6b03f5a7c92
+Revises: d42a9b6f0e18
+Create Date: 2026-10-19 15:02:47.518340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b03f5a7c92'
+down_revision: Union[str, None] = 'd42a9b6f0e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+LEDGER_SQL = """-- The part of every expense charged to each grant: what is left of the
+-- expense on its own grant after its allocations, plus one row per allocation
+CREATE OR REPLACE VIEW grant_expense_share AS
+SELECT
+    e.id AS expense_id,
+    e.grant_id,
+    e.amount - COALESCE((
+        SELECT SUM(a.amount) FROM grant_expense_allocation a
+        WHERE a.expense_id = e.id
+    ), 0) AS amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense e
+UNION ALL
+SELECT
+    e.id AS expense_id,
+    a.grant_id,
+    a.amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense_allocation a
+JOIN grant_expense e ON e.id = a.expense_id;
+
+CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        1,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        version = b.version + 1,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (NEW.id, 0, 0, 0, 1, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_bump() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM grant_balance_apply(NEW.id, 0, NULL, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An expense only charges its own grant with what its allocations leave over
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+    allocated DOUBLE PRECISION;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        SELECT COALESCE(SUM(amount), 0) INTO allocated
+        FROM grant_expense_allocation WHERE expense_id = OLD.id;
+        PERFORM grant_balance_apply(
+            OLD.grant_id, allocated - OLD.amount, review, allocated - OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        SELECT COALESCE(SUM(amount), 0) INTO allocated
+        FROM grant_expense_allocation WHERE expense_id = NEW.id;
+        PERFORM grant_balance_apply(
+            NEW.grant_id, NEW.amount - allocated, review, NEW.amount - allocated);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move an allocated amount between the expense's own grant and the
+-- allocation's grant
+CREATE OR REPLACE FUNCTION grant_balance_allocation_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT e.grant_id, (
+            SELECT status::TEXT FROM grant_approval
+            WHERE expense_id = e.id LIMIT 1
+        ) INTO expense_grant_id, review
+        FROM grant_expense e WHERE e.id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                OLD.grant_id, -OLD.amount, review, -OLD.amount);
+            PERFORM grant_balance_apply(
+                expense_grant_id, OLD.amount, review, OLD.amount);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT e.grant_id, (
+            SELECT status::TEXT FROM grant_approval
+            WHERE expense_id = e.id LIMIT 1
+        ) INTO expense_grant_id, review
+        FROM grant_expense e WHERE e.id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -NEW.amount, review, -NEW.amount);
+            PERFORM grant_balance_apply(
+                NEW.grant_id, NEW.amount, review, NEW.amount);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    share RECORD;
+BEGIN
+    -- Move every share of the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        FOR share IN
+            SELECT grant_id, amount FROM grant_expense_share
+            WHERE expense_id = OLD.expense_id
+        LOOP
+            PERFORM grant_balance_apply(
+                share.grant_id, -share.amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(share.grant_id, share.amount, NULL, 0);
+        END LOOP;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        FOR share IN
+            SELECT grant_id, amount FROM grant_expense_share
+            WHERE expense_id = NEW.expense_id
+        LOOP
+            PERFORM grant_balance_apply(share.grant_id, -share.amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                share.grant_id, share.amount, NEW.status::TEXT, 0);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_bump ON "grant";
+CREATE TRIGGER grant_balance_bump
+    AFTER UPDATE OF total_amount ON "grant"
+    FOR EACH ROW
+    WHEN (OLD.total_amount IS DISTINCT FROM NEW.total_amount)
+    EXECUTE FUNCTION grant_balance_bump();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_allocation_sync ON grant_expense_allocation;
+CREATE TRIGGER grant_balance_allocation_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_allocation_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+PREVIOUS_LEDGER_SQL = """CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        1,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        version = b.version + 1,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (NEW.id, 0, 0, 0, 1, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_bump() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM grant_balance_apply(NEW.id, 0, NULL, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        PERFORM grant_balance_apply(OLD.grant_id, -OLD.amount, review, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        PERFORM grant_balance_apply(NEW.grant_id, NEW.amount, review, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    expense_amount DOUBLE PRECISION;
+BEGIN
+    -- Move the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -expense_amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(expense_grant_id, expense_amount, NULL, 0);
+        END IF;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        SELECT grant_id, amount INTO expense_grant_id, expense_amount
+        FROM grant_expense WHERE id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(expense_grant_id, -expense_amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                expense_grant_id, expense_amount, NEW.status::TEXT, 0);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_bump ON "grant";
+CREATE TRIGGER grant_balance_bump
+    AFTER UPDATE OF total_amount ON "grant"
+    FOR EACH ROW
+    WHEN (OLD.total_amount IS DISTINCT FROM NEW.total_amount)
+    EXECUTE FUNCTION grant_balance_bump();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('grant_expense_allocation',
+    sa.Column('grant_id', sa.Uuid(), nullable=False),
+    sa.Column('percentage', sa.Float(), nullable=True),
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('expense_id', sa.Uuid(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['expense_id'], ['grant_expense.id'], ),
+    sa.ForeignKeyConstraint(['grant_id'], ['grant.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('expense_id', 'grant_id')
+    )
+    op.create_index(op.f('ix_grant_expense_allocation_grant_id'), 'grant_expense_allocation', ['grant_id'], unique=False)
+    op.create_index(op.f('ix_grant_expense_grant_id'), 'grant_expense', ['grant_id'], unique=False)
+    op.create_index(op.f('ix_grant_approval_expense_id'), 'grant_approval', ['expense_id'], unique=False)
+    # ### end Alembic commands ###
+    op.execute(LEDGER_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS grant_balance_allocation_sync ON grant_expense_allocation')
+    op.execute('DROP FUNCTION IF EXISTS grant_balance_allocation_sync()')
+    op.execute('DROP VIEW IF EXISTS grant_expense_share')
+    # Balances of grants with allocated expenses need a ledger reconcile after this
+    op.execute(PREVIOUS_LEDGER_SQL)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index(op.f('ix_grant_approval_expense_id'), table_name='grant_approval')
+    op.drop_index(op.f('ix_grant_expense_grant_id'), table_name='grant_expense')
+    op.drop_index(op.f('ix_grant_expense_allocation_grant_id'), table_name='grant_expense_allocation')
+    op.drop_table('grant_expense_allocation')
+    # ### end Alembic commands ###
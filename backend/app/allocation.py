@@ -0,0 +1,378 @@
+import re
+from collections import defaultdict
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import and_, literal, literal_column, true
+from sqlmodel import Session, func, select
+
+from app.ledger import grant_expense_share
+from app.models import (
+    AllocationExclusion,
+    AllocationPlan,
+    AllocationPlansPublic,
+    ExpenseAllocationRequest,
+    Grant,
+    GrantAllocation,
+    GrantBalance,
+    GrantPermission,
+    GrantRole,
+    Rule,
+    RuleAggregator,
+    RuleCondition,
+    RuleFilter,
+    RuleOperator,
+    RuleType,
+)
+
+logger = getLogger("uvicorn.error")
+
+# Allocations below a cent are dropped from a plan
+MIN_ALLOCATION = 0.005
+
+
+def _candidate_statement(
+    request: ExpenseAllocationRequest, user_id: UUID, is_superuser: bool
+):
+    """
+    Select the candidate grants the user can submit expenses to, with their
+    remaining (not committed, pending or reserved) balance.
+    """
+    available = Grant.total_amount - func.coalesce(
+        GrantBalance.committed_amount
+        + GrantBalance.pending_amount
+        + GrantBalance.reserved_amount,
+        0.0,
+    )
+    statement = (
+        select(Grant.id, Grant.status, Grant.start_date, Grant.end_date, available)
+        .join(GrantBalance, GrantBalance.grant_id == Grant.id, isouter=True)
+        .order_by(Grant.id)
+    )
+    if request.grant_ids:
+        statement = statement.where(Grant.id.in_(request.grant_ids))
+    if not is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user_id)
+            .where(GrantRole.permissions.any(GrantPermission.SUBMIT_EXPENSES.value))
+        )
+        statement = statement.where(Grant.id.in_(subquery))
+    return statement
+
+
+def _rule_filters(
+    session: Session, grant_ids: List[UUID], rule_type: RuleType
+) -> Dict[UUID, List[Tuple[str, RuleOperator, str]]]:
+    """The filters of the active rules of a type of the candidate grants."""
+    statement = (
+        select(
+            RuleFilter.rule_id,
+            RuleFilter.field,
+            RuleFilter.operator,
+            RuleFilter.value,
+        )
+        .join(Rule, Rule.id == RuleFilter.rule_id)
+        .where(Rule.grant_id.in_(grant_ids))
+        .where(Rule.is_active)
+        .where(Rule.rule_type == rule_type)
+    )
+    filters = defaultdict(list)
+    for rule_id, field, operator, value in session.exec(statement).all():
+        filters[rule_id].append((field, operator, value))
+    return filters
+
+
+def _category_codes(value: str) -> List[str]:
+    return re.findall(r"'([^']*)'", value) or [value.strip("'\" ")]
+
+
+def _applies(
+    filters: List[Tuple[str, RuleOperator, str]], request: ExpenseAllocationRequest
+) -> bool:
+    """
+    Whether a rule's filters select the proposed expense. Only category
+    filters are known before the expense is split, a rule filtering on
+    anything else is left to the rule triggers.
+    """
+    for field, operator, value in filters:
+        if field != "category":
+            return False
+        codes = _category_codes(value)
+        if operator in (RuleOperator.IN, RuleOperator.EQUALS):
+            matched = request.category in codes
+        elif operator == RuleOperator.NOT_EQUALS:
+            matched = request.category not in codes
+        else:
+            return False
+        if not matched:
+            return False
+    return True
+
+
+def _rule_limits(
+    session: Session, grant_ids: List[UUID], request: ExpenseAllocationRequest
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate the active EXPENSE rule conditions of the candidate grants that
+    can be checked ahead of time: amount limits and category restrictions,
+    of the rules whose filters select the proposed expense. Returns the
+    largest amount each grant accepts, within the headroom of its BUDGET
+    rules, and whether it accepts the category. Other conditions are left to
+    the rule triggers.
+    """
+    index = {grant_id: i for i, grant_id in enumerate(grant_ids)}
+    cap = _budget_limits(session, grant_ids, request)
+    allowed = np.ones(len(grant_ids), dtype=bool)
+    filters = _rule_filters(session, grant_ids, RuleType.EXPENSE)
+    statement = (
+        select(
+            Rule.id,
+            Rule.grant_id,
+            RuleCondition.field,
+            RuleCondition.operator,
+            RuleCondition.value,
+        )
+        .join(RuleCondition, RuleCondition.rule_id == Rule.id)
+        .where(Rule.grant_id.in_(grant_ids))
+        .where(Rule.is_active)
+        .where(Rule.rule_type == RuleType.EXPENSE)
+    )
+    for rule_id, grant_id, field, operator, value in session.exec(statement).all():
+        if not _applies(filters[rule_id], request):
+            continue
+        i = index[grant_id]
+        if field == "amount":
+            limit = _parse_amount(value)
+            if limit is None:
+                continue
+            if operator == RuleOperator.LESS_THAN_EQUALS:
+                cap[i] = min(cap[i], limit)
+            elif operator == RuleOperator.LESS_THAN:
+                cap[i] = min(cap[i], np.nextafter(limit, -np.inf))
+        elif field == "category":
+            codes = _category_codes(value)
+            if operator in (RuleOperator.IN, RuleOperator.EQUALS):
+                allowed[i] &= request.category in codes
+            elif operator == RuleOperator.NOT_EQUALS:
+                allowed[i] &= request.category not in codes
+    return cap, allowed
+
+
+def _parse_amount(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _grant_value(value: str):
+    """Map grant.<field> references to the columns of the grant."""
+    if value.startswith("grant."):
+        return getattr(Grant, value.split(".")[1])
+    return literal_column(value)
+
+
+def _compare(expression, operator: RuleOperator, value: str):
+    return expression.op(operator.value)(_grant_value(value))
+
+
+def _budget_limits(
+    session: Session, grant_ids: List[UUID], request: ExpenseAllocationRequest
+) -> np.ndarray:
+    """
+    The headroom the active BUDGET rules of the candidate grants leave for
+    the proposed expense. A SUM of the amounts caps a grant's share at what
+    the rule has left, a MAX at the limit itself. The totals are read from
+    grant_expense_share with the rule's filters, as the rule triggers
+    aggregate them, and only rules whose filters select the proposed expense
+    by its date and category count. Other budget rules are left to the rule
+    triggers.
+    """
+    index = {grant_id: i for i, grant_id in enumerate(grant_ids)}
+    cap = np.full(len(grant_ids), np.inf)
+    filters = _rule_filters(session, grant_ids, RuleType.BUDGET)
+    statement = (
+        select(
+            Rule.id,
+            Rule.grant_id,
+            Rule.aggregator,
+            RuleCondition.operator,
+            RuleCondition.value,
+        )
+        .join(RuleCondition, RuleCondition.rule_id == Rule.id)
+        .where(Rule.grant_id.in_(grant_ids))
+        .where(Rule.is_active)
+        .where(Rule.rule_type == RuleType.BUDGET)
+        .where(Rule.aggregator.in_([RuleAggregator.SUM, RuleAggregator.MAX]))
+        .where(RuleCondition.field == "amount")
+        .where(
+            RuleCondition.operator.in_(
+                [RuleOperator.LESS_THAN, RuleOperator.LESS_THAN_EQUALS]
+            )
+        )
+    )
+    proposed = {"date": request.date, "category": request.category}
+    rows = session.exec(statement).all()
+    for rule_id, grant_id, aggregator, operator, value in rows:
+        rule_filters = filters[rule_id]
+        if any(field not in proposed for field, _, _ in rule_filters):
+            continue
+        shares = and_(
+            grant_expense_share.c.grant_id == Grant.id,
+            *[
+                _compare(grant_expense_share.c[field], operator, value)
+                for field, operator, value in rule_filters
+            ],
+        )
+        selected = and_(
+            true(),
+            *[
+                _compare(
+                    literal(proposed[field], grant_expense_share.c[field].type),
+                    operator,
+                    value,
+                )
+                for field, operator, value in rule_filters
+            ],
+        )
+        if aggregator == RuleAggregator.SUM:
+            aggregate = func.sum(grant_expense_share.c.amount)
+        else:
+            aggregate = func.max(grant_expense_share.c.amount)
+        row = session.exec(
+            select(
+                _grant_value(value),
+                func.coalesce(aggregate, 0.0),
+                selected,
+            )
+            .select_from(Grant)
+            .join(grant_expense_share, shares, isouter=True)
+            .where(Grant.id == grant_id)
+            .group_by(Grant.id)
+        ).first()
+        if row is None or row[0] is None or not row[2]:
+            continue
+        limit = float(row[0])
+        if operator == RuleOperator.LESS_THAN:
+            limit = np.nextafter(limit, -np.inf)
+        if aggregator == RuleAggregator.SUM:
+            limit -= float(row[1])
+        elif float(row[1]) > limit:
+            limit = 0.0
+        i = index[grant_id]
+        cap[i] = min(cap[i], max(limit, 0.0))
+    return cap
+
+
+def _greedy_fill(amount: float, caps: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """Fill the grants in the given order, each up to its cap."""
+    ordered = caps[order]
+    before = np.cumsum(ordered) - ordered
+    filled = np.zeros_like(caps)
+    filled[order] = np.clip(amount - before, 0.0, ordered)
+    return filled
+
+
+def _plan(
+    strategy: str, amount: float, split: np.ndarray, grant_ids: List[UUID]
+) -> AllocationPlan:
+    used = np.flatnonzero(split >= MIN_ALLOCATION)
+    unallocated = max(amount - float(split[used].sum()), 0.0)
+    return AllocationPlan(
+        strategy=strategy,
+        feasible=unallocated < MIN_ALLOCATION,
+        allocations=[
+            GrantAllocation(grant_id=grant_ids[i], amount=float(split[i]))
+            for i in used
+        ],
+        unallocated_amount=unallocated,
+    )
+
+
+def plan_expense_allocation(
+    session: Session,
+    request: ExpenseAllocationRequest,
+    user_id: UUID,
+    is_superuser: bool,
+) -> AllocationPlansPublic:
+    """
+    Compute the ways a proposed expense can be split across the candidate
+    grants, within each grant's remaining balance, date window and expense
+    rules. Plans are ranked feasible first, then by how soon the money they
+    use expires, then by the number of grants they touch.
+    """
+    rows = session.exec(
+        _candidate_statement(request, user_id, is_superuser)
+    ).all()
+    if not rows:
+        return AllocationPlansPublic(data=[], count=0, excluded=[])
+    grant_ids = [row[0] for row in rows]
+    status = np.array([row[1] for row in rows])
+    start = np.array([row[2].timestamp() for row in rows])
+    end = np.array([row[3].timestamp() for row in rows])
+    available = np.array([row[4] for row in rows], dtype=float)
+    rule_cap, category_allowed = _rule_limits(session, grant_ids, request)
+
+    # Evaluate every constraint for every candidate at once
+    when = request.date.timestamp()
+    checks = [
+        (status == "active", "Grant is not active"),
+        ((start <= when) & (when <= end), "Expense date outside of grant period"),
+        (category_allowed, "Expense category is not allowed"),
+        (available > 0, "No remaining funds"),
+    ]
+    eligible = np.ones(len(grant_ids), dtype=bool)
+    excluded = []
+    for passed, reason in checks:
+        failed = np.flatnonzero(eligible & ~passed)
+        excluded += [
+            AllocationExclusion(grant_id=grant_ids[i], reason=reason) for i in failed
+        ]
+        eligible &= passed
+    caps = np.where(eligible, np.minimum(available, rule_cap), 0.0)
+
+    amount = request.amount
+    days_left = (end - when) / 86400.0
+    plans = [
+        _plan(
+            "soonest_expiring",
+            amount,
+            _greedy_fill(amount, caps, np.lexsort((-caps, end))),
+            grant_ids,
+        ),
+        _plan(
+            "largest_balance",
+            amount,
+            _greedy_fill(amount, caps, np.argsort(-caps, kind="stable")),
+            grant_ids,
+        ),
+    ]
+    if caps.sum() > 0:
+        proportional = np.minimum(amount * caps / caps.sum(), caps)
+        plans.append(_plan("proportional", amount, proportional, grant_ids))
+    for i in np.flatnonzero(caps >= amount):
+        single = np.zeros_like(caps)
+        single[i] = amount
+        plans.append(_plan("single_grant", amount, single, grant_ids))
+
+    # Drop duplicate splits, keeping the first strategy that produced them
+    unique = {}
+    for plan in plans:
+        key = tuple((a.grant_id, round(a.amount, 2)) for a in plan.allocations)
+        unique.setdefault(key, plan)
+    index = {grant_id: i for i, grant_id in enumerate(grant_ids)}
+
+    def rank(plan: AllocationPlan):
+        allocated = np.array([a.amount for a in plan.allocations])
+        expiry = np.array([days_left[index[a.grant_id]] for a in plan.allocations])
+        weighted = float(allocated @ expiry / allocated.sum()) if len(allocated) else 0
+        return (not plan.feasible, weighted, len(plan.allocations))
+
+    ranked = sorted(unique.values(), key=rank)
+    return AllocationPlansPublic(data=ranked, count=len(ranked), excluded=excluded)
+
+
+# End
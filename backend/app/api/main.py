@@ -2,14 +2,18 @@ from fastapi import APIRouter
 
 from app.api.routes import (
     grant_approvals,
+    grant_budgets,
     grant_categories,
+    grant_changes,
     grant_expenses,
+    grant_reservations,
     grant_roles,
     grants,
     login,
     private,
     projection,
     rules,
+    search,
     users,
     utils,
 )
@@ -23,9 +27,13 @@ api_router.include_router(grants.router)
 api_router.include_router(grant_categories.router)
 api_router.include_router(grant_expenses.router)
 api_router.include_router(grant_approvals.router)
+api_router.include_router(grant_reservations.router)
+api_router.include_router(grant_budgets.router)
+api_router.include_router(grant_changes.router)
 api_router.include_router(grant_roles.router)
 api_router.include_router(utils.router)
 api_router.include_router(projection.router)
+api_router.include_router(search.router)
 
 if settings.ENVIRONMENT == "local":
     api_router.include_router(private.router)
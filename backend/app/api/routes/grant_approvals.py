@@ -1,11 +1,11 @@
 from logging import getLogger
-from typing import Any
+from typing import Any, Optional
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException
 from psycopg.errors import DatabaseError
 from sqlalchemy.exc import DatabaseError as SQL_ERR
-from sqlmodel import func, select
+from sqlmodel import select
 
 from app.api.deps import CurrentUser, SessionDep
 from app.models import (
@@ -18,6 +18,7 @@ from app.models import (
     GrantExpensesPublic,
     GrantRole,
 )
+from app.pagination import CountMode, count_rows, page, paginate
 from app.permissions import GrantPermission, has_grant_permission
 
 router = APIRouter(prefix="/grant-approvals", tags=["Grant Approvals"])
@@ -30,11 +31,14 @@ def get_expenses_without_requests(
     current_user: CurrentUser,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> Any:
     """
     Returns a list of expenses that do not have any grant approval requests.
     Regular users can only see expenses for their grants, superusers can see all expenses.
+    Pass the returned next_cursor as `cursor` to get the next page.
     """
+    keys = [GrantExpense.created_at, GrantExpense.id]
 
     if current_user.is_superuser:
         statement = (
@@ -43,8 +47,6 @@ def get_expenses_without_requests(
                 GrantApproval, GrantExpense.id == GrantApproval.expense_id, isouter=True
             )
             .where(GrantApproval.id.is_(None))
-            .offset(skip)
-            .limit(limit)
         )
     else:
         # Subquery to find grant_ids where the user has the 'approve_expenses' permission
@@ -61,12 +63,13 @@ def get_expenses_without_requests(
             )
             .where(GrantExpense.grant_id.in_(subquery))
             .where(GrantApproval.id.is_(None))
-            .offset(skip)
-            .limit(limit)
         )
 
-    expenses = session.exec(statement).all()
-    return GrantExpensesPublic(data=expenses, count=len(expenses))
+    statement = paginate(statement, keys, skip, limit, cursor)
+    expenses, next_cursor = page(session.exec(statement).all(), keys, limit)
+    return GrantExpensesPublic(
+        data=expenses, count=len(expenses), next_cursor=next_cursor
+    )
 
 
 @router.get("/", response_model=GrantApprovalsPublic)
@@ -75,16 +78,19 @@ def read_grant_approvals(
     current_user: CurrentUser,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
 ) -> Any:
     """
     Returns a list of grant approvals. Regular users can only see approvals for
     the grants they have the GrantPermission.APPROVE_EXPENSES on,
-    superusers can see all approvals.
+    superusers can see all approvals. Pass the returned next_cursor as
+    `cursor` to get the next page.
     """
+    keys = [GrantApproval.created_at, GrantApproval.id]
 
     if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(GrantApproval)
-        statement = select(GrantApproval).offset(skip).limit(limit)
+        statement = select(GrantApproval)
     else:
         # Subquery to find grant_ids where the user has the 'APPROVE_EXPENSES' permission
         subquery = (
@@ -93,27 +99,18 @@ def read_grant_approvals(
             .where(GrantRole.permissions.any(GrantPermission.APPROVE_EXPENSES.value))
         )
 
-        # Count statement for approvals in allowed grants
-        count_statement = (
-            select(func.count())
-            .select_from(GrantApproval)
-            .join(GrantExpense, GrantApproval.expense_id == GrantExpense.id)
-            .where(GrantExpense.grant_id.in_(subquery))
-        )
-
         # Main query to select approvals belonging to those grants
         statement = (
             select(GrantApproval)
             .join(GrantExpense, GrantApproval.expense_id == GrantExpense.id)
             .where(GrantExpense.grant_id.in_(subquery))
-            .offset(skip)
-            .limit(limit)
         )
 
-    count = session.exec(count_statement).one()
-    approvals = session.exec(statement).all()
+    total = count_rows(session, statement, count)
+    statement = paginate(statement, keys, skip, limit, cursor)
+    approvals, next_cursor = page(session.exec(statement).all(), keys, limit)
 
-    return GrantApprovalsPublic(data=approvals, count=count)
+    return GrantApprovalsPublic(data=approvals, count=total, next_cursor=next_cursor)
 
 
 @router.post("/", response_model=GrantApprovalPublic)
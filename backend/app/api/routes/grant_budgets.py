@@ -0,0 +1,107 @@
+from logging import getLogger
+from typing import Any, List
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+
+from app.api.deps import CurrentUser, SessionDep
+from app.budgets import import_budget, iter_report, write_budget_report
+from app.models import (
+    Grant,
+    GrantBudgetImport,
+    GrantBudgetLine,
+    GrantBudgetLinesPublic,
+)
+from app.permissions import GrantPermission, has_grant_permission
+from app.rule_templates import RULE_TEMPLATES
+
+router = APIRouter(prefix="/grant-budgets", tags=["Grant Budgets"])
+logger = getLogger("uvicorn.error")
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@router.post("/import", response_model=GrantBudgetImport)
+def import_grant_budget(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    file: UploadFile,
+    templates: List[str] = Query(default=["max_grant_funding"]),
+) -> Any:
+    """
+    Create a grant from a budget in the UI-Budget-Template spreadsheet
+    format, with a budget line per line and year of the sheet and a rule
+    for each of the given rule templates.
+    """
+    unknown = [template for template in templates if template not in RULE_TEMPLATES]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown rule template: {unknown[0]}"
+        )
+
+    result = import_budget(session, file.file, current_user, templates)
+    session.commit()
+    return result
+
+
+@router.get("/{grant_id}", response_model=GrantBudgetLinesPublic)
+async def read_grant_budget(
+    *,
+    session: SessionDep,
+    grant_id: UUID,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Get the budget lines of a grant, by category and year.
+    """
+    permission = await has_grant_permission(
+        session,
+        grant_id=grant_id,
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    lines = session.exec(
+        select(GrantBudgetLine)
+        .where(GrantBudgetLine.grant_id == grant_id)
+        .order_by(GrantBudgetLine.category, GrantBudgetLine.period)
+    ).all()
+    return GrantBudgetLinesPublic(data=lines, count=len(lines))
+
+
+@router.get("/{grant_id}/export")
+async def export_grant_budget(
+    *,
+    session: SessionDep,
+    grant_id: UUID,
+    current_user: CurrentUser,
+) -> StreamingResponse:
+    """
+    Download a spreadsheet with the budgeted and actual amounts of a grant
+    per category and budget year.
+    """
+    permission = await has_grant_permission(
+        session,
+        grant_id=grant_id,
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    grant = session.get(Grant, grant_id)
+    if not grant:
+        raise HTTPException(status_code=404, detail="Grant not found")
+
+    report = write_budget_report(session, grant)
+    return StreamingResponse(
+        iter_report(report),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": 'attachment; filename="UI-Budget-Report.xlsx"'
+        },
+    )
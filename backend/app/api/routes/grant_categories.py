@@ -1,18 +1,19 @@
 from logging import getLogger
-from typing import Any
+from typing import Any, Optional
 
 from fastapi import APIRouter, HTTPException
 from psycopg.errors import DatabaseError
 from sqlalchemy.exc import DatabaseError as SQL_ERR
-from sqlmodel import func, select
 
 from app.api.deps import CurrentSuperUser, SessionDep
+from app.categories import category_registry
 from app.models import (
     GrantCategoriesPublic,
     GrantCategory,
     GrantCategoryBase,
     GrantCategoryPublic,
 )
+from app.pagination import CountMode, decode_cursor, encode_cursor
 
 router = APIRouter(prefix="/grant-categories", tags=["Grant Categories"])
 logger = getLogger("uvicorn.error")
@@ -23,17 +24,30 @@ def read_grant_categories(
     session: SessionDep,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
 ) -> Any:
     """
-    Returns a list of all grant categories.
+    Returns a list of all grant categories, ordered by code. Pass the
+    returned next_cursor as `cursor` to get the next page. The categories
+    are served from the category registry.
     """
-    count_statement = select(func.count()).select_from(GrantCategory)
-    count = session.exec(count_statement).one()
+    categories = category_registry.all(session)
+    total = None if count == CountMode.NONE else len(categories)
 
-    statement = select(GrantCategory).offset(skip).limit(limit)
-    categories = session.exec(statement).all()
+    if cursor is not None:
+        (after,) = decode_cursor(cursor, [GrantCategory.code])
+        categories = [category for category in categories if category.code > after]
+    else:
+        categories = categories[skip:]
+    next_cursor = None
+    if len(categories) > limit:
+        categories = categories[:limit]
+        next_cursor = encode_cursor([categories[-1].code])
 
-    return GrantCategoriesPublic(data=categories, count=count)
+    return GrantCategoriesPublic(
+        data=categories, count=total, next_cursor=next_cursor
+    )
 
 
 @router.post("/", response_model=GrantCategoryPublic)
@@ -51,6 +65,7 @@ def create_grant_category(
         session.add(category)
         session.commit()
         session.refresh(category)
+        category_registry.invalidate()
     except SQL_ERR as e:
         driver = e.orig
         if isinstance(driver, DatabaseError):
@@ -101,6 +116,7 @@ def update_grant_category(
         session.add(category)
         session.commit()
         session.refresh(category)
+        category_registry.invalidate()
     except SQL_ERR as e:
         driver = e.orig
         if isinstance(driver, DatabaseError):
@@ -128,4 +144,5 @@ def delete_grant_category(
         raise HTTPException(status_code=404, detail="Grant category not found")
     session.delete(category)
     session.commit()
+    category_registry.invalidate()
     return {"message": "Grant category deleted successfully"}
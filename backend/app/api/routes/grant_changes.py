@@ -0,0 +1,142 @@
+import asyncio
+from typing import AsyncIterator, List, Optional, Set
+from uuid import UUID
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+
+from app.api.deps import CurrentUser, SessionDep
+from app.changes import Subscription, change_broker, read_changes
+from app.models import GrantChangePublic, GrantChangesPublic, User
+from app.permissions import GrantPermission, GrantRole
+
+router = APIRouter(prefix="/grant-changes", tags=["Grant Changes"])
+
+# Changes replayed to a reconnecting stream before it is told to reload
+CATCH_UP_LIMIT = 1000
+# Comment lines keep idle streams open through proxies
+HEARTBEAT_SECONDS = 15.0
+
+
+def _viewable_grants(
+    session: SessionDep, user: User, grant_ids: List[UUID]
+) -> Optional[Set[UUID]]:
+    """
+    The grants to follow: the requested ones, or every grant the user has
+    the GrantPermission.VIEW_EXPENSES on. None follows every grant, which
+    only superusers do.
+    """
+    if user.is_superuser:
+        return set(grant_ids) or None
+    viewable = set(
+        session.exec(
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        ).all()
+    )
+    if not grant_ids:
+        return viewable
+    if not viewable.issuperset(grant_ids):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return set(grant_ids)
+
+
+def _event(change: GrantChangePublic) -> str:
+    return (
+        f"id: {change.cursor}\n"
+        f"event: {change.entity.value}\n"
+        f"data: {change.model_dump_json()}\n\n"
+    )
+
+
+@router.get("/", response_model=GrantChangesPublic)
+def read_grant_changes(
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: List[UUID] = Query(default=[]),
+    after: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=CATCH_UP_LIMIT),
+) -> GrantChangesPublic:
+    """
+    Return the expense and approval changes logged after the change cursor
+    `after`, of the given grants or of every grant the user can view,
+    in commit order. Changes are kept for a week.
+    """
+    grant_ids = _viewable_grants(session, current_user, grant_id)
+    changes = read_changes(session, after, grant_ids, limit)
+    return GrantChangesPublic(
+        data=changes,
+        count=len(changes),
+        last_cursor=changes[-1].cursor if changes else None,
+    )
+
+
+async def _stream(
+    request: Request,
+    subscription: Subscription,
+    backlog: List[GrantChangePublic],
+    reset: bool,
+) -> AsyncIterator[str]:
+    try:
+        if reset:
+            # Too much was missed, the client reloads instead of catching up
+            yield "event: reset\ndata: {}\n\n"
+            return
+        for change in backlog:
+            yield _event(change)
+        replayed = {change.id for change in backlog}
+        while not await request.is_disconnected():
+            if subscription.overflowed:
+                yield "event: reset\ndata: {}\n\n"
+                return
+            try:
+                change = await asyncio.wait_for(
+                    subscription.queue.get(), HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if change.id not in replayed:
+                yield _event(change)
+    finally:
+        change_broker.unsubscribe(subscription)
+
+
+@router.get("/stream")
+async def stream_grant_changes(
+    request: Request,
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: List[UUID] = Query(default=[]),
+    last_event_id: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    """
+    Stream the expense and approval changes of the given grants, or of every
+    grant the user can view, as Server-Sent Events. Each event is named after
+    the changed record ("expense" or "approval") and carries the change,
+    clients fetch the record itself. A reconnecting EventSource sends the
+    Last-Event-ID header and first gets the changes it missed; a "reset"
+    event tells it to reload its lists instead. The grants are resolved
+    when the stream opens.
+    """
+    grant_ids = _viewable_grants(session, current_user, grant_id)
+    # Subscribed before reading the backlog, so no change falls in between
+    subscription = change_broker.subscribe(grant_ids)
+    backlog: List[GrantChangePublic] = []
+    reset = False
+    if last_event_id is not None:
+        try:
+            backlog = read_changes(
+                session, last_event_id, grant_ids, CATCH_UP_LIMIT + 1
+            )
+        except Exception:
+            change_broker.unsubscribe(subscription)
+            raise
+        reset = len(backlog) > CATCH_UP_LIMIT
+    return StreamingResponse(
+        _stream(request, subscription, backlog, reset),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
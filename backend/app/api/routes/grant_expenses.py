@@ -1,45 +1,249 @@
+from datetime import datetime
+from enum import Enum
 from logging import getLogger
-from typing import Any
+from typing import Any, List, Optional
+from uuid import UUID
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
 from psycopg.errors import DatabaseError
+from sqlalchemy import exists, insert, literal, true
 from sqlalchemy.exc import DatabaseError as SQL_ERR
 from sqlalchemy.exc import DBAPIError
-from sqlmodel import func, select
+from sqlmodel import delete, func, select, update
 
 from app.api.deps import CurrentSuperUser, CurrentUser, SessionDep
+from app.categories import category_registry
+from app.expense_import import create_expenses, import_expenses
+from app.expense_partitions import (
+    detach_expense_partition,
+    list_expense_partitions,
+    maintain_expense_partitions,
+)
+from app.exports import MEDIA_TYPES, export_statement, stream_export
+from app.ledger import (
+    DRIFT_TOLERANCE,
+    available_balance,
+    available_statement,
+    lock_grants,
+)
 from app.models import (
+    ApprovalStatus,
+    ExpenseExportFormat,
+    ExpenseImportFormat,
+    ExpenseImportReport,
+    ExpenseStatus,
     Grant,
-    GrantCategory,
+    GrantApproval,
+    GrantBalance,
     GrantExpense,
+    GrantExpenseAllocation,
+    GrantExpenseAllocationCreate,
+    GrantExpenseAllocationsPublic,
     GrantExpenseBase,
+    GrantExpenseBatch,
+    GrantExpenseBatchResult,
+    GrantExpenseCreate,
+    GrantExpensePartitionsPublic,
     GrantExpensePublic,
     GrantExpensesPublic,
+    GrantReservation,
 )
+from app.pagination import CountMode, count_rows, page, paginate
 from app.permissions import GrantPermission, GrantRole, has_grant_permission
+from app.reservations import expire_reservations
+from app.utils import get_utc_now
 
 router = APIRouter(prefix="/grant-expenses", tags=["Grant Expenses"])
 logger = getLogger("uvicorn.error")
 
+# Allocations may only exceed their expense by rounding
+ALLOCATION_TOLERANCE = 0.005
+
+
+class ExpenseSort(str, Enum):
+    """Columns the expense list can be sorted by."""
+
+    CREATED_AT = "created_at"
+    DATE = "date"
+    AMOUNT = "amount"
+
+
+# Keyset of every sort, the id breaks ties between equal values
+SORT_KEYS = {
+    ExpenseSort.CREATED_AT: [GrantExpense.created_at, GrantExpense.id],
+    ExpenseSort.DATE: [GrantExpense.date, GrantExpense.id],
+    ExpenseSort.AMOUNT: [GrantExpense.amount, GrantExpense.id],
+}
+
+
+async def _build_allocations(
+    session: SessionDep,
+    expense: GrantExpense,
+    allocations_in: List[GrantExpenseAllocationCreate],
+    current_user: CurrentUser,
+) -> List[GrantExpenseAllocation]:
+    """
+    Validate the allocations of an expense and resolve percentages to amounts.
+    The user needs the GrantPermission.SUBMIT_EXPENSES on every grant the
+    expense is allocated to.
+    """
+    allocations = []
+    seen = set()
+    for allocation_in in allocations_in:
+        if (allocation_in.amount is None) == (allocation_in.percentage is None):
+            raise HTTPException(
+                status_code=400,
+                detail="Allocation needs either an amount or a percentage",
+            )
+        if allocation_in.grant_id == expense.grant_id:
+            raise HTTPException(
+                status_code=400,
+                detail="Expense cannot be allocated to its own grant",
+            )
+        if allocation_in.grant_id in seen:
+            raise HTTPException(
+                status_code=400, detail="Grant is allocated more than once"
+            )
+        seen.add(allocation_in.grant_id)
+
+        if not session.get(Grant, allocation_in.grant_id):
+            raise HTTPException(status_code=404, detail="Grant not found")
+        permission = await has_grant_permission(
+            session,
+            grant_id=allocation_in.grant_id,
+            permission=GrantPermission.SUBMIT_EXPENSES,
+            user_id=current_user.id,
+        )
+        if not permission:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+
+        amount = allocation_in.amount
+        if allocation_in.percentage is not None:
+            amount = expense.amount * allocation_in.percentage / 100
+        allocations.append(
+            GrantExpenseAllocation(
+                expense_id=expense.id,
+                grant_id=allocation_in.grant_id,
+                amount=amount,
+                percentage=allocation_in.percentage,
+            )
+        )
+    _check_allocated(expense, allocations)
+    return allocations
+
+
+def _check_allocated(
+    expense: GrantExpense, allocations: List[GrantExpenseAllocation]
+) -> None:
+    if sum(a.amount for a in allocations) > expense.amount + ALLOCATION_TOLERANCE:
+        raise HTTPException(
+            status_code=400, detail="Allocations exceed the expense amount"
+        )
+
+
+def _insert_expense(
+    session: SessionDep,
+    expense: GrantExpense,
+    charged: float,
+    current_user: CurrentUser,
+) -> GrantExpense:
+    """
+    Insert an expense with a single INSERT ... SELECT ... RETURNING that also
+    checks its grant exists, the user has the GrantPermission.SUBMIT_EXPENSES
+    on it and the `charged` part of the expense is available on it, after
+    the held reservations. Nothing is inserted when a check fails, the
+    checks returned with the result tell which one did. The category is
+    checked against the registry beforehand, the caller holds the grant's
+    lock so the balance cannot change before the commit.
+    """
+    table = GrantExpense.__table__
+    if current_user.is_superuser:
+        permitted = literal(True)
+    else:
+        permitted = (
+            exists()
+            .where(GrantRole.grant_id == expense.grant_id)
+            .where(GrantRole.user_id == current_user.id)
+            .where(GrantRole.permissions.any(GrantPermission.SUBMIT_EXPENSES.value))
+        )
+    checks = select(
+        exists().where(Grant.id == expense.grant_id).label("grant_found"),
+        permitted.label("permitted"),
+        available_statement(expense.grant_id).scalar_subquery().label("available"),
+    ).cte("checks")
+    values = select(
+        *(
+            literal(getattr(expense, column.name), column.type).label(column.name)
+            for column in table.columns
+        )
+    ).where(
+        checks.c.grant_found,
+        checks.c.permitted,
+        checks.c.available + DRIFT_TOLERANCE >= charged,
+    )
+    inserted = (
+        insert(table)
+        .from_select([column.name for column in table.columns], values)
+        .returning(*table.columns)
+        .cte("inserted")
+    )
+    row = session.exec(
+        select(checks, inserted).select_from(checks.outerjoin(inserted, true()))
+    ).one()
+
+    if not row.grant_found:
+        raise HTTPException(status_code=404, detail="Grant not found")
+    if not row.permitted:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if row.available + DRIFT_TOLERANCE < charged:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Insufficient funds, {row.available:.2f} available",
+        )
+    return GrantExpense(
+        **{column.name: row._mapping[column.name] for column in table.columns}
+    )
+
 
 @router.get("/", response_model=GrantExpensesPublic)
 async def read_grant_expenses(
     session: SessionDep,
     current_user: CurrentUser,
+    grant_id: Optional[UUID] = None,
+    category: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    created_by: Optional[UUID] = None,
+    status: Optional[ExpenseStatus] = None,
+    sort: ExpenseSort = ExpenseSort.CREATED_AT,
+    descending: bool = False,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
 ) -> Any:
     """
     Returns a list of grant expenses. Regular users can only see expenses for the grants,
     that they have the GrantPermission.VIEW_EXPENSES on, while
-    superusers can see all expenses.
+    superusers can see all expenses. The dates are inclusive, the status
+    of an expense is pending until it is approved or rejected. Pass the
+    returned next_cursor as `cursor` with the same filters and sort to get
+    the next page. Without filters an estimated count sums the expense
+    counters of the grant ledgers.
     """
-    count_statement: Any  # Define type hint for count_statement
     statement: Any  # Define type hint for statement
+    keys = SORT_KEYS[sort]
+    estimate_statement: Optional[Any] = select(
+        func.sum(GrantBalance.expense_count)
+    )
 
     if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(GrantExpense)
-        statement = select(GrantExpense).offset(skip).limit(limit)
+        statement = select(GrantExpense)
     else:
         # Subquery to find grant_ids where the user has the 'VIEW_EXPENSES' permission
         subquery = (
@@ -50,68 +254,113 @@ async def read_grant_expenses(
             )  # Use enum value
         )
 
-        # Count statement for expenses in allowed grants
-        count_statement = (
-            select(func.count())
-            .select_from(GrantExpense)
-            .where(GrantExpense.grant_id.in_(subquery))
+        # Main query to select expenses belonging to those grants
+        statement = select(GrantExpense).where(GrantExpense.grant_id.in_(subquery))
+        estimate_statement = estimate_statement.where(
+            GrantBalance.grant_id.in_(subquery)
         )
 
-        # Main query to select expenses belonging to those grants
-        statement = (
-            select(GrantExpense)
-            .where(GrantExpense.grant_id.in_(subquery))
-            .offset(skip)
-            .limit(limit)
+    if grant_id is not None:
+        statement = statement.where(GrantExpense.grant_id == grant_id)
+        estimate_statement = estimate_statement.where(
+            GrantBalance.grant_id == grant_id
+        )
+    filters = []
+    if category is not None:
+        filters.append(GrantExpense.category == category)
+    if date_from is not None:
+        filters.append(GrantExpense.date >= date_from)
+    if date_to is not None:
+        filters.append(GrantExpense.date <= date_to)
+    if created_from is not None:
+        filters.append(GrantExpense.created_at >= created_from)
+    if created_to is not None:
+        filters.append(GrantExpense.created_at <= created_to)
+    if amount_min is not None:
+        filters.append(GrantExpense.amount >= amount_min)
+    if amount_max is not None:
+        filters.append(GrantExpense.amount <= amount_max)
+    if created_by is not None:
+        filters.append(GrantExpense.created_by == created_by)
+    if status == ExpenseStatus.PENDING:
+        reviewed = select(GrantApproval.expense_id).where(
+            GrantApproval.expense_id == GrantExpense.id
+        )
+        filters.append(~reviewed.exists())
+    elif status is not None:
+        reviewed = (
+            select(GrantApproval.expense_id)
+            .where(GrantApproval.expense_id == GrantExpense.id)
+            .where(GrantApproval.status == ApprovalStatus[status.name])
         )
+        filters.append(reviewed.exists())
+    if filters:
+        statement = statement.where(*filters)
+        # The ledger counters only count whole grants
+        estimate_statement = None
 
-    count = session.exec(count_statement).one()
-    expenses = session.exec(statement).all()
+    total = count_rows(session, statement, count, estimate_statement)
+    statement = paginate(statement, keys, skip, limit, cursor, descending)
+    expenses, next_cursor = page(session.exec(statement).all(), keys, limit)
 
-    return GrantExpensesPublic(data=expenses, count=count)
+    return GrantExpensesPublic(data=expenses, count=total, next_cursor=next_cursor)
 
 
 @router.post("/", response_model=GrantExpensePublic)
 async def create_grant_expense(
     *,
     session: SessionDep,
-    grant_expense: GrantExpenseBase,
+    grant_expense: GrantExpenseCreate,
     current_user: CurrentUser,
 ) -> Any:
     """
-    Create a new grant expense.
+    Create a new grant expense, optionally split across other grants by its
+    allocations. The expense's own grant is charged the rest. Every grant
+    charged must have its part available after the held reservations, like
+    a reservation would. Without allocations the expense is checked and
+    inserted by one statement once its grant is locked.
     """
-    # Verify that the user has access to the grant
-    grant = session.get(Grant, grant_expense.grant_id)
-    if not grant:
-        raise HTTPException(status_code=404, detail="Grant not found")
+    # Checked against the registry, without a query unless the code is new
+    if not category_registry.get(session, grant_expense.category):
+        raise HTTPException(status_code=400, detail="Invalid expense category")
 
-    # Check if user has permission to submit expenses
-    permission = await has_grant_permission(
-        session,
-        grant_id=grant_expense.grant_id,
-        permission=GrantPermission.SUBMIT_EXPENSES,
-        user_id=current_user.id,
+    expense = GrantExpense(
+        created_by=current_user.id,
+        **grant_expense.model_dump(exclude={"allocations"}),
     )
-
-    if not permission:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
-    # Create the expense
-    expense = GrantExpense(created_by=current_user.id, **grant_expense.model_dump())
-
-    # Ensure the the category is valid
-    category = session.exec(
-        select(GrantCategory).where(GrantCategory.code == grant_expense.category)
-    ).first()
-    if not category:
-        raise HTTPException(status_code=400, detail="Invalid expense category")
+    allocations = []
+    if grant_expense.allocations:
+        allocations = await _build_allocations(
+            session, expense, grant_expense.allocations, current_user
+        )
 
     # Invalid Rules will be caught by the trigger, and expense will not be created
     try:
-        session.add(expense)
+        # Locked in order before the balances are read, the triggers would
+        # lock the grants in insertion order
+        grant_ids = [expense.grant_id, *(a.grant_id for a in allocations)]
+        lock_grants(session, grant_ids)
+        expire_reservations(session, grant_ids)
+        for allocation in allocations:
+            available = available_balance(session, allocation.grant_id) or 0.0
+            if allocation.amount > available + DRIFT_TOLERANCE:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Insufficient funds, {available:.2f} available",
+                )
+        charged = expense.amount - sum(a.amount for a in allocations)
+        expense = _insert_expense(session, expense, charged, current_user)
+        if allocations:
+            session.add_all(allocations)
+            session.flush()
+            # Run the rule triggers again now that the allocations are in place
+            expense.updated_at = get_utc_now()
+            session.exec(
+                update(GrantExpense)
+                .where(GrantExpense.id == expense.id)
+                .values(updated_at=expense.updated_at)
+            )
         session.commit()
-        session.refresh(expense)
     except SQL_ERR as e:
         driver = e.orig
         if isinstance(driver, DatabaseError):
@@ -155,6 +404,160 @@ async def create_grant_expense(
     return expense
 
 
+@router.post("/batch", response_model=GrantExpenseBatchResult)
+def create_grant_expenses(
+    *,
+    session: SessionDep,
+    batch: GrantExpenseBatch,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Create many grant expenses in one request. Every item gets its own
+    result, the created expense or why it was rejected, e.g. the rule it
+    breaks. With `atomic` nothing is created unless every item is valid.
+    """
+    result = create_expenses(session, batch, current_user)
+    session.commit()
+    return result
+
+
+@router.post("/import", response_model=ExpenseImportReport)
+def import_grant_expenses(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    file: UploadFile,
+    format: ExpenseImportFormat = ExpenseImportFormat.CSV,
+) -> Any:
+    """
+    Import a CSV (with a header row) or NDJSON file of expenses with the
+    GrantExpenseBase fields. Accepted rows are created together, the others
+    are reported by their line in the file with the reason they were
+    rejected.
+    """
+    report = import_expenses(session, file.file, format, current_user)
+    session.commit()
+    return report
+
+
+@router.get("/export")
+async def export_grant_expenses(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: Optional[UUID] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    format: ExpenseExportFormat = ExpenseExportFormat.CSV,
+) -> StreamingResponse:
+    """
+    Stream every expense the user can see (of one grant) as CSV, NDJSON,
+    an Arrow IPC stream or Parquet, oldest first. Rows are read from a
+    server-side cursor, so the export runs in constant memory however many
+    expenses there are. The Arrow and Parquet exports add the category name
+    and approval status of every expense. The dates are inclusive, a
+    created_at window exports the expenses entered since the last export.
+    """
+    if grant_id is not None:
+        permission = await has_grant_permission(
+            session,
+            grant_id=grant_id,
+            permission=GrantPermission.VIEW_EXPENSES,
+            user_id=current_user.id,
+        )
+        if not permission:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    statement = export_statement(
+        current_user,
+        grant_id,
+        format,
+        date_from=date_from,
+        date_to=date_to,
+        created_from=created_from,
+        created_to=created_to,
+    )
+    return StreamingResponse(
+        stream_export(session.get_bind(), statement, format),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="expenses.{format.value}"'
+        },
+    )
+
+
+@router.get("/partitions", response_model=GrantExpensePartitionsPublic)
+def read_grant_expense_partitions(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+) -> Any:
+    """
+    List the yearly partitions of the expenses and the default partition
+    holding expenses of years without a partition.
+    """
+    partitions = list_expense_partitions(session)
+    return GrantExpensePartitionsPublic(data=partitions, count=len(partitions))
+
+
+@router.post("/partitions/maintain", response_model=GrantExpensePartitionsPublic)
+def maintain_grant_expense_partitions(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+    years_ahead: int = 1,
+) -> Any:
+    """
+    Create the partitions of the coming years now, and of the years whose
+    expenses are in the default partition, instead of waiting for the
+    background maintenance.
+    """
+    maintain_expense_partitions(session, years_ahead)
+    session.commit()
+    partitions = list_expense_partitions(session)
+    return GrantExpensePartitionsPublic(data=partitions, count=len(partitions))
+
+
+@router.post("/partitions/{year}/detach")
+def detach_grant_expense_partition(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+    year: int,
+) -> Any:
+    """
+    Detach the expenses of a closed year into an archive table. The
+    expenses no longer show anywhere, the balances of their grants keep
+    them. A year counting towards an active budget rule cannot be detached.
+    """
+    try:
+        archive = detach_expense_partition(session, year)
+    except SQL_ERR as e:
+        driver = e.orig
+        if isinstance(driver, DatabaseError):
+            logger.error(driver)
+            raise HTTPException(
+                status_code=409,
+                detail=driver.diag.message_primary,
+                headers={
+                    "pg_code": driver.sqlstate if driver.sqlstate else "00000",
+                    "detail": driver.diag.message_detail
+                    if driver.diag.message_detail
+                    else "",
+                    "primary": driver.diag.message_primary
+                    if driver.diag.message_primary
+                    else "",
+                    "hint": driver.diag.message_hint
+                    if driver.diag.message_hint
+                    else "",
+                },
+            )
+        raise
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Partition not found")
+    session.commit()
+    return {"message": f"Expenses of {year} detached into {archive}"}
+
+
 @router.get("/{expense_id}", response_model=GrantExpensePublic)
 async def read_grant_expense(
     *,
@@ -207,10 +610,38 @@ async def update_grant_expense(
     if not permission:
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
+    allocations = session.exec(
+        select(GrantExpenseAllocation).where(
+            GrantExpenseAllocation.expense_id == expense.id
+        )
+    ).all()
+    # Locked before the expense changes, so no flush writes ahead of the locks
+    lock_grants(
+        session,
+        [
+            expense.grant_id,
+            expense_in.grant_id,
+            *(allocation.grant_id for allocation in allocations),
+        ],
+    )
+
     expense_data = expense_in.model_dump(exclude_unset=True)
     for key, value in expense_data.items():
         setattr(expense, key, value)
 
+    # Allocations given as a percentage follow the expense amount
+    for allocation in allocations:
+        if allocation.grant_id == expense.grant_id:
+            raise HTTPException(
+                status_code=400,
+                detail="Expense cannot be allocated to its own grant",
+            )
+        if allocation.percentage is not None:
+            allocation.amount = expense.amount * allocation.percentage / 100
+            allocation.updated_at = get_utc_now()
+            session.add(allocation)
+    _check_allocated(expense, allocations)
+
     # Invalid Rules will be caught by the trigger, and expense will not be updated
     try:
         session.add(expense)
@@ -251,6 +682,121 @@ async def delete_grant_expense(
     if not permission:
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
+    allocated = session.exec(
+        select(GrantExpenseAllocation.grant_id).where(
+            GrantExpenseAllocation.expense_id == expense.id
+        )
+    ).all()
+    lock_grants(session, [expense.grant_id, *allocated])
+    session.exec(
+        delete(GrantExpenseAllocation).where(
+            GrantExpenseAllocation.expense_id == expense.id
+        )
+    )
+    # A finalized reservation outlives the expense it was turned into
+    session.exec(
+        update(GrantReservation)
+        .where(GrantReservation.expense_id == expense.id)
+        .values(expense_id=None)
+    )
     session.delete(expense)
     session.commit()
     return {"message": "Grant expense deleted successfully"}
+
+
+@router.get("/{expense_id}/allocations", response_model=GrantExpenseAllocationsPublic)
+async def read_grant_expense_allocations(
+    *,
+    session: SessionDep,
+    expense_id: str,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Get the allocations of a grant expense.
+    """
+    expense = session.get(GrantExpense, expense_id)
+    if not expense:
+        raise HTTPException(status_code=404, detail="Grant expense not found")
+
+    # Verify that the user has access to the grant
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=expense.grant_id,
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    allocations = session.exec(
+        select(GrantExpenseAllocation)
+        .where(GrantExpenseAllocation.expense_id == expense.id)
+        .order_by(GrantExpenseAllocation.created_at)
+    ).all()
+    return GrantExpenseAllocationsPublic(data=allocations, count=len(allocations))
+
+
+@router.put("/{expense_id}/allocations", response_model=GrantExpenseAllocationsPublic)
+async def update_grant_expense_allocations(
+    *,
+    session: SessionDep,
+    expense_id: str,
+    allocations_in: List[GrantExpenseAllocationCreate],
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Replace the allocations of a grant expense, an empty list charges the
+    whole expense to its own grant again.
+    """
+    expense = session.get(GrantExpense, expense_id)
+    if not expense:
+        raise HTTPException(status_code=404, detail="Grant expense not found")
+
+    # Verify that the user has access to the grant
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=expense.grant_id,
+        permission=GrantPermission.EDIT_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    allocations = await _build_allocations(
+        session, expense, allocations_in, current_user
+    )
+
+    allocated = session.exec(
+        select(GrantExpenseAllocation.grant_id).where(
+            GrantExpenseAllocation.expense_id == expense.id
+        )
+    ).all()
+
+    # Invalid Rules will be caught by the trigger, and allocations will not change
+    try:
+        lock_grants(
+            session,
+            [expense.grant_id, *allocated, *(a.grant_id for a in allocations)],
+        )
+        session.exec(
+            delete(GrantExpenseAllocation).where(
+                GrantExpenseAllocation.expense_id == expense.id
+            )
+        )
+        session.add_all(allocations)
+        session.flush()
+        expense.updated_at = get_utc_now()
+        session.add(expense)
+        session.commit()
+    except SQL_ERR as e:
+        driver = e.orig
+        if isinstance(driver, DatabaseError):
+            logger.error(driver)
+            raise HTTPException(
+                status_code=409,
+                detail=driver.diag.message_primary,
+                headers={"pg_code": driver.sqlstate},
+            )
+    for allocation in allocations:
+        session.refresh(allocation)
+    return GrantExpenseAllocationsPublic(data=allocations, count=len(allocations))
@@ -0,0 +1,208 @@
+from logging import getLogger
+from typing import Any, Optional
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException
+from psycopg.errors import DatabaseError
+from sqlalchemy.exc import DatabaseError as SQL_ERR
+from sqlmodel import select
+
+from app.api.deps import CurrentSuperUser, CurrentUser, SessionDep
+from app.models import (
+    GrantExpensePublic,
+    GrantReservation,
+    GrantReservationCreate,
+    GrantReservationFinalize,
+    GrantReservationPublic,
+    GrantReservationsPublic,
+    Message,
+    ReservationStatus,
+)
+from app.pagination import CountMode, count_rows, page, paginate
+from app.permissions import GrantPermission, GrantRole, has_grant_permission
+from app.reservations import (
+    expire_reservations,
+    finalize_reservation,
+    place_reservation,
+    release_reservation,
+)
+
+router = APIRouter(prefix="/grant-reservations", tags=["Grant Reservations"])
+logger = getLogger("uvicorn.error")
+
+
+@router.get("/", response_model=GrantReservationsPublic)
+def read_grant_reservations(
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: Optional[UUID] = None,
+    status: Optional[ReservationStatus] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
+) -> Any:
+    """
+    Returns a list of reservations. Regular users can only see reservations
+    for the grants they have the GrantPermission.VIEW_EXPENSES on, while
+    superusers can see all reservations. Pass the returned next_cursor as
+    `cursor` to get the next page.
+    """
+    statement = select(GrantReservation)
+    if not current_user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == current_user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(GrantReservation.grant_id.in_(subquery))
+    if grant_id is not None:
+        statement = statement.where(GrantReservation.grant_id == grant_id)
+    if status is not None:
+        statement = statement.where(GrantReservation.status == status)
+
+    total = count_rows(session, statement, count)
+    keys = [GrantReservation.created_at, GrantReservation.id]
+    statement = paginate(statement, keys, skip, limit, cursor)
+    reservations, next_cursor = page(session.exec(statement).all(), keys, limit)
+    return GrantReservationsPublic(
+        data=reservations, count=total, next_cursor=next_cursor
+    )
+
+
+@router.post("/", response_model=GrantReservationPublic)
+async def create_grant_reservation(
+    *,
+    session: SessionDep,
+    reservation_in: GrantReservationCreate,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Hold funds on a grant before the expense is made, so the same money
+    cannot be committed twice.
+    """
+    permission = await has_grant_permission(
+        session,
+        grant_id=reservation_in.grant_id,
+        permission=GrantPermission.SUBMIT_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    reservation = place_reservation(session, reservation_in, current_user.id)
+    session.commit()
+    session.refresh(reservation)
+    return reservation
+
+
+@router.post("/expire", response_model=Message)
+def expire_grant_reservations(
+    session: SessionDep, current_user: CurrentSuperUser
+) -> Message:
+    """
+    Release every held reservation past its expiry.
+    """
+    count = expire_reservations(session)
+    session.commit()
+    return Message(message=f"Expired {count} reservations")
+
+
+@router.get("/{reservation_id}", response_model=GrantReservationPublic)
+async def read_grant_reservation(
+    *,
+    session: SessionDep,
+    reservation_id: str,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Get a reservation by ID.
+    """
+    reservation = session.get(GrantReservation, reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=reservation.grant_id,
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return reservation
+
+
+@router.post("/{reservation_id}/finalize", response_model=GrantExpensePublic)
+async def finalize_grant_reservation(
+    *,
+    session: SessionDep,
+    reservation_id: str,
+    finalize_in: GrantReservationFinalize,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Turn a held reservation into an expense on its grant.
+    """
+    reservation = session.get(GrantReservation, reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=reservation.grant_id,
+        permission=GrantPermission.SUBMIT_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    # Invalid Rules will be caught by the trigger, and the reservation is kept
+    try:
+        expense = finalize_reservation(
+            session, reservation, finalize_in, current_user.id
+        )
+        session.commit()
+        session.refresh(expense)
+    except SQL_ERR as e:
+        driver = e.orig
+        if isinstance(driver, DatabaseError):
+            logger.error(driver)
+            raise HTTPException(
+                status_code=409,
+                detail=driver.diag.message_primary,
+                headers={"pg_code": driver.sqlstate},
+            )
+        raise
+    return expense
+
+
+@router.post("/{reservation_id}/release", response_model=GrantReservationPublic)
+async def release_grant_reservation(
+    *,
+    session: SessionDep,
+    reservation_id: str,
+    current_user: CurrentUser,
+) -> Any:
+    """
+    Release a held reservation, its creator or anyone with the
+    GrantPermission.EDIT_EXPENSES on the grant can release it.
+    """
+    reservation = session.get(GrantReservation, reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    if reservation.created_by != current_user.id:
+        permission = await has_grant_permission(
+            session=session,
+            grant_id=reservation.grant_id,
+            permission=GrantPermission.EDIT_EXPENSES,
+            user_id=current_user.id,
+        )
+        if not permission:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    release_reservation(session, reservation)
+    session.commit()
+    session.refresh(reservation)
+    return reservation
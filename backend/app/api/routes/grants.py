@@ -1,12 +1,12 @@
 import asyncio
 from logging import getLogger
-from typing import Any
+from typing import Any, Optional
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException
 from psycopg.errors import DatabaseError
 from sqlalchemy.exc import DatabaseError as SQL_ERR
-from sqlmodel import func, select
+from sqlmodel import select
 
 from app.api.deps import (
     CurrentUser,
@@ -22,6 +22,7 @@ from app.models import (
     GrantsPublic,
     GrantUpdate,  # Import the new model
 )
+from app.pagination import CountMode, count_rows, page, paginate
 from app.permissions import DEFAULT_ROLE_PERMISSIONS, has_grant_permission
 
 router = APIRouter(prefix="/grants", tags=["Grants"])
@@ -34,31 +35,24 @@ def read_grants(
     current_user: CurrentUser,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
 ) -> Any:
     """
     Returns a list of grants. Regular users can only see the grants they own or have access to,
-    superusers can see all grants.
+    superusers can see all grants. Pass the returned next_cursor as `cursor`
+    to get the next page.
     """
-    if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(Grant)
-        statement = select(Grant).offset(skip).limit(limit)
-    else:
-        count_statement = (
-            select(func.count())
-            .select_from(Grant)
-            .where(Grant.owner_id == current_user.id)
-        )
-        statement = (
-            select(Grant)
-            .where(Grant.owner_id == current_user.id)
-            .offset(skip)
-            .limit(limit)
-        )
+    keys = [Grant.created_at, Grant.id]
+    statement = select(Grant)
+    if not current_user.is_superuser:
+        statement = statement.where(Grant.owner_id == current_user.id)
 
-    count = session.exec(count_statement).one()
-    grants = session.exec(statement).all()
+    total = count_rows(session, statement, count)
+    statement = paginate(statement, keys, skip, limit, cursor)
+    grants, next_cursor = page(session.exec(statement).all(), keys, limit)
 
-    return GrantsPublic(data=grants, count=count)
+    return GrantsPublic(data=grants, count=total, next_cursor=next_cursor)
 
 
 @router.post("/", response_model=GrantPublic)
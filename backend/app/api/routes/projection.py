@@ -1,83 +1,418 @@
+from datetime import datetime
 from logging import getLogger
+from typing import Optional
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException
-from sqlmodel import select
+from sqlmodel import func, select
 
-from app.api.deps import CurrentUser, SessionDep
+from app.allocation import plan_expense_allocation
+from app.api.deps import CurrentSuperUser, CurrentUser, SessionDep
+from app.cache import VersionedLRUCache
+from app.core.config import settings
+from app.forecast import refresh_forecasts
+from app.ledger import (
+    check_grant_balances,
+    grant_expense_share,
+    repair_grant_balances,
+)
 from app.models import (
+    AllocationPlansPublic,
+    ApprovalStatus,
+    CategoryExpenseProjection,
+    CategoryExpenseProjectionsPublic,
+    ExpenseAllocationRequest,
     ExpenseProjection,
+    ExpenseProjectionsPublic,
     Grant,
     GrantApproval,
-    GrantExpense,
+    GrantBalance,
+    GrantBalanceDriftsPublic,
+    GrantForecast,
+    GrantForecastPublic,
+    GrantForecastsPublic,
+    Message,
+    PeriodSpend,
+    PeriodSpendsPublic,
+    SpendInterval,
 )
-from app.permissions import GrantPermission, has_grant_permission
+from app.permissions import GrantPermission, GrantRole, has_grant_permission
 
 router = APIRouter(prefix="/grant-projection", tags=["Grant Projections"])
 logger = getLogger("uvicorn.error")
 
+# Keyed by (grant_id, grant_balance.version, ...), see app.ledger
+projection_cache = VersionedLRUCache(settings.PROJECTION_CACHE_SIZE)
+
+
+def _projection_statement():
+    """
+    Select the grant total and ledger balances needed for an ExpenseProjection,
+    followed by the grant version.
+    """
+    return select(
+        Grant.id,
+        Grant.total_amount,
+        func.coalesce(GrantBalance.committed_amount, 0.0),
+        func.coalesce(GrantBalance.pending_amount, 0.0),
+        GrantBalance.version,
+    ).join(GrantBalance, GrantBalance.grant_id == Grant.id, isouter=True)
+
+
+def _grant_version(session: SessionDep, grant_id: UUID) -> Optional[int]:
+    """Return the current data version of a grant."""
+    return session.exec(
+        select(GrantBalance.version).where(GrantBalance.grant_id == grant_id)
+    ).first()
+
+
+def _to_projection(row) -> ExpenseProjection:
+    grant_id, grant_total_funds, approved_expenses, pending_expenses = row[:4]
+    return ExpenseProjection(
+        grant_id=grant_id,
+        grant_total_funds=grant_total_funds,
+        existing_expense_amount=approved_expenses,
+        projected_expense_amount=pending_expenses,
+        grant_projected_remaining_funds=grant_total_funds
+        - (approved_expenses + pending_expenses),
+        grant_current_remaining_funds=grant_total_funds - approved_expenses,
+    )
+
 
-async def _calculate_approved_grant_expenses(
+async def _calculate_grant_expense_projection(
     session: SessionDep,
     grant_id: UUID,
-) -> float:
+) -> ExpenseProjection:
     """
-    Calculate the total expenses for a specific grant.
+    Calculate the expense projection for a specific grant.
     """
+    version = _grant_version(session, grant_id)
+    projection = projection_cache.get((grant_id, version, "projection"))
+    if projection is not None:
+        return projection
+
+    row = session.exec(_projection_statement().where(Grant.id == grant_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Grant not found")
+    projection = _to_projection(row)
+    if row[4] is not None:
+        projection_cache.put((grant_id, row[4], "projection"), projection)
+    return projection
 
+
+def _category_projection_statement(
+    grant_id: UUID,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+):
+    """
+    Sum the approved and pending expense shares of a grant per category, with
+    the grand total added by ROLLUP. The grant total is returned on every row.
+    """
+    share = grant_expense_share
+    approved = func.coalesce(
+        func.sum(share.c.amount).filter(
+            GrantApproval.status == ApprovalStatus.APPROVED
+        ),
+        0.0,
+    )
+    pending = func.coalesce(
+        func.sum(share.c.amount).filter(GrantApproval.id.is_(None)), 0.0
+    )
+    grant_total = (
+        select(Grant.total_amount).where(Grant.id == grant_id).scalar_subquery()
+    )
     statement = (
-        select(GrantExpense)
-        .join(GrantApproval, GrantExpense.id == GrantApproval.expense_id, isouter=True)
-        .where(GrantApproval.id.is_(None))
-        .where(GrantExpense.grant_id == grant_id)
+        select(
+            share.c.category,
+            func.grouping(share.c.category),
+            approved,
+            pending,
+            grant_total,
+        )
+        .select_from(share)
+        .join(
+            GrantApproval, share.c.expense_id == GrantApproval.expense_id, isouter=True
+        )
+        .where(share.c.grant_id == grant_id)
+        .group_by(func.rollup(share.c.category))
+        .order_by(func.grouping(share.c.category), share.c.category)
+    )
+    if start_date is not None:
+        statement = statement.where(share.c.date >= start_date)
+    if end_date is not None:
+        statement = statement.where(share.c.date <= end_date)
+    return statement
+
+
+def _period_spend_statement(
+    start_date: datetime, end_date: datetime, interval: SpendInterval
+):
+    """
+    Sum the approved and pending expense shares dated in [start_date,
+    end_date) per period. The bare range on the expense date is what lets
+    Postgres prune the yearly partitions and scan the BRIN index on the date
+    instead of the whole table.
+    """
+    share = grant_expense_share
+    period = func.date_trunc(interval.value, share.c.date)
+    approved = func.coalesce(
+        func.sum(share.c.amount).filter(
+            GrantApproval.status == ApprovalStatus.APPROVED
+        ),
+        0.0,
+    )
+    pending = func.coalesce(
+        func.sum(share.c.amount).filter(GrantApproval.id.is_(None)), 0.0
+    )
+    return (
+        select(period, approved, pending)
+        .select_from(share)
+        .join(
+            GrantApproval, share.c.expense_id == GrantApproval.expense_id, isouter=True
+        )
+        .where(share.c.date >= start_date)
+        .where(share.c.date < end_date)
+        .group_by(period)
+        .order_by(period)
     )
-    expenses = session.exec(statement).all()
-    total_expenses = sum(expense.amount for expense in expenses)
-    return total_expenses
 
 
-async def _calculate_unapproved_grant_expenses(
+@router.get("/spend", response_model=PeriodSpendsPublic)
+def get_period_spend(
     session: SessionDep,
-    grant_id: UUID,
-) -> float:
+    current_user: CurrentUser,
+    start_date: datetime,
+    end_date: datetime,
+    interval: SpendInterval = SpendInterval.MONTH,
+) -> PeriodSpendsPublic:
     """
-    Calculate the total expenses for a specific grant.
+    Return the approved and pending spend per period of the expenses dated
+    from start_date up to (excluding) end_date, across every grant the user
+    has the GrantPermission.VIEW_EXPENSES on, superusers get every grant.
+    Periods without expenses are left out.
     """
-    statement = (
-        select(GrantExpense)
-        .join(GrantApproval, GrantExpense.id == GrantApproval.expense_id, isouter=True)
-        .where(GrantApproval.id.isnot(None))
-        .where(GrantExpense.grant_id == grant_id)
+    if end_date <= start_date:
+        raise HTTPException(
+            status_code=400, detail="end_date must be after start_date"
+        )
+    statement = _period_spend_statement(start_date, end_date, interval)
+    if not current_user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == current_user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(grant_expense_share.c.grant_id.in_(subquery))
+
+    spend = [
+        PeriodSpend(period=period, approved_amount=approved, pending_amount=pending)
+        for period, approved, pending in session.exec(statement).all()
+    ]
+    return PeriodSpendsPublic(
+        start_date=start_date,
+        end_date=end_date,
+        interval=interval,
+        data=spend,
+        count=len(spend),
     )
-    expenses = session.exec(statement).all()
-    total_expenses = sum(expense.amount for expense in expenses)
-    return total_expenses
 
 
-async def _calculate_grant_expense_projection(
+@router.get("/", response_model=ExpenseProjectionsPublic)
+def get_portfolio_projection(
     session: SessionDep,
-    grant_id: UUID,
-) -> ExpenseProjection:
+    current_user: CurrentUser,
+    status: Optional[str] = None,
+    funding_agency: Optional[str] = None,
+) -> ExpenseProjectionsPublic:
     """
-    Calculate the total expenses for a specific grant.
+    Return the ExpenseProjection of every grant the user has the
+    GrantPermission.VIEW_EXPENSES on, superusers get every grant.
     """
-    approved_expenses = await _calculate_approved_grant_expenses(session, grant_id)
-    pending_expenses = await _calculate_unapproved_grant_expenses(session, grant_id)
-    grant_total_funds = session.exec(
-        select(Grant.total_amount).where(Grant.id == grant_id)
-    ).first()
-    if not grant_total_funds:
+    statement = _projection_statement().order_by(Grant.end_date, Grant.id)
+    if not current_user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == current_user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(Grant.id.in_(subquery))
+    if status is not None:
+        statement = statement.where(Grant.status == status)
+    if funding_agency is not None:
+        statement = statement.where(Grant.funding_agency == funding_agency)
+
+    projections = [_to_projection(row) for row in session.exec(statement).all()]
+    return ExpenseProjectionsPublic(data=projections, count=len(projections))
+
+
+@router.post("/allocation", response_model=AllocationPlansPublic)
+def get_expense_allocation(
+    session: SessionDep,
+    current_user: CurrentUser,
+    request: ExpenseAllocationRequest,
+) -> AllocationPlansPublic:
+    """
+    Analyse how a proposed expense can be supported by multiple grants.
+    Returns the feasible splits across the candidate grants the user can
+    submit expenses to, ranked to spend the soonest expiring funds first.
+    """
+    return plan_expense_allocation(
+        session, request, current_user.id, current_user.is_superuser
+    )
+
+
+@router.get("/ledger/drift", response_model=GrantBalanceDriftsPublic)
+def get_ledger_drift(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+) -> GrantBalanceDriftsPublic:
+    """
+    Recompute every grant balance from its expenses and approvals
+    and return the grants whose stored balance has drifted.
+    """
+    drift = check_grant_balances(session)
+    return GrantBalanceDriftsPublic(data=drift, count=len(drift))
+
+
+@router.post("/ledger/reconcile", response_model=GrantBalanceDriftsPublic)
+def reconcile_ledger(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+) -> GrantBalanceDriftsPublic:
+    """
+    Rebuild the drifted grant balances from their source rows.
+    Returns the drift that was repaired.
+    """
+    drift = check_grant_balances(session)
+    if drift:
+        logger.warning(f"Repairing {len(drift)} drifted grant balances")
+        repair_grant_balances(session, [d.grant_id for d in drift])
+    return GrantBalanceDriftsPublic(data=drift, count=len(drift))
+
+
+@router.get(
+    "/{grant_id}/by-category", response_model=CategoryExpenseProjectionsPublic
+)
+async def get_category_projection(
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> CategoryExpenseProjectionsPublic:
+    """
+    Return the approved, pending and remaining amounts of a grant per
+    expense category, optionally limited to expenses dated in a window.
+    """
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=UUID(grant_id),
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    version = _grant_version(session, UUID(grant_id))
+    key = (UUID(grant_id), version, "by-category", start_date, end_date)
+    cached = projection_cache.get(key)
+    if cached is not None:
+        return cached
+
+    statement = _category_projection_statement(UUID(grant_id), start_date, end_date)
+    rows = session.exec(statement).all()
+    # The grand total row is always present, even without any expense
+    grant_total_funds = rows[-1][4] if rows else None
+    if grant_total_funds is None:
         raise HTTPException(status_code=404, detail="Grant not found")
-    projection = ExpenseProjection(
-        grant_id=grant_id,
-        grant_total_funds=grant_total_funds,
-        existing_expense_amount=approved_expenses,
-        projected_expense_amount=pending_expenses,
-        grant_projected_remaining_funds=grant_total_funds
-        - (approved_expenses + pending_expenses),
-        grant_current_remaining_funds=grant_total_funds - approved_expenses,
+
+    categories = []
+    total = None
+    for category, is_total, approved, pending, _ in rows:
+        if is_total:
+            total = CategoryExpenseProjection(
+                approved_amount=approved,
+                pending_amount=pending,
+                remaining_amount=grant_total_funds - (approved + pending),
+            )
+        else:
+            categories.append(
+                CategoryExpenseProjection(
+                    category=category,
+                    approved_amount=approved,
+                    pending_amount=pending,
+                )
+            )
+    breakdown = CategoryExpenseProjectionsPublic(
+        grant_id=UUID(grant_id), data=categories, total=total
     )
-    return projection
+    if version is not None:
+        projection_cache.put(key, breakdown)
+    return breakdown
+
+
+@router.post("/forecast/refresh", response_model=Message)
+def refresh_grant_forecasts(
+    session: SessionDep,
+    current_user: CurrentSuperUser,
+) -> Message:
+    """
+    Recompute the burn rate forecast of every grant in one batch.
+    The same batch runs from `python app/forecast.py`.
+    """
+    count = refresh_forecasts(session)
+    return Message(message=f"Computed {count} grant forecasts")
+
+
+@router.get("/forecast/at-risk", response_model=GrantForecastsPublic)
+def get_at_risk_forecasts(
+    session: SessionDep,
+    current_user: CurrentUser,
+) -> GrantForecastsPublic:
+    """
+    Return the cached forecasts of the grants predicted to run out of funds
+    before their end date. Regular users only see the grants they have the
+    GrantPermission.VIEW_EXPENSES on.
+    """
+    statement = (
+        select(GrantForecast)
+        .where(GrantForecast.exhausts_before_end)
+        .order_by(GrantForecast.exhaustion_date)
+    )
+    if not current_user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == current_user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(GrantForecast.grant_id.in_(subquery))
+    forecasts = session.exec(statement).all()
+    return GrantForecastsPublic(data=forecasts, count=len(forecasts))
+
+
+@router.get("/{grant_id}/forecast", response_model=GrantForecastPublic)
+async def get_grant_forecast(
+    session: SessionDep,
+    current_user: CurrentUser,
+    grant_id: str,
+) -> GrantForecast:
+    """
+    Return the cached burn rate forecast of a grant.
+    """
+    permission = await has_grant_permission(
+        session=session,
+        grant_id=UUID(grant_id),
+        permission=GrantPermission.VIEW_EXPENSES,
+        user_id=current_user.id,
+    )
+    if not permission:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    forecast = session.get(GrantForecast, UUID(grant_id))
+    if not forecast:
+        raise HTTPException(status_code=404, detail="Grant forecast not computed")
+    return forecast
 
 
 @router.get("/{grant_id}", response_model=ExpenseProjection)
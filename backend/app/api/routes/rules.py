@@ -1,10 +1,9 @@
 import uuid
 from logging import getLogger
-from typing import Any, List
-from uuid import UUID
+from typing import Any, List, Optional
 
 from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from sqlmodel import select
 
 from app.api.deps import CurrentUser, SessionDep
 from app.models import (
@@ -17,7 +16,8 @@ from app.models import (
     RulePublic,
     RulesPublic,
 )
-from app.permissions import get_user_grants_with_permission, has_grant_permission
+from app.pagination import CountMode, count_rows, page, paginate
+from app.permissions import GrantRole, has_grant_permission
 from app.rule_templates import RULE_TEMPLATES
 from app.rules import (
     InvalidRule,
@@ -38,33 +38,34 @@ logger = getLogger("uvicorn.error")
     response_model=RulesPublic,
 )
 async def read_rules(
-    session: SessionDep, user: CurrentUser, skip: int = 0, limit: int = 100
+    session: SessionDep,
+    user: CurrentUser,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
 ) -> Any:
     """
-    Returns a list of all the current rules in the database.
+    Returns a list of all the current rules in the database. Regular users
+    only see the rules of the grants they have the
+    GrantPermission.CREATE_RULES on. Pass the returned next_cursor as
+    `cursor` to get the next page.
     """
-    if user.is_superuser:
-        count_statement = select(func.count()).select_from(Rule)
-        count = session.exec(count_statement).one()
-
-        statement = select(Rule.id).offset(skip).limit(limit)
-        rules = session.exec(statement).all()
-        rules = [await get_rule_by_id(session, rule_id) for rule_id in rules]
-
-        return RulesPublic(data=rules, count=count)
-    else:
-        grants: List[UUID] = await get_user_grants_with_permission(
-            session=session, user_id=user.id, permission=GrantPermission.CREATE_RULES
-        )
-        count_statement = select(func.count()).select_from(Rule)
-        count = session.exec(count_statement).one()
-
-        statement = (
-            select(Rule).where(Rule.grant_id in grants).offset(skip).limit(limit)
+    statement = select(Rule)
+    if not user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user.id)
+            .where(GrantRole.permissions.any(GrantPermission.CREATE_RULES.value))
         )
-        rules = session.exec(statement).all()
-        rules = [await get_rule_by_id(session, rule_id) for rule_id in rules]
-        return RulesPublic(data=rules, count=count)
+        statement = statement.where(Rule.grant_id.in_(subquery))
+    total = count_rows(session, statement, count)
+
+    keys = [Rule.created_at, Rule.id]
+    statement = paginate(statement, keys, skip, limit, cursor)
+    rules, next_cursor = page(session.exec(statement).all(), keys, limit)
+    rules = [await get_rule_by_id(session, rule.id) for rule in rules]
+    return RulesPublic(data=rules, count=total, next_cursor=next_cursor)
 
 
 @router.post("/", response_model=RulePublic)
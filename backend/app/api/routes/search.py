@@ -0,0 +1,27 @@
+from typing import Any
+
+from fastapi import APIRouter, Query
+
+from app.api.deps import CurrentUser, SessionDep
+from app.models import SearchResults
+from app.search import search_expenses, search_grants
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+
+@router.get("/", response_model=SearchResults)
+def search(
+    session: SessionDep,
+    current_user: CurrentUser,
+    q: str = Query(min_length=3, max_length=255),
+    limit: int = Query(default=20, ge=1, le=100),
+) -> Any:
+    """
+    Search the expenses by description and invoice number and the grants by
+    title and funding agency. Matches are substrings or similar words, the
+    best matches of each come first.
+    """
+    return SearchResults(
+        expenses=search_expenses(session, current_user, q, limit),
+        grants=search_grants(session, current_user, q, limit),
+    )
@@ -1,8 +1,8 @@
 import uuid
-from typing import Any
+from typing import Any, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import func, select
+from sqlmodel import select
 
 from app import crud
 from app.api.deps import CurrentUser, SessionDep, get_current_active_superuser
@@ -18,6 +18,7 @@ from app.models import (
     UserUpdate,
     UserUpdateMe,
 )
+from app.pagination import CountMode, count_rows, page, paginate
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -27,17 +28,24 @@ router = APIRouter(prefix="/users", tags=["users"])
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UsersPublic,
 )
-def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+def read_users(
+    session: SessionDep,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: CountMode = CountMode.EXACT,
+) -> Any:
     """
-    Retrieve users.
+    Retrieve users, ordered by email. Pass the returned next_cursor as
+    `cursor` to get the next page.
     """
-    count_statement = select(func.count()).select_from(User)
-    count = session.exec(count_statement).one()
+    total = count_rows(session, select(User), count)
 
-    statement = select(User).offset(skip).limit(limit)
-    users = session.exec(statement).all()
+    keys = [User.email]
+    statement = paginate(select(User), keys, skip, limit, cursor)
+    users, next_cursor = page(session.exec(statement).all(), keys, limit)
 
-    return UsersPublic(data=users, count=count)
+    return UsersPublic(data=users, count=total, next_cursor=next_cursor)
 
 
 # @router.post(
@@ -0,0 +1,347 @@
+import tempfile
+import uuid
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, func, select
+
+from app.ledger import grant_expense_share
+from app.models import (
+    ApprovalStatus,
+    Grant,
+    GrantApproval,
+    GrantBudgetImport,
+    GrantBudgetLine,
+    GrantBudgetLinePublic,
+    GrantCategory,
+    GrantPublic,
+    GrantRole,
+    GrantRoleType,
+    User,
+)
+from app.permissions import DEFAULT_ROLE_PERMISSIONS
+from app.rules import add_rule_from_template
+
+# Section headings of the UI budget template and the categories of their lines
+SECTION_CATEGORIES = {
+    "personnel compensation": ("SAL", "Salaries"),
+    "other personnel": ("SAL", "Salaries"),
+    "fringe": ("FRG", "Fringe Benefits"),
+    "equipment": ("EQP", "Equipment"),
+    "travel": ("TRV", "Travel"),
+    "participant support costs": ("PSC", "Participant Support Costs"),
+    "other direct costs": ("ODC", "Other Direct Costs"),
+    "consortia/subawards": ("SUB", "Subawards"),
+    "indirect costs": ("IDC", "Indirect Costs"),
+}
+
+# The budget years are the columns after label, hours and rate
+FIRST_PERIOD_COLUMN = 3
+DATE_FORMAT = "%m/%d/%Y"
+# Columns of every budget year in the budget report
+SIDES = ["Budget", "Actual"]
+# Reports larger than this are spooled to disk while they are streamed
+REPORT_SPOOL_SIZE = 1024 * 1024
+
+
+def _section(label: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return the category of a section heading, None for other labels."""
+    if not label:
+        return None
+    label = label.strip().lower()
+    for heading, category in SECTION_CATEGORIES.items():
+        if label.startswith(heading):
+            return category
+    return None
+
+
+def _label(value: Any) -> Optional[str]:
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _cell(row: Sequence[Any], column: int) -> Any:
+    return row[column] if column < len(row) else None
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _parse_dates(value: Any) -> Tuple[datetime, datetime]:
+    """Parse the "MM/DD/YYYY-MM/DD/YYYY" project dates of the template."""
+    try:
+        start, end = (part.strip() for part in str(value).split("-"))
+        return (
+            datetime.strptime(start, DATE_FORMAT).replace(tzinfo=timezone.utc),
+            datetime.strptime(end, DATE_FORMAT).replace(tzinfo=timezone.utc),
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Project dates must be given as MM/DD/YYYY-MM/DD/YYYY",
+        )
+
+
+def read_budget(stream: IO[bytes]) -> Dict[str, Any]:
+    """
+    Read a budget in the format of docs/UI-Budget-Template.xlsx. The sheet
+    is streamed row by row in read-only mode, formulas are read as the
+    values last calculated by the spreadsheet application.
+
+    Returns the grant fields, the categories used and one line per budget
+    line and year with a non-zero amount.
+    """
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid budget spreadsheet")
+
+    header: Dict[str, Any] = {}
+    categories: Dict[str, str] = {}
+    lines: List[Dict[str, Any]] = []
+    periods = 0
+    section: Optional[Tuple[str, str]] = None
+    direct = True
+    total: Optional[float] = None
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            label = _label(_cell(row, 0))
+            if not periods:
+                # Grant details above the "Y1", "Y2", ... header
+                if label and label.endswith(":"):
+                    header[label[:-1].lower()] = _cell(row, 1)
+                while _cell(row, FIRST_PERIOD_COLUMN + periods) == f"Y{periods + 1}":
+                    periods += 1
+                continue
+
+            amounts = [
+                _number(_cell(row, FIRST_PERIOD_COLUMN + period))
+                for period in range(periods)
+            ]
+            heading = _section(label)
+            if label and label.lower().startswith("total direct cost"):
+                direct = False
+                continue
+            if label and label.lower().startswith("total project cost"):
+                # The column after the budget years holds the total
+                total = _number(_cell(row, FIRST_PERIOD_COLUMN + periods))
+                continue
+            if heading and (not direct or not any(amounts)):
+                section = heading
+                if direct:
+                    continue
+            elif not direct:
+                # Subtotals and adjustments below the direct costs
+                continue
+            if section is None:
+                continue
+
+            code, name = section
+            for period, amount in enumerate(amounts, start=1):
+                if amount:
+                    categories[code] = name
+                    lines.append(
+                        {
+                            "category": code,
+                            "label": label or name,
+                            "period": period,
+                            "amount": amount,
+                        }
+                    )
+    finally:
+        workbook.close()
+
+    if not periods:
+        raise HTTPException(status_code=400, detail="Budget years not found")
+    title = _label(header.get("title"))
+    if not title:
+        raise HTTPException(status_code=400, detail="Budget has no title")
+    start_date, end_date = _parse_dates(header.get("project start and end dates"))
+    return {
+        "grant": {
+            "title": title,
+            "funding_agency": _label(header.get("funding source")) or "",
+            "start_date": start_date,
+            "end_date": end_date,
+            "total_amount": total
+            if total is not None
+            else sum(line["amount"] for line in lines),
+        },
+        "categories": categories,
+        "lines": lines,
+    }
+
+
+def import_budget(
+    session: Session, stream: IO[bytes], user: User, templates: List[str]
+) -> GrantBudgetImport:
+    """
+    Create a grant owned by the user from a budget spreadsheet, with its
+    budget lines and rules from the given templates. Missing categories of
+    the template's sections are created. The caller commits, so everything
+    is created in one transaction.
+    """
+    budget = read_budget(stream)
+
+    # Create the categories in one statement, keeping existing ones
+    if budget["categories"]:
+        session.exec(
+            insert(GrantCategory)
+            .values(
+                [
+                    {"id": uuid.uuid4(), "code": code, "name": name, "is_active": True}
+                    for code, name in budget["categories"].items()
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+
+    grant = Grant(owner_id=user.id, **budget["grant"])
+    grant_role = GrantRole(
+        grant_id=grant.id,
+        role_type=GrantRoleType.OWNER,
+        user_id=user.id,
+        permissions=DEFAULT_ROLE_PERMISSIONS[GrantRoleType.OWNER],
+    )
+    session.add(grant)
+    session.add(grant_role)
+    session.flush()
+
+    # The lines are flushed as one multi-row insert
+    lines = [GrantBudgetLine(grant_id=grant.id, **line) for line in budget["lines"]]
+    session.add_all(lines)
+    session.flush()
+
+    rule_ids = [
+        add_rule_from_template(session, template, grant.id)[0].id
+        for template in templates
+    ]
+    return GrantBudgetImport(
+        grant=GrantPublic.model_validate(grant),
+        lines=[GrantBudgetLinePublic.model_validate(line) for line in lines],
+        rule_ids=rule_ids,
+    )
+
+
+def _grant_years(grant: Grant) -> int:
+    """Number of budget years a grant runs, counting a started year."""
+    start, end = grant.start_date, grant.end_date
+    years = end.year - start.year
+    if (end.month, end.day) > (start.month, start.day):
+        years += 1
+    return max(years, 1)
+
+
+def budget_report_rows(session: Session, grant: Grant) -> Iterator[List[Any]]:
+    """
+    Yield the rows of a grant's budget report: the grant details and, per
+    category, the budgeted and actual amount of every budget year. Actuals
+    are the approved and pending expense shares charged to the grant, both
+    sides are aggregated in SQL.
+    """
+    budgeted = session.exec(
+        select(
+            GrantBudgetLine.category,
+            GrantBudgetLine.period,
+            func.sum(GrantBudgetLine.amount),
+        )
+        .where(GrantBudgetLine.grant_id == grant.id)
+        .group_by(GrantBudgetLine.category, GrantBudgetLine.period)
+    ).all()
+
+    share = grant_expense_share
+    period = (
+        func.extract("year", func.age(share.c.date, grant.start_date)) + 1
+    ).cast(Integer)
+    actual = session.exec(
+        select(share.c.category, period, func.sum(share.c.amount))
+        .join(
+            GrantApproval, share.c.expense_id == GrantApproval.expense_id, isouter=True
+        )
+        .where(share.c.grant_id == grant.id)
+        .where(share.c.date >= grant.start_date)
+        .where(
+            GrantApproval.id.is_(None)
+            | (GrantApproval.status != ApprovalStatus.REJECTED)
+        )
+        .group_by(share.c.category, period)
+    ).all()
+
+    amounts: Dict[str, Dict[int, List[float]]] = defaultdict(
+        lambda: defaultdict(lambda: [0.0, 0.0])
+    )
+    for category, year, amount in budgeted:
+        amounts[category][year][0] += amount
+    for category, year, amount in actual:
+        amounts[category][year][1] += amount
+    periods = max(
+        [_grant_years(grant)] + [year for years in amounts.values() for year in years]
+    )
+    names = dict(
+        session.exec(
+            select(GrantCategory.code, GrantCategory.name).where(
+                GrantCategory.code.in_(list(amounts))
+            )
+        ).all()
+    )
+
+    dates = "-".join(
+        date.strftime(DATE_FORMAT) for date in (grant.start_date, grant.end_date)
+    )
+    yield ["Title:", grant.title]
+    yield ["Funding source:", grant.funding_agency]
+    yield ["Project Start and End Dates:", dates]
+    yield []
+    yield (
+        ["Category", "Code"]
+        + [f"Y{year} {side}" for year in range(1, periods + 1) for side in SIDES]
+        + [f"Total {side}" for side in SIDES]
+        + ["Remaining"]
+    )
+    totals = [0.0] * (2 * periods + 2)
+    for category in sorted(amounts, key=lambda code: names.get(code, code)):
+        values = [
+            amounts[category][year][side]
+            for year in range(1, periods + 1)
+            for side in range(2)
+        ]
+        values += [sum(values[0::2]), sum(values[1::2])]
+        totals = [total + value for total, value in zip(totals, values)]
+        yield [names.get(category, category), category] + values + [
+            values[-2] - values[-1]
+        ]
+    yield ["Total", None] + totals + [totals[-2] - totals[-1]]
+
+
+def write_budget_report(session: Session, grant: Grant) -> IO[bytes]:
+    """
+    Write a grant's budget report with a write-only workbook, which keeps
+    only the current row in memory. Returns the file positioned at its start.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Budget vs Actual")
+    for row in budget_report_rows(session, grant):
+        sheet.append(row)
+    report = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE)
+    workbook.save(report)
+    report.seek(0)
+    return report
+
+
+def iter_report(report: IO[bytes], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Stream a written report in chunks and close it when done."""
+    with report:
+        while True:
+            chunk = report.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
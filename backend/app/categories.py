@@ -0,0 +1,147 @@
+from logging import getLogger
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional, Set
+
+import psycopg
+from sqlalchemy import DDL, event
+from sqlmodel import Session, SQLModel, select
+
+from app.core.db import engine
+from app.models import GrantCategory, GrantCategoryPublic
+
+logger = getLogger("uvicorn.error")
+
+CATEGORY_CHANNEL = "grant_category_changed"
+
+# Every committed change to the categories notifies the listening workers
+CATEGORY_SQL = f"""CREATE OR REPLACE FUNCTION grant_category_notify()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('{CATEGORY_CHANNEL}', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_category_notify ON grant_category;
+CREATE TRIGGER grant_category_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON grant_category
+    FOR EACH STATEMENT EXECUTE FUNCTION grant_category_notify();
+"""
+
+event.listen(SQLModel.metadata, "after_create", DDL(CATEGORY_SQL))
+
+
+class CategoryRegistry:
+    """
+    Process wide snapshot of the grant categories, so validating an expense
+    or listing the categories needs no query.
+
+    The snapshot is loaded on first use and reloaded on the next use after
+    `invalidate`, which the category routes call after their commits and
+    the listener thread calls on every change notified by the database.
+    A code missing from the snapshot is looked up by its row, so a category
+    created by another worker is accepted while its notification is on the
+    way. A code without a row is remembered until the next `invalidate`, so
+    invalid codes repeated in a batch or an import do not query again.
+    """
+
+    def __init__(self) -> None:
+        self._categories: Dict[str, GrantCategoryPublic] = {}
+        self._missing: Set[str] = set()
+        self._generation = 0
+        self._loaded_generation = -1
+        self._lock = Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._missing = set()
+
+    def load(self, session: Session) -> Dict[str, GrantCategoryPublic]:
+        with self._lock:
+            generation = self._generation
+        rows = session.exec(select(GrantCategory).order_by(GrantCategory.code)).all()
+        categories = {
+            row.code: GrantCategoryPublic.model_validate(row) for row in rows
+        }
+        with self._lock:
+            # A change notified while loading keeps the snapshot stale
+            if generation == self._generation:
+                self._loaded_generation = generation
+            self._categories = categories
+        return categories
+
+    @property
+    def stale(self) -> bool:
+        """Whether the categories changed since the snapshot was loaded."""
+        return self._loaded_generation != self._generation
+
+    def _snapshot(self, session: Session) -> Dict[str, GrantCategoryPublic]:
+        if self.stale:
+            return self.load(session)
+        return self._categories
+
+    def all(self, session: Session) -> List[GrantCategoryPublic]:
+        """All categories, ordered by code."""
+        return list(self._snapshot(session).values())
+
+    def get(self, session: Session, code: str) -> Optional[GrantCategoryPublic]:
+        category = self._snapshot(session).get(code)
+        if category is not None or code in self._missing:
+            return category
+        with self._lock:
+            generation = self._generation
+        row = session.exec(
+            select(GrantCategory).where(GrantCategory.code == code)
+        ).first()
+        if row is None:
+            with self._lock:
+                # A change notified meanwhile may have created the code
+                if generation == self._generation:
+                    self._missing.add(code)
+            return None
+        # Created behind the snapshot, reloaded on the next use
+        self.invalidate()
+        return GrantCategoryPublic.model_validate(row)
+
+
+category_registry = CategoryRegistry()
+
+
+class CategoryListener:
+    """
+    Thread invalidating a registry whenever the categories change in the
+    database, on a dedicated connection LISTENing for the notifications.
+    """
+
+    def __init__(self, registry: CategoryRegistry, poll_seconds: float = 1.0):
+        self.registry = registry
+        self.poll_seconds = poll_seconds
+        self._stop = Event()
+        self._thread = Thread(
+            target=self._run, name="category-listener", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        conninfo = engine.url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as connection:
+                    connection.execute(f"LISTEN {CATEGORY_CHANNEL}")
+                    # Changes may have been missed while not listening
+                    self.registry.invalidate()
+                    while not self._stop.is_set():
+                        for _ in connection.notifies(timeout=self.poll_seconds):
+                            self.registry.invalidate()
+            except psycopg.Error as e:
+                logger.warning(f"Category listener reconnecting: {e}")
+                self._stop.wait(self.poll_seconds)
@@ -0,0 +1,332 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from threading import Event, Lock, Thread
+from typing import List, Optional, Set
+from uuid import UUID
+
+import psycopg
+from sqlalchemy import DDL, BigInteger, Text, cast, event, literal, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, SQLModel, delete, func, select
+
+from app.core.db import engine
+from app.models import GrantChange, GrantChangePublic
+from app.pagination import decode_cursor, encode_cursor
+
+logger = getLogger("uvicorn.error")
+
+CHANGE_CHANNEL = "grant_changed"
+# Changes are kept this long for streams catching up after a reconnect
+CHANGE_RETENTION = timedelta(days=7)
+# Changes a subscriber may fall behind by before its stream is reset
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Every expense, allocation and approval write logs a change per grant it
+# touches, like the ledger sync charges every grant of a split expense, and
+# notifies the workers' brokers, delivered on commit. Each change keeps the
+# id of its transaction: the change ids come from a sequence and may commit
+# out of order, so readers only take changes of transactions older than
+# every one still open, in transaction order (see read_changes).
+# An expense moved to another year's partition is deleted and inserted by
+# Postgres, only the insert is logged for it.
+CHANGE_SQL = f"""CREATE OR REPLACE FUNCTION grant_change_record(
+    p_grant_id UUID,
+    p_entity TEXT,
+    p_entity_id UUID,
+    p_operation TEXT
+) RETURNS VOID AS $$
+DECLARE
+    change_id BIGINT;
+    changed_at TIMESTAMPTZ := now();
+BEGIN
+    INSERT INTO grant_change (
+        grant_id, entity, entity_id, operation, xact_id, created_at
+    )
+    VALUES (
+        p_grant_id, p_entity::changeentity, p_entity_id,
+        p_operation::changeoperation, pg_current_xact_id()::TEXT::BIGINT,
+        changed_at
+    )
+    RETURNING id INTO change_id;
+    PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+        'id', change_id,
+        'grant_id', p_grant_id,
+        'entity', p_entity,
+        'entity_id', p_entity_id,
+        'operation', p_operation,
+        'created_at', changed_at
+    )::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_change_expense() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+            PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.id, TG_OP);
+    END IF;
+    PERFORM grant_change_record(NEW.grant_id, 'EXPENSE', NEW.id, TG_OP);
+    -- The grants carrying an allocation of the expense see it change too
+    PERFORM grant_change_record(a.grant_id, 'EXPENSE', NEW.id, TG_OP)
+    FROM grant_expense_allocation a WHERE a.expense_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An allocation adds the expense to its grant, and changes what is left
+-- over for the expense's own grant
+CREATE OR REPLACE FUNCTION grant_change_allocation() RETURNS TRIGGER AS $$
+DECLARE
+    allocated_expense_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        allocated_expense_id := OLD.expense_id;
+        PERFORM grant_change_record(OLD.grant_id, 'EXPENSE', OLD.expense_id, TG_OP);
+    ELSE
+        allocated_expense_id := NEW.expense_id;
+        IF TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id THEN
+            PERFORM grant_change_record(
+                OLD.grant_id, 'EXPENSE', OLD.expense_id, 'DELETE');
+            PERFORM grant_change_record(
+                NEW.grant_id, 'EXPENSE', NEW.expense_id, 'INSERT');
+        ELSE
+            PERFORM grant_change_record(
+                NEW.grant_id, 'EXPENSE', NEW.expense_id, TG_OP);
+        END IF;
+    END IF;
+    PERFORM grant_change_record(e.grant_id, 'EXPENSE', e.id, 'UPDATE')
+    FROM grant_expense e WHERE e.id = allocated_expense_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An approval belongs to every grant charged a share of its expense
+CREATE OR REPLACE FUNCTION grant_change_approval() RETURNS TRIGGER AS $$
+DECLARE
+    approval_id UUID;
+    approved_expense_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        approval_id := OLD.id;
+        approved_expense_id := OLD.expense_id;
+    ELSE
+        approval_id := NEW.id;
+        approved_expense_id := NEW.expense_id;
+    END IF;
+    PERFORM grant_change_record(s.grant_id, 'APPROVAL', approval_id, TG_OP)
+    FROM grant_expense_share s WHERE s.expense_id = approved_expense_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_change_expense ON grant_expense;
+CREATE TRIGGER grant_change_expense
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_change_expense();
+
+DROP TRIGGER IF EXISTS grant_change_allocation ON grant_expense_allocation;
+CREATE TRIGGER grant_change_allocation
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_change_allocation();
+
+DROP TRIGGER IF EXISTS grant_change_approval ON grant_approval;
+CREATE TRIGGER grant_change_approval
+    AFTER INSERT OR UPDATE OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_change_approval();
+"""
+
+event.listen(SQLModel.metadata, "after_create", DDL(CHANGE_SQL))
+
+
+# Transactions older than this one are all committed or rolled back
+_settled_xact_id = cast(
+    cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger
+)
+_change_keys = [GrantChange.xact_id, GrantChange.id]
+
+
+def _public(change: GrantChange) -> GrantChangePublic:
+    return GrantChangePublic.model_validate(
+        change, update={"cursor": encode_cursor([change.xact_id, change.id])}
+    )
+
+
+def read_changes(
+    session: Session,
+    after: Optional[str],
+    grant_ids: Optional[Set[UUID]],
+    limit: int,
+) -> List[GrantChangePublic]:
+    """
+    The changes logged after a change cursor (of the given grants), in
+    transaction order. Changes of a transaction are held back while an
+    older transaction is open, that one could still log changes ordered
+    before them.
+    """
+    statement = select(GrantChange).where(GrantChange.xact_id < _settled_xact_id)
+    if after is not None:
+        values = [
+            literal(value, BigInteger) for value in decode_cursor(after, _change_keys)
+        ]
+        statement = statement.where(tuple_(*_change_keys) > tuple_(*values))
+    if grant_ids is not None:
+        statement = statement.where(GrantChange.grant_id.in_(grant_ids))
+    changes = session.exec(statement.order_by(*_change_keys).limit(limit)).all()
+    return [_public(change) for change in changes]
+
+
+def latest_change_cursor(session: Session) -> Optional[str]:
+    """The cursor of the latest change read_changes returns, None without."""
+    change = session.exec(
+        select(GrantChange)
+        .where(GrantChange.xact_id < _settled_xact_id)
+        .order_by(*[key.desc() for key in _change_keys])
+        .limit(1)
+    ).first()
+    return _public(change).cursor if change is not None else None
+
+
+class Subscription:
+    """
+    Changes of some grants (of every grant if grant_ids is None) queued for
+    one stream on its event loop.
+    """
+
+    def __init__(self, grant_ids: Optional[Set[UUID]]):
+        self.grant_ids = grant_ids
+        self.queue: asyncio.Queue[GrantChangePublic] = asyncio.Queue(
+            SUBSCRIBER_QUEUE_SIZE
+        )
+        # Set once changes were dropped because the stream fell behind
+        self.overflowed = False
+        self._loop = asyncio.get_running_loop()
+
+    def wants(self, change: GrantChangePublic) -> bool:
+        return self.grant_ids is None or change.grant_id in self.grant_ids
+
+    def _put(self, change: GrantChangePublic) -> None:
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def offer(self, change: GrantChangePublic) -> None:
+        """Queue a change from any thread."""
+        self._loop.call_soon_threadsafe(self._put, change)
+
+
+class ChangeBroker:
+    """
+    Thread reading the committed changes in transaction order and handing
+    every change to the subscriptions of this worker, so open streams cost
+    no queries. It reads once per poll and whenever a change notification
+    on its dedicated LISTEN connection wakes it up. It also deletes the
+    changes older than the retention once an hour.
+    """
+
+    def __init__(
+        self,
+        poll_seconds: float = 1.0,
+        retention: timedelta = CHANGE_RETENTION,
+        prune_seconds: float = 3600,
+    ):
+        self.poll_seconds = poll_seconds
+        self.retention = retention
+        self.prune_seconds = prune_seconds
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="change-broker", daemon=True)
+        # Cursor of the last change published, taken on the first read
+        self._cursor: Optional[str] = None
+        self._reading = False
+
+    def subscribe(self, grant_ids: Optional[Set[UUID]]) -> Subscription:
+        """Subscribe the calling event loop to the changes of some grants."""
+        subscription = Subscription(grant_ids)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, change: GrantChangePublic) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(change):
+                subscription.offer(change)
+
+    def start(self) -> None:
+        # Streams opened from now on are caught up from this cursor
+        self.read()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def prune(self) -> None:
+        cutoff = datetime.now(timezone.utc) - self.retention
+        try:
+            with Session(engine) as session:
+                session.exec(delete(GrantChange).where(GrantChange.created_at < cutoff))
+                session.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Pruning the grant changes failed: {e}")
+
+    def read(self) -> None:
+        """Publish the changes committed since the last read."""
+        try:
+            with Session(engine) as session:
+                if not self._reading:
+                    self._cursor = latest_change_cursor(session)
+                    self._reading = True
+                    return
+                while True:
+                    changes = read_changes(
+                        session, self._cursor, None, SUBSCRIBER_QUEUE_SIZE
+                    )
+                    for change in changes:
+                        self.publish(change)
+                        self._cursor = change.cursor
+                    if len(changes) < SUBSCRIBER_QUEUE_SIZE:
+                        return
+        except Exception as e:
+            # Kept running, the next read starts after the last published
+            logger.error(f"Reading the grant changes failed: {e}")
+
+    def _run(self) -> None:
+        conninfo = engine.url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        next_prune = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as connection:
+                    connection.execute(f"LISTEN {CHANGE_CHANNEL}")
+                    while not self._stop.is_set():
+                        # A notification only ends the wait early
+                        for _ in connection.notifies(
+                            timeout=self.poll_seconds, stop_after=1
+                        ):
+                            pass
+                        self.read()
+                        if time.monotonic() >= next_prune:
+                            self.prune()
+                            next_prune = time.monotonic() + self.prune_seconds
+            except psycopg.Error as e:
+                logger.warning(f"Change broker reconnecting: {e}")
+                self._stop.wait(self.poll_seconds)
+
+
+change_broker = ChangeBroker()
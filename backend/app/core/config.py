@@ -105,6 +105,11 @@ class Settings(BaseSettings):
     def emails_enabled(self) -> bool:
         return bool(self.SMTP_HOST and self.EMAILS_FROM_EMAIL)
 
+    # Number of grant projections kept in each worker's cache
+    PROJECTION_CACHE_SIZE: int = 1024
+    # Hours a reservation holds its funds unless it is given an expiry
+    RESERVATION_EXPIRE_HOURS: int = 24 * 7
+
     EMAIL_TEST_USER: EmailStr = "test@example.com"
     FIRST_SUPERUSER: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
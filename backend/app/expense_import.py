@@ -0,0 +1,326 @@
+import csv
+import io
+import json
+import uuid
+from typing import IO, Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from psycopg.errors import DatabaseError
+from pydantic import ValidationError
+from sqlalchemy import Uuid, literal
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, delete, func, insert, select, update
+
+from app.categories import category_registry
+from app.ledger import lock_grants
+from app.models import (
+    ExpenseImportError,
+    ExpenseImportFormat,
+    ExpenseImportReport,
+    Grant,
+    GrantCategory,
+    GrantExpense,
+    GrantExpenseBase,
+    GrantExpenseBatch,
+    GrantExpenseBatchItem,
+    GrantExpenseBatchResult,
+    GrantExpensePublic,
+    GrantExpenseStaging,
+    User,
+)
+from app.permissions import GrantPermission, GrantRole
+
+# Columns copied from the imported file, in the order of the COPY
+IMPORT_COLUMNS = [
+    "amount",
+    "date",
+    "description",
+    "category",
+    "invoice_number",
+    "grant_id",
+]
+
+
+def read_records(
+    stream: IO[bytes], file_format: ExpenseImportFormat
+) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Read an imported file one record at a time. Yields the line of every
+    record with either the record or the reason it could not be read.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if file_format == ExpenseImportFormat.CSV:
+        # The header is line 1, empty cells are missing values
+        for line, row in enumerate(csv.DictReader(text), start=2):
+            yield line, {k: v for k, v in row.items() if k and v != ""}, None
+        return
+
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            yield line, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line, None, "Expected a JSON object"
+            continue
+        yield line, record, None
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        for error in exc.errors()
+    )
+
+
+def _driver_message(exc: DBAPIError) -> str:
+    driver = exc.orig
+    if isinstance(driver, DatabaseError) and driver.diag.message_primary:
+        return driver.diag.message_primary
+    return str(driver)
+
+
+def _driver_code(exc: DBAPIError) -> Optional[str]:
+    driver = exc.orig
+    return driver.sqlstate if isinstance(driver, DatabaseError) else None
+
+
+def copy_records(
+    session: Session,
+    batch_id: uuid.UUID,
+    records: Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]],
+) -> List[ExpenseImportError]:
+    """
+    Stream the records into the staging table with COPY. Records that do not
+    parse as an expense are not copied, their errors are returned.
+    """
+    errors = []
+    columns = ", ".join(["batch_id", "line", *IMPORT_COLUMNS])
+    connection = session.connection().connection.driver_connection
+    with connection.cursor() as cursor:
+        with cursor.copy(
+            f"COPY {GrantExpenseStaging.__tablename__} ({columns}) FROM STDIN"
+        ) as copy:
+            for line, record, error in records:
+                if record is not None:
+                    try:
+                        expense = GrantExpenseBase.model_validate(record)
+                    except ValidationError as e:
+                        error = _validation_message(e)
+                if error is not None:
+                    errors.append(ExpenseImportError(line=line, error=error))
+                    continue
+                copy.write_row(
+                    [batch_id, line]
+                    + [getattr(expense, column) for column in IMPORT_COLUMNS]
+                )
+    return errors
+
+
+def _reject(session: Session, batch_id: uuid.UUID, condition: Any, error: str) -> None:
+    """Mark the staged rows of a batch matching a condition as rejected."""
+    staged = GrantExpenseStaging
+    session.exec(
+        update(staged)
+        .where(staged.batch_id == batch_id)
+        .where(staged.error.is_(None))
+        .where(condition)
+        .values(error=error)
+    )
+
+
+def validate_batch(session: Session, batch_id: uuid.UUID, user: User) -> None:
+    """Check the grants, permissions and categories of a whole batch at once."""
+    staged = GrantExpenseStaging
+    grants = select(Grant.id).where(Grant.id == staged.grant_id)
+    _reject(session, batch_id, ~grants.exists(), "Grant not found")
+
+    if not user.is_superuser:
+        permitted = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user.id)
+            .where(GrantRole.permissions.any(GrantPermission.SUBMIT_EXPENSES.value))
+        )
+        _reject(
+            session,
+            batch_id,
+            staged.grant_id.not_in(permitted),
+            "Not enough permissions",
+        )
+
+    categories = select(GrantCategory.code).where(
+        GrantCategory.code == staged.category
+    )
+    _reject(session, batch_id, ~categories.exists(), "Invalid expense category")
+
+
+def _move(
+    session: Session,
+    batch_id: uuid.UUID,
+    user_id: uuid.UUID,
+    line: Optional[int] = None,
+) -> int:
+    """Insert the accepted rows of a batch (or one of its lines) as expenses."""
+    staged = GrantExpenseStaging
+    source = (
+        select(
+            func.gen_random_uuid(),
+            *[getattr(staged, column) for column in IMPORT_COLUMNS],
+            literal(user_id, Uuid),
+            func.now(),
+            func.now(),
+        )
+        .where(staged.batch_id == batch_id)
+        .where(staged.error.is_(None))
+        .order_by(staged.line)
+    )
+    if line is not None:
+        source = source.where(staged.line == line)
+    # The ORM reports no rowcount for INSERT ... SELECT, the ids are counted
+    moved = session.exec(
+        insert(GrantExpense)
+        .from_select(
+            ["id", *IMPORT_COLUMNS, "created_by", "created_at", "updated_at"],
+            source,
+        )
+        .returning(GrantExpense.id)
+    ).all()
+    return len(moved)
+
+
+def import_expenses(
+    session: Session,
+    stream: IO[bytes],
+    file_format: ExpenseImportFormat,
+    user: User,
+) -> ExpenseImportReport:
+    """
+    Import a CSV or NDJSON file of expenses. The rows are copied into the
+    staging table, validated set-wise and moved into grant_expense with one
+    INSERT ... SELECT. When a rule trigger rejects that insert, the rows are
+    moved one savepoint at a time to tell which of them break a rule.
+    The caller commits.
+    """
+    staged = GrantExpenseStaging
+    batch_id = uuid.uuid4()
+    errors = copy_records(session, batch_id, read_records(stream, file_format))
+    validate_batch(session, batch_id, user)
+    # The triggers would lock the grants in the order of the rows
+    lock_grants(
+        session,
+        session.exec(
+            select(staged.grant_id)
+            .where(staged.batch_id == batch_id)
+            .where(staged.error.is_(None))
+            .distinct()
+        ).all(),
+    )
+
+    try:
+        with session.begin_nested():
+            imported = _move(session, batch_id, user.id)
+    except DBAPIError:
+        imported = 0
+        lines = session.exec(
+            select(staged.line)
+            .where(staged.batch_id == batch_id)
+            .where(staged.error.is_(None))
+            .order_by(staged.line)
+        ).all()
+        for line in lines:
+            try:
+                with session.begin_nested():
+                    imported += _move(session, batch_id, user.id, line)
+            except DBAPIError as e:
+                errors.append(ExpenseImportError(line=line, error=_driver_message(e)))
+
+    rejected = session.exec(
+        select(staged.line, staged.error)
+        .where(staged.batch_id == batch_id)
+        .where(staged.error.is_not(None))
+    ).all()
+    errors += [ExpenseImportError(line=line, error=error) for line, error in rejected]
+    session.exec(delete(staged).where(staged.batch_id == batch_id))
+    return ExpenseImportReport(
+        imported=imported, errors=sorted(errors, key=lambda error: error.line)
+    )
+
+
+def _batch_checks(
+    session: Session, items: List[GrantExpenseBase], user: User
+) -> Tuple[Set[uuid.UUID], Set[uuid.UUID], Set[str]]:
+    """
+    Look up the grants, the grants the user may submit expenses to and the
+    categories of a batch once for all of its items.
+    """
+    grant_ids = {item.grant_id for item in items}
+    codes = {item.category for item in items}
+    grants = set(session.exec(select(Grant.id).where(Grant.id.in_(grant_ids))).all())
+    if user.is_superuser:
+        permitted = grants
+    else:
+        permitted = set(
+            session.exec(
+                select(GrantRole.grant_id)
+                .where(GrantRole.user_id == user.id)
+                .where(GrantRole.grant_id.in_(grant_ids))
+                .where(
+                    GrantRole.permissions.any(GrantPermission.SUBMIT_EXPENSES.value)
+                )
+            ).all()
+        )
+    categories = {code for code in codes if category_registry.get(session, code)}
+    return grants, permitted, categories
+
+
+def create_expenses(
+    session: Session, batch: GrantExpenseBatch, user: User
+) -> GrantExpenseBatchResult:
+    """
+    Create a batch of expenses in one transaction, each in its own savepoint
+    so an expense breaking a rule leaves the others in place. An atomic
+    batch is rolled back as a whole when any expense fails. The caller
+    commits.
+    """
+    grants, permitted, categories = _batch_checks(session, batch.items, user)
+    # The triggers would lock the grants in the order of the items
+    lock_grants(session, list(permitted))
+    results = []
+    for index, item in enumerate(batch.items):
+        if item.grant_id not in grants:
+            error = "Grant not found"
+        elif item.grant_id not in permitted:
+            error = "Not enough permissions"
+        elif item.category not in categories:
+            error = "Invalid expense category"
+        else:
+            expense = GrantExpense(**item.model_dump(), created_by=user.id)
+            try:
+                with session.begin_nested():
+                    session.add(expense)
+            except DBAPIError as e:
+                results.append(
+                    GrantExpenseBatchItem(
+                        index=index, error=_driver_message(e), pg_code=_driver_code(e)
+                    )
+                )
+                continue
+            results.append(
+                GrantExpenseBatchItem(
+                    index=index, expense=GrantExpensePublic.model_validate(expense)
+                )
+            )
+            continue
+        results.append(GrantExpenseBatchItem(index=index, error=error))
+
+    failed = any(result.error is not None for result in results)
+    if batch.atomic and failed:
+        session.rollback()
+        for result in results:
+            if result.expense is not None:
+                result.expense = None
+                result.error = "Rolled back with the batch"
+    created = sum(result.expense is not None for result in results)
+    return GrantExpenseBatchResult(created=created, results=results)
@@ -0,0 +1,340 @@
+from logging import getLogger
+from threading import Event, Thread
+from typing import List, Optional
+
+from sqlalchemy import DDL, event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, SQLModel
+
+from app.core.db import engine
+from app.models import GrantExpensePartition
+
+logger = getLogger("uvicorn.error")
+
+# First key of the advisory lock serializing the partition maintenance, next
+# to the per grant locks of app/ledger.py
+PARTITION_LOCK_CLASS = 7302
+
+# grant_expense is range partitioned by date into one partition per calendar
+# year (UTC), named grant_expense_y<year>. Expenses dated outside the created
+# years land in the default partition until their year is created, which
+# moves them over. Postgres only accepts foreign keys to a partitioned table
+# on a key including the partition key, so the expense references of the
+# allocations, approvals and reservations are checked by triggers instead.
+PARTITION_SQL = f"""
+CREATE TABLE IF NOT EXISTS grant_expense_default
+    PARTITION OF grant_expense DEFAULT;
+
+CREATE OR REPLACE FUNCTION grant_expense_create_partition(p_year INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    lower_bound TIMESTAMPTZ := make_timestamptz(p_year, 1, 1, 0, 0, 0, 'UTC');
+    upper_bound TIMESTAMPTZ := make_timestamptz(p_year + 1, 1, 1, 0, 0, 0, 'UTC');
+BEGIN
+    PERFORM pg_advisory_xact_lock({PARTITION_LOCK_CLASS}, 0);
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE 'CREATE TABLE ' || quote_ident(partition_name)
+        || ' (LIKE grant_expense INCLUDING DEFAULTS)';
+    -- Move the year's rows out of the default partition. The rows only
+    -- change partition, so the ledger, rule and reference triggers must
+    -- not see them as deleted.
+    IF EXISTS (
+        SELECT 1 FROM grant_expense_default
+        WHERE date >= lower_bound AND date < upper_bound
+    ) THEN
+        ALTER TABLE grant_expense_default DISABLE TRIGGER USER;
+        EXECUTE 'WITH moved AS (DELETE FROM grant_expense_default'
+            || ' WHERE date >= $1 AND date < $2 RETURNING *)'
+            || ' INSERT INTO ' || quote_ident(partition_name)
+            || ' SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+        ALTER TABLE grant_expense_default ENABLE TRIGGER USER;
+    END IF;
+    -- Attaching adds the indexes, constraints and triggers of grant_expense
+    EXECUTE 'ALTER TABLE grant_expense ATTACH PARTITION '
+        || quote_ident(partition_name)
+        || ' FOR VALUES FROM (' || quote_literal(lower_bound)
+        || ') TO (' || quote_literal(upper_bound) || ')';
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the partitions of the years ahead and of the years that ended up
+-- in the default partition. Returns the number of partitions created.
+CREATE OR REPLACE FUNCTION grant_expense_maintain_partitions(
+    p_years_ahead INTEGER DEFAULT 1
+) RETURNS INTEGER AS $$
+DECLARE
+    current_year INTEGER := extract(year FROM now() AT TIME ZONE 'UTC');
+    partition_years INTEGER[];
+    partition_year INTEGER;
+    created INTEGER := 0;
+BEGIN
+    -- Collected first, the default partition cannot be altered while scanned
+    partition_years := ARRAY(
+        SELECT generate_series(current_year, current_year + p_years_ahead)
+        UNION
+        SELECT extract(year FROM date AT TIME ZONE 'UTC')::INTEGER
+        FROM grant_expense_default
+    );
+    FOREACH partition_year IN ARRAY partition_years
+    LOOP
+        IF grant_expense_create_partition(partition_year) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach a year and keep it as the table grant_expense_archive_y<year>.
+-- Detaching only touches the catalog, the rows are not scanned. The
+-- balances of the year's grants keep its spend, so it is folded into
+-- grant_balance_carryover first, the allocations and approvals of its
+-- expenses move to <table>_archive_y<year> tables and its finalized
+-- reservations let go of their expenses. The triggers of those tables are
+-- off meanwhile, the ledger must not see the rows as deleted. A year
+-- counting towards an active budget rule is refused, the rule's aggregate
+-- would lose it.
+CREATE OR REPLACE FUNCTION grant_expense_detach_partition(p_year INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := 'grant_expense_y' || p_year;
+    archive TEXT := 'grant_expense_archive_y' || p_year;
+    lower_bound TIMESTAMPTZ := make_timestamptz(p_year, 1, 1, 0, 0, 0, 'UTC');
+    upper_bound TIMESTAMPTZ := make_timestamptz(p_year + 1, 1, 1, 0, 0, 0, 'UTC');
+    referencing TEXT;
+BEGIN
+    PERFORM pg_advisory_xact_lock({PARTITION_LOCK_CLASS}, 0);
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'grant_expense'::regclass
+            AND c.relname = partition_name
+    ) THEN
+        RETURN NULL;
+    END IF;
+    -- Taken by the detach anyway, no expense may change from here on
+    LOCK TABLE grant_expense IN ACCESS EXCLUSIVE MODE;
+    IF EXISTS (
+        SELECT 1 FROM rule r
+        WHERE r.is_active AND r.rule_type = 'BUDGET'
+            AND r.grant_id IN (
+                SELECT grant_id FROM grant_expense_share
+                WHERE date >= lower_bound AND date < upper_bound
+            )
+    ) THEN
+        RAISE EXCEPTION USING
+            ERRCODE = 'object_in_use',
+            MESSAGE = 'Expenses of ' || p_year
+                || ' count towards an active budget rule',
+            HINT = 'Deactivate the budget rules of their grants first.';
+    END IF;
+
+    INSERT INTO grant_balance_carryover (
+        grant_id, year, committed_amount, pending_amount, spent_amount,
+        created_at
+    )
+    SELECT
+        s.grant_id,
+        p_year,
+        COALESCE(SUM(s.amount) FILTER (WHERE a.status::TEXT = 'APPROVED'), 0),
+        COALESCE(SUM(s.amount) FILTER (WHERE a.id IS NULL), 0),
+        COALESCE(SUM(s.amount), 0),
+        now()
+    FROM grant_expense_share s
+    LEFT JOIN grant_approval a ON a.expense_id = s.expense_id
+    WHERE s.date >= lower_bound AND s.date < upper_bound
+    GROUP BY s.grant_id;
+    -- The expenses no longer count as owned, and the projections change
+    UPDATE grant_balance b SET
+        expense_count = b.expense_count - (
+            SELECT COUNT(*) FROM grant_expense e
+            WHERE e.grant_id = b.grant_id
+                AND e.date >= lower_bound AND e.date < upper_bound
+        ),
+        version = b.version + 1,
+        updated_at = now()
+    FROM grant_balance_carryover c
+    WHERE c.grant_id = b.grant_id AND c.year = p_year;
+
+    FOREACH referencing IN ARRAY ARRAY['grant_expense_allocation', 'grant_approval']
+    LOOP
+        EXECUTE 'CREATE TABLE '
+            || quote_ident(referencing || '_archive_y' || p_year)
+            || ' (LIKE ' || quote_ident(referencing) || ' INCLUDING DEFAULTS)';
+        EXECUTE 'ALTER TABLE ' || quote_ident(referencing)
+            || ' DISABLE TRIGGER USER';
+        EXECUTE 'WITH moved AS (DELETE FROM ' || quote_ident(referencing)
+            || ' WHERE expense_id IN (SELECT id FROM grant_expense'
+            || ' WHERE date >= $1 AND date < $2) RETURNING *)'
+            || ' INSERT INTO '
+            || quote_ident(referencing || '_archive_y' || p_year)
+            || ' SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+        EXECUTE 'ALTER TABLE ' || quote_ident(referencing)
+            || ' ENABLE TRIGGER USER';
+    END LOOP;
+    -- A finalized reservation outlives the expense it was turned into
+    ALTER TABLE grant_reservation DISABLE TRIGGER USER;
+    UPDATE grant_reservation SET expense_id = NULL
+    WHERE expense_id IN (
+        SELECT id FROM grant_expense
+        WHERE date >= lower_bound AND date < upper_bound
+    );
+    ALTER TABLE grant_reservation ENABLE TRIGGER USER;
+
+    EXECUTE 'ALTER TABLE grant_expense DETACH PARTITION '
+        || quote_ident(partition_name);
+    EXECUTE 'ALTER TABLE ' || quote_ident(partition_name)
+        || ' RENAME TO ' || quote_ident(archive);
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A referenced expense must exist, it is locked like a foreign key check
+-- would lock it
+CREATE OR REPLACE FUNCTION grant_expense_reference_check() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.expense_id IS NOT NULL THEN
+        PERFORM 1 FROM grant_expense WHERE id = NEW.expense_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = 'insert or update on table "' || TG_TABLE_NAME
+                    || '" violates the reference to grant_expense',
+                DETAIL = 'Key (expense_id)=(' || NEW.expense_id
+                    || ') is not present in table "grant_expense".';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A referenced expense cannot be deleted. An update moving an expense to
+-- another partition also fires the delete, the expense still exists then.
+CREATE OR REPLACE FUNCTION grant_expense_reference_restrict() RETURNS TRIGGER AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM grant_expense WHERE id = OLD.id) THEN
+        RETURN NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM grant_expense_allocation WHERE expense_id = OLD.id)
+        OR EXISTS (SELECT 1 FROM grant_approval WHERE expense_id = OLD.id)
+        OR EXISTS (SELECT 1 FROM grant_reservation WHERE expense_id = OLD.id)
+    THEN
+        RAISE foreign_key_violation USING
+            MESSAGE = 'delete on table "grant_expense" violates a reference'
+                || ' to the expense',
+            DETAIL = 'Key (id)=(' || OLD.id || ') is still referenced.';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_expense_allocation;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_approval;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_check ON grant_reservation;
+CREATE TRIGGER grant_expense_reference_check
+    BEFORE INSERT OR UPDATE OF expense_id ON grant_reservation
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_check();
+
+DROP TRIGGER IF EXISTS grant_expense_reference_restrict ON grant_expense;
+CREATE TRIGGER grant_expense_reference_restrict
+    AFTER DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_expense_reference_restrict();
+
+SELECT grant_expense_maintain_partitions(1);
+"""
+
+event.listen(SQLModel.metadata, "after_create", DDL(PARTITION_SQL))
+
+
+def maintain_expense_partitions(session: Session, years_ahead: int = 1) -> int:
+    """
+    Create the partitions of the current and the next years and of the
+    years found in the default partition. The caller commits.
+    """
+    return session.exec(
+        text("SELECT grant_expense_maintain_partitions(:years_ahead)"),
+        params={"years_ahead": years_ahead},
+    ).scalar_one()
+
+
+def detach_expense_partition(session: Session, year: int) -> Optional[str]:
+    """
+    Detach the partition of a year from grant_expense, keeping its rows in
+    the returned archive table. Returns None when the year has no partition.
+    The expenses of the year disappear from every query but stay counted in
+    the balances of their grants through grant_balance_carryover, their
+    allocations and approvals are archived next to them.
+    Raises when the year counts towards an active budget rule. The caller
+    commits.
+    """
+    return session.exec(
+        text("SELECT grant_expense_detach_partition(:year)"),
+        params={"year": year},
+    ).scalar_one()
+
+
+def list_expense_partitions(session: Session) -> List[GrantExpensePartition]:
+    """The partitions attached to grant_expense, ordered by name."""
+    rows = session.exec(
+        text(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'grant_expense'::regclass
+            ORDER BY c.relname
+            """
+        )
+    ).all()
+    return [
+        GrantExpensePartition(
+            name=name, bound=bound, estimated_rows=max(int(reltuples), 0)
+        )
+        for name, bound, reltuples in rows
+    ]
+
+
+class PartitionMaintainer:
+    """
+    Thread creating the coming years' partitions ahead of time, so expenses
+    of a new year never land in the default partition.
+    """
+
+    def __init__(self, interval_seconds: float = 6 * 3600, years_ahead: int = 1):
+        self.interval_seconds = interval_seconds
+        self.years_ahead = years_ahead
+        self._stop = Event()
+        self._thread = Thread(
+            target=self._run, name="partition-maintainer", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with Session(engine) as session:
+                    created = maintain_expense_partitions(session, self.years_ahead)
+                    session.commit()
+                if created:
+                    logger.info(f"Created {created} grant expense partitions")
+            except SQLAlchemyError as e:
+                logger.warning(f"Grant expense partition maintenance failed: {e}")
+            self._stop.wait(self.interval_seconds)
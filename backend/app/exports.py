@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Sequence
+from uuid import UUID
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import String, cast
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, func, select
+
+from app.models import (
+    ExpenseExportFormat,
+    GrantApproval,
+    GrantCategory,
+    GrantExpense,
+    User,
+)
+from app.permissions import GrantPermission, GrantRole
+
+# Rows fetched from the server-side cursor at a time
+EXPORT_BATCH_SIZE = 1000
+# Rows per record batch of the columnar exports, one Parquet row group each
+COLUMNAR_BATCH_SIZE = 50000
+
+EXPORT_COLUMNS = [
+    GrantExpense.id,
+    GrantExpense.grant_id,
+    GrantExpense.date,
+    GrantExpense.amount,
+    GrantExpense.category,
+    GrantExpense.description,
+    GrantExpense.invoice_number,
+    GrantExpense.created_by,
+    GrantExpense.created_at,
+]
+
+# Status of the latest review of an expense, pending before the first one
+_approval_status = (
+    select(func.lower(cast(GrantApproval.status, String)))
+    .where(GrantApproval.expense_id == GrantExpense.id)
+    .order_by(GrantApproval.created_at.desc())
+    .limit(1)
+    .scalar_subquery()
+)
+
+# The columnar exports are typed in SQL, so the batches need no conversion
+COLUMNAR_COLUMNS = [
+    cast(GrantExpense.id, String).label("id"),
+    cast(GrantExpense.grant_id, String).label("grant_id"),
+    GrantExpense.date,
+    GrantExpense.amount,
+    GrantExpense.category,
+    GrantCategory.name.label("category_name"),
+    GrantExpense.description,
+    GrantExpense.invoice_number,
+    func.coalesce(_approval_status, "pending").label("approval_status"),
+    cast(GrantExpense.created_by, String).label("created_by"),
+    GrantExpense.created_at,
+]
+
+COLUMNAR_SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.string(), nullable=False),
+        pa.field("grant_id", pa.string(), nullable=False),
+        pa.field("date", pa.timestamp("us", tz="UTC"), nullable=False),
+        pa.field("amount", pa.float64(), nullable=False),
+        pa.field("category", pa.string(), nullable=False),
+        pa.field("category_name", pa.string(), nullable=False),
+        pa.field("description", pa.string(), nullable=False),
+        pa.field("invoice_number", pa.string()),
+        pa.field("approval_status", pa.string(), nullable=False),
+        pa.field("created_by", pa.string(), nullable=False),
+        pa.field("created_at", pa.timestamp("us", tz="UTC"), nullable=False),
+    ]
+)
+
+MEDIA_TYPES = {
+    ExpenseExportFormat.CSV: "text/csv",
+    ExpenseExportFormat.NDJSON: "application/x-ndjson",
+    ExpenseExportFormat.ARROW: "application/vnd.apache.arrow.stream",
+    ExpenseExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+COLUMNAR_FORMATS = {ExpenseExportFormat.ARROW, ExpenseExportFormat.PARQUET}
+
+
+def export_statement(
+    user: User,
+    grant_id: Optional[UUID] = None,
+    export_format: ExpenseExportFormat = ExpenseExportFormat.CSV,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> Any:
+    """
+    Select the expense columns of the export, restricted to the grants the
+    user has the GrantPermission.VIEW_EXPENSES on unless they are a
+    superuser. The columnar formats add the category name and the approval
+    status. The inclusive date and created_at windows are scanned through
+    the BRIN indexes of those columns.
+    """
+    if export_format in COLUMNAR_FORMATS:
+        statement = select(*COLUMNAR_COLUMNS).join_from(
+            GrantExpense, GrantCategory, GrantCategory.code == GrantExpense.category
+        )
+    else:
+        statement = select(*EXPORT_COLUMNS)
+    statement = statement.order_by(GrantExpense.created_at, GrantExpense.id)
+    if not user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(GrantExpense.grant_id.in_(subquery))
+    if grant_id is not None:
+        statement = statement.where(GrantExpense.grant_id == grant_id)
+    if date_from is not None:
+        statement = statement.where(GrantExpense.date >= date_from)
+    if date_to is not None:
+        statement = statement.where(GrantExpense.date <= date_to)
+    if created_from is not None:
+        statement = statement.where(GrantExpense.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(GrantExpense.created_at <= created_to)
+    return statement
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def _export_values(rows: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    return [[_export_value(value) for value in row] for row in rows]
+
+
+def stream_rows(
+    bind: Engine, statement: Any, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[Sequence[Sequence[Any]]]:
+    """
+    Run a select on a server-side cursor and yield its rows in batches. The
+    export has its own session, the request's session is closed before a
+    streamed response is sent.
+    """
+    with Session(bind) as session:
+        result = session.exec(statement.execution_options(yield_per=batch_size))
+        yield from result.partitions()
+
+
+def stream_csv(bind: Engine, statement: Any) -> Iterator[str]:
+    """Stream the rows of a select as CSV with a header row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+    for rows in stream_rows(bind, statement):
+        writer.writerows(_export_values(rows))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(bind: Engine, statement: Any) -> Iterator[str]:
+    """Stream the rows of a select as one JSON object per line."""
+    keys = [column.key for column in EXPORT_COLUMNS]
+    for rows in stream_rows(bind, statement):
+        yield "".join(
+            json.dumps(dict(zip(keys, row))) + "\n" for row in _export_values(rows)
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file keeping what was written until it is drained."""
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _record_batch(rows: Sequence[Sequence[Any]]) -> pa.RecordBatch:
+    """Build a record batch column by column from the rows of one fetch."""
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, COLUMNAR_SCHEMA)
+        ],
+        schema=COLUMNAR_SCHEMA,
+    )
+
+
+def stream_columnar(
+    bind: Engine, statement: Any, export_format: ExpenseExportFormat
+) -> Iterator[bytes]:
+    """
+    Stream the rows of a select as an Arrow IPC stream or a Parquet file,
+    one record batch (row group) per fetch from the cursor.
+    """
+    sink = _ChunkSink()
+    if export_format == ExpenseExportFormat.PARQUET:
+        writer = pq.ParquetWriter(sink, COLUMNAR_SCHEMA, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, COLUMNAR_SCHEMA)
+    for rows in stream_rows(bind, statement, COLUMNAR_BATCH_SIZE):
+        writer.write_batch(_record_batch(rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(
+    bind: Engine, statement: Any, export_format: ExpenseExportFormat
+) -> Iterator:
+    """Stream the rows of a select in the requested format."""
+    if export_format in COLUMNAR_FORMATS:
+        return stream_columnar(bind, statement, export_format)
+    if export_format == ExpenseExportFormat.CSV:
+        return stream_csv(bind, statement)
+    return stream_ndjson(bind, statement)
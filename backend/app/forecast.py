@@ -0,0 +1,179 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, func, select
+
+from app.core.db import engine
+from app.ledger import grant_expense_share
+from app.models import (
+    ApprovalStatus,
+    Grant,
+    GrantApproval,
+    GrantForecast,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+SECONDS_PER_DAY = 86400.0
+# Rows per upsert statement, keeps the bind parameters under Postgres' limit
+UPSERT_CHUNK_SIZE = 1000
+
+
+def fit_burn_rates(
+    group: np.ndarray, days: np.ndarray, amounts: np.ndarray, n_groups: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a linear spend curve through the origin for every grant at once.
+
+    `group` holds the grant index of each daily spend, sorted ascending, and
+    `days` the day of the spend relative to the grant start, ascending within
+    each grant. Returns the burn rate (spend per day) and the total spend of
+    each grant.
+    """
+    # Cumulative spend within each grant
+    cumulative = np.cumsum(amounts)
+    starts = np.flatnonzero(np.r_[True, np.diff(group) != 0])
+    lengths = np.diff(np.r_[starts, len(group)])
+    cumulative -= np.repeat(cumulative[starts] - amounts[starts], lengths)
+
+    # Least squares slope of cumulative = rate * t, spend on the first day
+    # counts as one day of burn
+    t = np.maximum(days, 1.0)
+    numerator = np.bincount(group, weights=t * cumulative, minlength=n_groups)
+    denominator = np.bincount(group, weights=t * t, minlength=n_groups)
+    rate = np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(n_groups),
+        where=denominator > 0,
+    )
+    rate = np.maximum(rate, 0.0)
+    spent = np.bincount(group, weights=amounts, minlength=n_groups)
+    return rate, spent
+
+
+def _daily_spend_statement():
+    """
+    Select the daily spend of every grant from the expense shares, approved
+    and pending expenses only, along with the grant figures needed for the
+    forecast. Grants without expenses get a single row without a day.
+    """
+    share = grant_expense_share
+    day = func.date_trunc("day", share.c.date)
+    spend = (
+        select(
+            share.c.grant_id,
+            day.label("day"),
+            func.sum(share.c.amount).label("amount"),
+        )
+        .join(
+            GrantApproval, share.c.expense_id == GrantApproval.expense_id, isouter=True
+        )
+        .where(
+            GrantApproval.id.is_(None)
+            | (GrantApproval.status != ApprovalStatus.REJECTED)
+        )
+        .group_by(share.c.grant_id, day)
+        .subquery()
+    )
+    epoch = func.extract("epoch", Grant.start_date)
+    return (
+        select(
+            func.dense_rank().over(order_by=Grant.id) - 1,
+            Grant.id,
+            Grant.total_amount,
+            epoch,
+            (func.extract("epoch", Grant.end_date) - epoch) / SECONDS_PER_DAY,
+            func.coalesce(
+                (func.extract("epoch", spend.c.day) - epoch) / SECONDS_PER_DAY, 0.0
+            ),
+            func.coalesce(spend.c.amount, 0.0),
+        )
+        .join(spend, spend.c.grant_id == Grant.id, isouter=True)
+        .order_by(Grant.id, spend.c.day)
+    )
+
+
+def compute_forecasts(session: Session) -> List[GrantForecast]:
+    """
+    Forecast every grant from its dated expense history in one batch.
+    """
+    rows = session.exec(_daily_spend_statement()).all()
+    if not rows:
+        return []
+    columns = list(zip(*rows))
+    group = np.asarray(columns[0], dtype=np.int64)
+    grant_ids = columns[1]
+    total = np.asarray(columns[2], dtype=float)
+    start = np.asarray(columns[3], dtype=float)
+    duration = np.asarray(columns[4], dtype=float)
+    days = np.asarray(columns[5], dtype=float)
+    amounts = np.asarray(columns[6], dtype=float)
+
+    n_groups = int(group[-1]) + 1
+    first = np.flatnonzero(np.r_[True, np.diff(group) != 0])
+    rate, spent = fit_burn_rates(group, days, amounts, n_groups)
+    total, start, duration = total[first], start[first], duration[first]
+
+    exhaustion_days = np.divide(
+        total, rate, out=np.full(n_groups, np.inf), where=rate > 0
+    )
+    exhausts_before_end = exhaustion_days < duration
+    projected_end_spend = rate * np.maximum(duration, 0.0)
+    exhaustion = start + exhaustion_days * SECONDS_PER_DAY
+
+    computed_at = datetime.now(timezone.utc)
+    epoch = datetime.fromtimestamp(0, timezone.utc)
+    return [
+        GrantForecast(
+            grant_id=grant_ids[row],
+            burn_rate=float(rate[i]),
+            spent_amount=float(spent[i]),
+            projected_end_spend=float(projected_end_spend[i]),
+            exhaustion_date=epoch + timedelta(seconds=float(exhaustion[i]))
+            if np.isfinite(exhaustion[i])
+            else None,
+            exhausts_before_end=bool(exhausts_before_end[i]),
+            computed_at=computed_at,
+        )
+        for i, row in enumerate(first)
+    ]
+
+
+def refresh_forecasts(session: Session) -> int:
+    """
+    Recompute the forecast of every grant and store it in grant_forecast.
+    Returns the number of grants forecast.
+    """
+    forecasts = compute_forecasts(session)
+    for offset in range(0, len(forecasts), UPSERT_CHUNK_SIZE):
+        chunk = forecasts[offset : offset + UPSERT_CHUNK_SIZE]
+        statement = insert(GrantForecast).values(
+            [forecast.model_dump() for forecast in chunk]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[GrantForecast.grant_id],
+            set_={
+                column: statement.excluded[column]
+                for column in GrantForecast.model_fields
+                if column != "grant_id"
+            },
+        )
+        session.exec(statement)
+    session.commit()
+    return len(forecasts)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Computing grant forecasts")
+    with Session(engine) as session:
+        count = refresh_forecasts(session)
+    logger.info(f"Computed {count} grant forecasts")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import logging
 from sqlmodel import Session
 
 from app.core.db import engine, init_db
+from app.rules import rebuild_triggers
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,6 +12,9 @@ logger = logging.getLogger(__name__)
 def init() -> None:
     with Session(engine) as session:
         init_db(session)
+        # Pick up changes to the generated rule SQL after an upgrade
+        count = rebuild_triggers(session)
+        logger.info(f"Rebuilt the triggers of {count} rules")
 
 
 def main() -> None:
@@ -0,0 +1,566 @@
+from logging import getLogger
+from typing import List, Optional
+from uuid import UUID
+
+from sqlalchemy import (
+    DDL,
+    TIMESTAMP,
+    Float,
+    String,
+    Uuid,
+    column,
+    event,
+    literal,
+    table,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel, func, select
+
+from app.models import (
+    ApprovalStatus,
+    Grant,
+    GrantApproval,
+    GrantBalance,
+    GrantBalanceCarryover,
+    GrantBalanceDrift,
+    GrantExpense,
+    GrantReservation,
+    ReservationStatus,
+)
+
+logger = getLogger("uvicorn.error")
+
+# Balances are stored as floats, ignore drift below a cent
+DRIFT_TOLERANCE = 0.005
+
+# First key of the per grant advisory locks, keeps them apart from any other
+# advisory locks taken on the database
+GRANT_LOCK_CLASS = 7301
+
+# Functions and triggers keeping grant_balance in sync with its source rows.
+# They run inside the writing transaction, so a rolled back expense or
+# approval never reaches the ledger. Every change bumps the grant version,
+# which keys the projection cache.
+LEDGER_SQL = """
+-- The part of every expense charged to each grant: what is left of the
+-- expense on its own grant after its allocations, plus one row per allocation
+CREATE OR REPLACE VIEW grant_expense_share AS
+SELECT
+    e.id AS expense_id,
+    e.grant_id,
+    e.amount - COALESCE((
+        SELECT SUM(a.amount) FROM grant_expense_allocation a
+        WHERE a.expense_id = e.id
+    ), 0) AS amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense e
+UNION ALL
+SELECT
+    e.id AS expense_id,
+    a.grant_id,
+    a.amount,
+    e.date,
+    e.category,
+    e.description,
+    e.invoice_number,
+    e.created_by,
+    e.created_at
+FROM grant_expense_allocation a
+JOIN grant_expense e ON e.id = a.expense_id;
+
+CREATE OR REPLACE FUNCTION grant_balance_apply(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION,
+    p_status TEXT,
+    p_spent DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (
+        p_grant_id,
+        CASE WHEN p_status = 'APPROVED' THEN p_amount ELSE 0 END,
+        CASE WHEN p_status IS NULL THEN p_amount ELSE 0 END,
+        p_spent,
+        1,
+        now()
+    )
+    ON CONFLICT (grant_id) DO UPDATE SET
+        committed_amount = b.committed_amount + EXCLUDED.committed_amount,
+        pending_amount = b.pending_amount + EXCLUDED.pending_amount,
+        spent_amount = b.spent_amount + EXCLUDED.spent_amount,
+        version = b.version + 1,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_reserve(
+    p_grant_id UUID,
+    p_amount DOUBLE PRECISION
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO grant_balance AS b (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        reserved_amount, version, updated_at
+    )
+    VALUES (p_grant_id, 0, 0, 0, p_amount, 1, now())
+    ON CONFLICT (grant_id) DO UPDATE SET
+        reserved_amount = b.reserved_amount + EXCLUDED.reserved_amount,
+        version = b.version + 1,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Take the advisory lock of every grant a write touches (key class 7301 is
+-- GRANT_LOCK_CLASS) before any grant_balance row is locked, so application
+-- code holding a grant lock and trigger code always lock in the same order
+CREATE OR REPLACE FUNCTION grant_balance_lock() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_advisory_xact_lock(7301, hashtext(OLD.grant_id::TEXT));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_advisory_xact_lock(7301, hashtext(NEW.grant_id::TEXT));
+    END IF;
+    -- An allocation also moves money on its expense's own grant
+    IF TG_TABLE_NAME = 'grant_expense_allocation' THEN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_advisory_xact_lock(7301, hashtext(e.grant_id::TEXT))
+            FROM grant_expense e WHERE e.id = OLD.expense_id;
+        ELSE
+            PERFORM pg_advisory_xact_lock(7301, hashtext(e.grant_id::TEXT))
+            FROM grant_expense e WHERE e.id = NEW.expense_id;
+        END IF;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_open() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO grant_balance (
+        grant_id, committed_amount, pending_amount, spent_amount,
+        version, updated_at
+    )
+    VALUES (NEW.id, 0, 0, 0, 1, now())
+    ON CONFLICT (grant_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_bump() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM grant_balance_apply(NEW.id, 0, NULL, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An expense only charges its own grant with what its allocations leave over
+CREATE OR REPLACE FUNCTION grant_balance_expense_sync() RETURNS TRIGGER AS $$
+DECLARE
+    review TEXT;
+    allocated DOUBLE PRECISION;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = OLD.id LIMIT 1;
+        SELECT COALESCE(SUM(amount), 0) INTO allocated
+        FROM grant_expense_allocation WHERE expense_id = OLD.id;
+        PERFORM grant_balance_apply(
+            OLD.grant_id, allocated - OLD.amount, review, allocated - OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT status::TEXT INTO review
+        FROM grant_approval WHERE expense_id = NEW.id LIMIT 1;
+        SELECT COALESCE(SUM(amount), 0) INTO allocated
+        FROM grant_expense_allocation WHERE expense_id = NEW.id;
+        PERFORM grant_balance_apply(
+            NEW.grant_id, NEW.amount - allocated, review, NEW.amount - allocated);
+    END IF;
+    -- Count the expenses owned by each grant for list estimates
+    IF TG_OP = 'DELETE'
+        OR (TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id)
+    THEN
+        UPDATE grant_balance SET expense_count = expense_count - 1
+        WHERE grant_id = OLD.grant_id;
+    END IF;
+    IF TG_OP = 'INSERT'
+        OR (TG_OP = 'UPDATE' AND OLD.grant_id IS DISTINCT FROM NEW.grant_id)
+    THEN
+        UPDATE grant_balance SET expense_count = expense_count + 1
+        WHERE grant_id = NEW.grant_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only held reservations count towards the reserved amount
+CREATE OR REPLACE FUNCTION grant_balance_reservation_sync() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status::TEXT = 'HELD' THEN
+        PERFORM grant_balance_reserve(OLD.grant_id, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status::TEXT = 'HELD' THEN
+        PERFORM grant_balance_reserve(NEW.grant_id, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move an allocated amount between the expense's own grant and the
+-- allocation's grant
+CREATE OR REPLACE FUNCTION grant_balance_allocation_sync() RETURNS TRIGGER AS $$
+DECLARE
+    expense_grant_id UUID;
+    review TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT e.grant_id, (
+            SELECT status::TEXT FROM grant_approval
+            WHERE expense_id = e.id LIMIT 1
+        ) INTO expense_grant_id, review
+        FROM grant_expense e WHERE e.id = OLD.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                OLD.grant_id, -OLD.amount, review, -OLD.amount);
+            PERFORM grant_balance_apply(
+                expense_grant_id, OLD.amount, review, OLD.amount);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT e.grant_id, (
+            SELECT status::TEXT FROM grant_approval
+            WHERE expense_id = e.id LIMIT 1
+        ) INTO expense_grant_id, review
+        FROM grant_expense e WHERE e.id = NEW.expense_id;
+        IF FOUND THEN
+            PERFORM grant_balance_apply(
+                expense_grant_id, -NEW.amount, review, -NEW.amount);
+            PERFORM grant_balance_apply(
+                NEW.grant_id, NEW.amount, review, NEW.amount);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION grant_balance_approval_sync() RETURNS TRIGGER AS $$
+DECLARE
+    share RECORD;
+BEGIN
+    -- Move every share of the expense back to pending for the old review...
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.expense_id IS NOT NULL THEN
+        FOR share IN
+            SELECT grant_id, amount FROM grant_expense_share
+            WHERE expense_id = OLD.expense_id
+        LOOP
+            PERFORM grant_balance_apply(
+                share.grant_id, -share.amount, OLD.status::TEXT, 0);
+            PERFORM grant_balance_apply(share.grant_id, share.amount, NULL, 0);
+        END LOOP;
+    END IF;
+    -- ...and out of pending for the new one
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.expense_id IS NOT NULL THEN
+        FOR share IN
+            SELECT grant_id, amount FROM grant_expense_share
+            WHERE expense_id = NEW.expense_id
+        LOOP
+            PERFORM grant_balance_apply(share.grant_id, -share.amount, NULL, 0);
+            PERFORM grant_balance_apply(
+                share.grant_id, share.amount, NEW.status::TEXT, 0);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grant_balance_open ON "grant";
+CREATE TRIGGER grant_balance_open
+    AFTER INSERT ON "grant"
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_open();
+
+DROP TRIGGER IF EXISTS grant_balance_bump ON "grant";
+CREATE TRIGGER grant_balance_bump
+    AFTER UPDATE OF total_amount ON "grant"
+    FOR EACH ROW
+    WHEN (OLD.total_amount IS DISTINCT FROM NEW.total_amount)
+    EXECUTE FUNCTION grant_balance_bump();
+
+DROP TRIGGER IF EXISTS grant_balance_lock ON grant_expense;
+CREATE TRIGGER grant_balance_lock
+    BEFORE INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_lock();
+
+DROP TRIGGER IF EXISTS grant_balance_lock ON grant_expense_allocation;
+CREATE TRIGGER grant_balance_lock
+    BEFORE INSERT OR UPDATE OR DELETE ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_lock();
+
+DROP TRIGGER IF EXISTS grant_balance_lock ON grant_reservation;
+CREATE TRIGGER grant_balance_lock
+    BEFORE INSERT OR UPDATE OR DELETE ON grant_reservation
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_lock();
+
+DROP TRIGGER IF EXISTS grant_balance_expense_sync ON grant_expense;
+CREATE TRIGGER grant_balance_expense_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_expense_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_allocation_sync ON grant_expense_allocation;
+CREATE TRIGGER grant_balance_allocation_sync
+    AFTER INSERT OR UPDATE OR DELETE ON grant_expense_allocation
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_allocation_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_reservation_sync ON grant_reservation;
+CREATE TRIGGER grant_balance_reservation_sync
+    AFTER INSERT OR UPDATE OF grant_id, amount, status OR DELETE
+    ON grant_reservation
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_reservation_sync();
+
+DROP TRIGGER IF EXISTS grant_balance_approval_sync ON grant_approval;
+CREATE TRIGGER grant_balance_approval_sync
+    AFTER INSERT OR UPDATE OF expense_id, status OR DELETE ON grant_approval
+    FOR EACH ROW EXECUTE FUNCTION grant_balance_approval_sync();
+"""
+
+# Read only view over the grant_expense_share view defined above
+grant_expense_share = table(
+    "grant_expense_share",
+    column("expense_id", Uuid),
+    column("grant_id", Uuid),
+    column("amount", Float),
+    column("date", TIMESTAMP(timezone=True)),
+    column("category", String),
+    column("description", String),
+    column("invoice_number", String),
+    column("created_by", Uuid),
+    column("created_at", TIMESTAMP(timezone=True)),
+)
+
+# Install the ledger triggers whenever the schema is created from the models
+# (the migrations install them for deployed databases).
+event.listen(SQLModel.metadata, "after_create", DDL(LEDGER_SQL))
+
+
+def _carried(amount):
+    """Sum a carryover column over the detached years of the outer grant."""
+    return (
+        select(func.coalesce(func.sum(amount), 0.0))
+        .where(GrantBalanceCarryover.grant_id == Grant.id)
+        .scalar_subquery()
+    )
+
+
+def expected_balances_statement(grant_ids: Optional[List[UUID]] = None):
+    """
+    Recompute the ledger columns for every grant (or the given grants)
+    from the expense shares, their approvals, the held reservations and
+    the expenses each grant owns with one grouped query. The spend of
+    detached years is added from their carryover rows.
+    """
+    share = grant_expense_share
+    committed = func.coalesce(
+        func.sum(share.c.amount).filter(
+            GrantApproval.status == ApprovalStatus.APPROVED
+        ),
+        0.0,
+    ) + _carried(GrantBalanceCarryover.committed_amount)
+    pending = func.coalesce(
+        func.sum(share.c.amount).filter(
+            share.c.expense_id.isnot(None), GrantApproval.id.is_(None)
+        ),
+        0.0,
+    ) + _carried(GrantBalanceCarryover.pending_amount)
+    spent = func.coalesce(func.sum(share.c.amount), 0.0) + _carried(
+        GrantBalanceCarryover.spent_amount
+    )
+    reserved = (
+        select(func.coalesce(func.sum(GrantReservation.amount), 0.0))
+        .where(GrantReservation.grant_id == Grant.id)
+        .where(GrantReservation.status == ReservationStatus.HELD)
+        .scalar_subquery()
+    )
+    expense_count = (
+        select(func.count(GrantExpense.id))
+        .where(GrantExpense.grant_id == Grant.id)
+        .scalar_subquery()
+    )
+    statement = (
+        select(
+            Grant.id.label("grant_id"),
+            committed.label("committed_amount"),
+            pending.label("pending_amount"),
+            spent.label("spent_amount"),
+            reserved.label("reserved_amount"),
+            expense_count.label("expense_count"),
+        )
+        .select_from(Grant)
+        .join(share, share.c.grant_id == Grant.id, isouter=True)
+        .join(
+            GrantApproval, share.c.expense_id == GrantApproval.expense_id, isouter=True
+        )
+        .group_by(Grant.id)
+    )
+    if grant_ids is not None:
+        statement = statement.where(Grant.id.in_(grant_ids))
+    return statement
+
+
+def check_grant_balances(
+    session: Session, grant_ids: Optional[List[UUID]] = None
+) -> List[GrantBalanceDrift]:
+    """
+    Compare the stored grant balances with their source rows and
+    return every grant whose ledger has drifted.
+    """
+    expected = expected_balances_statement(grant_ids).subquery()
+    committed = func.coalesce(GrantBalance.committed_amount, 0.0)
+    pending = func.coalesce(GrantBalance.pending_amount, 0.0)
+    spent = func.coalesce(GrantBalance.spent_amount, 0.0)
+    reserved = func.coalesce(GrantBalance.reserved_amount, 0.0)
+    expense_count = func.coalesce(GrantBalance.expense_count, 0)
+    statement = (
+        select(
+            expected.c.grant_id,
+            committed,
+            expected.c.committed_amount,
+            pending,
+            expected.c.pending_amount,
+            spent,
+            expected.c.spent_amount,
+            reserved,
+            expected.c.reserved_amount,
+            expense_count,
+            expected.c.expense_count,
+        )
+        .select_from(expected)
+        .join(GrantBalance, GrantBalance.grant_id == expected.c.grant_id, isouter=True)
+        .where(
+            (GrantBalance.grant_id.is_(None))
+            | (func.abs(committed - expected.c.committed_amount) > DRIFT_TOLERANCE)
+            | (func.abs(pending - expected.c.pending_amount) > DRIFT_TOLERANCE)
+            | (func.abs(spent - expected.c.spent_amount) > DRIFT_TOLERANCE)
+            | (func.abs(reserved - expected.c.reserved_amount) > DRIFT_TOLERANCE)
+            | (expense_count != expected.c.expense_count)
+        )
+    )
+    return [
+        GrantBalanceDrift(
+            grant_id=row[0],
+            committed_amount=row[1],
+            expected_committed_amount=row[2],
+            pending_amount=row[3],
+            expected_pending_amount=row[4],
+            spent_amount=row[5],
+            expected_spent_amount=row[6],
+            reserved_amount=row[7],
+            expected_reserved_amount=row[8],
+            expense_count=row[9],
+            expected_expense_count=row[10],
+        )
+        for row in session.exec(statement).all()
+    ]
+
+
+def repair_grant_balances(
+    session: Session, grant_ids: Optional[List[UUID]] = None
+) -> None:
+    """
+    Overwrite the stored grant balances with values recomputed from
+    their source rows.
+    """
+    expected = expected_balances_statement(grant_ids).subquery()
+    statement = insert(GrantBalance).from_select(
+        [
+            "grant_id",
+            "committed_amount",
+            "pending_amount",
+            "spent_amount",
+            "reserved_amount",
+            "expense_count",
+            "version",
+            "updated_at",
+        ],
+        select(
+            expected.c.grant_id,
+            expected.c.committed_amount,
+            expected.c.pending_amount,
+            expected.c.spent_amount,
+            expected.c.reserved_amount,
+            expected.c.expense_count,
+            literal(1),
+            func.now(),
+        ),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[GrantBalance.grant_id],
+        set_={
+            "committed_amount": statement.excluded.committed_amount,
+            "pending_amount": statement.excluded.pending_amount,
+            "spent_amount": statement.excluded.spent_amount,
+            "reserved_amount": statement.excluded.reserved_amount,
+            "expense_count": statement.excluded.expense_count,
+            "version": GrantBalance.version + 1,
+            "updated_at": func.now(),
+        },
+    )
+    session.exec(statement)
+    session.commit()
+
+
+def lock_grants(session: Session, grant_ids: List[UUID]) -> None:
+    """
+    Take the transaction scoped advisory lock of every given grant, in a
+    fixed order so writers locking several grants cannot deadlock. The
+    grant_balance_lock triggers lock in row order, so writes touching
+    several grants (split expenses, batches) call this before their first
+    write. Writers on other grants are never blocked, the locks are
+    released on commit or rollback.
+    """
+    for grant_id in sorted(set(grant_ids)):
+        session.exec(
+            select(
+                func.pg_advisory_xact_lock(
+                    GRANT_LOCK_CLASS, func.hashtext(str(grant_id))
+                )
+            )
+        )
+
+
+def available_statement(grant_id: UUID):
+    """
+    Select what is left of a grant after its committed and pending expenses
+    and held reservations, no row if the grant does not exist.
+    """
+    held = func.coalesce(
+        GrantBalance.committed_amount
+        + GrantBalance.pending_amount
+        + GrantBalance.reserved_amount,
+        0.0,
+    )
+    return (
+        select(Grant.total_amount - held)
+        .join(GrantBalance, GrantBalance.grant_id == Grant.id, isouter=True)
+        .where(Grant.id == grant_id)
+    )
+
+
+def available_balance(session: Session, grant_id: UUID) -> Optional[float]:
+    """
+    Return what is left of a grant after its committed and pending expenses
+    and held reservations, None if the grant does not exist.
+    """
+    return session.exec(available_statement(grant_id)).first()
+
+
+# End
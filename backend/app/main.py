@@ -1,5 +1,10 @@
+from contextlib import asynccontextmanager
+
 from app.api.main import api_router
+from app.categories import CategoryListener, category_registry
+from app.changes import change_broker
 from app.core.config import settings
+from app.expense_partitions import PartitionMaintainer
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
@@ -9,10 +14,27 @@ def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep this worker's category registry in step with the other workers
+    listener = CategoryListener(category_registry)
+    listener.start()
+    # Create the expense partitions of the coming years ahead of time
+    maintainer = PartitionMaintainer()
+    maintainer.start()
+    # Feed the change streams of this worker from the database notifications
+    change_broker.start()
+    yield
+    change_broker.stop()
+    maintainer.stop()
+    listener.stop()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 origins = [
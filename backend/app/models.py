@@ -4,12 +4,49 @@ from enum import Enum
 from typing import List, Optional
 
 from pydantic import EmailStr
-from sqlalchemy import Column
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    Index,
+    PrimaryKeyConstraint,
+    UniqueConstraint,
+    event,
+)
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlmodel import TIMESTAMP, Field, SQLModel, String
 
 from app.utils import get_utc_now
 
+# The trigram indexes of the search need pg_trgm before the tables are created
+event.listen(
+    SQLModel.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
+
+
+def trigram_index(table: str, column: str) -> Index:
+    """GIN trigram index serving ILIKE '%...%' and similarity searches."""
+    return Index(
+        f"ix_{table}_{column}_trgm",
+        column,
+        postgresql_using="gin",
+        postgresql_ops={column: "gin_trgm_ops"},
+    )
+
+
+def brin_index(table: str, column: str) -> Index:
+    """
+    BRIN index serving range scans on a column that grows with the insert
+    order. It stores one summary per 32 pages instead of an entry per row,
+    new ranges are summarized by autovacuum.
+    """
+    return Index(
+        f"ix_{table}_{column}_brin",
+        column,
+        postgresql_using="brin",
+        postgresql_with={"pages_per_range": 32, "autosummarize": "on"},
+    )
+
 
 # Generic message
 class Message(SQLModel):
@@ -64,7 +101,8 @@ class UserPublic(UserBase):
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
 
 
 # JSON payload containing access token
@@ -186,6 +224,7 @@ class Rule(RuleBase, table=True):
     """Rule Table Model."""
 
     __tablename__ = "rule"
+    __table_args__ = (Index("ix_rule_created_at_id", "created_at", "id"),)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     created_at: datetime = Field(
         default_factory=get_utc_now,
@@ -222,7 +261,8 @@ class RulesPublic(SQLModel):
     """Public model for list of rules."""
 
     data: List[RulePublic]
-    count: int
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
 
 
 class GrantBase(SQLModel):
@@ -245,6 +285,12 @@ class Grant(GrantBase, table=True):
     """Grant Table Model."""
 
     __tablename__ = "grant"
+    __table_args__ = (
+        Index("ix_grant_created_at_id", "created_at", "id"),
+        Index("ix_grant_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        trigram_index("grant", "title"),
+        trigram_index("grant", "funding_agency"),
+    )
     owner_id: uuid.UUID = Field(foreign_key="user.id")
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     created_at: datetime = Field(
@@ -297,7 +343,7 @@ class GrantExpenseBase(SQLModel):
         foreign_key="grant_category.code"
     )  # e.g., "SAL" for salary, "TRV" for travel, "EQP" for equipment
     invoice_number: Optional[str] = Field(default=None)
-    grant_id: uuid.UUID = Field(foreign_key="grant.id")
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", index=True)
 
 
 class ApprovalStatus(str, Enum):
@@ -307,11 +353,46 @@ class ApprovalStatus(str, Enum):
     REJECTED = "rejected"
 
 
+class ExpenseStatus(str, Enum):
+    """Enum for the review state of an expense, pending until approved."""
+
+    PENDING = "pending"
+    APPROVED = "approved"
+    REJECTED = "rejected"
+
+
 class GrantExpense(GrantExpenseBase, table=True):
-    """Grant Expense Table Model."""
+    """
+    Grant Expense Table Model. The table is range partitioned by date into
+    yearly partitions (see app/expense_partitions.py), so its primary key
+    includes the date while expenses are still identified by their id.
+    """
 
     __tablename__ = "grant_expense"
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "date"),
+        Index("ix_grant_expense_created_at_id", "created_at", "id"),
+        Index("ix_grant_expense_date_id", "date", "id"),
+        Index(
+            "ix_grant_expense_grant_id_created_at_id", "grant_id", "created_at", "id"
+        ),
+        Index("ix_grant_expense_grant_id_date_id", "grant_id", "date", "id"),
+        Index(
+            "ix_grant_expense_grant_id_category_date_id",
+            "grant_id",
+            "category",
+            "date",
+            "id",
+        ),
+        Index("ix_grant_expense_grant_id_amount_id", "grant_id", "amount", "id"),
+        trigram_index("grant_expense", "description"),
+        trigram_index("grant_expense", "invoice_number"),
+        brin_index("grant_expense", "date"),
+        brin_index("grant_expense", "created_at"),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+    __mapper_args__ = {"primary_key": ["id"]}
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, nullable=False)
     created_at: datetime = Field(
         default_factory=get_utc_now,
         sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
@@ -323,10 +404,54 @@ class GrantExpense(GrantExpenseBase, table=True):
     created_by: uuid.UUID = Field(foreign_key="user.id")
 
 
+class GrantExpenseAllocationBase(SQLModel):
+    """Base Grant Expense Allocation Model."""
+
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", index=True)
+    percentage: Optional[float] = Field(default=None, gt=0, le=100)
+
+
+class GrantExpenseAllocationCreate(GrantExpenseAllocationBase):
+    """
+    Part of an expense charged to another grant, given either as an amount
+    or as a percentage of the expense.
+    """
+
+    amount: Optional[float] = Field(default=None, gt=0)
+
+
+class GrantExpenseCreate(GrantExpenseBase):
+    """Model for creating a new grant expense."""
+
+    allocations: List[GrantExpenseAllocationCreate] = Field(default_factory=list)
+
+
+class GrantExpenseAllocation(GrantExpenseAllocationBase, table=True):
+    """
+    Grant Expense Allocation Table Model. The expense's own grant is charged
+    whatever the allocations of the expense leave over.
+    """
+
+    __tablename__ = "grant_expense_allocation"
+    __table_args__ = (UniqueConstraint("expense_id", "grant_id"),)
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    # References to the partitioned grant_expense are checked by triggers
+    expense_id: uuid.UUID = Field()
+    amount: float = Field()
+    created_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+    updated_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
 class GrantApprovalBase(SQLModel):
     """Base Grant Approval Model."""
 
-    expense_id: Optional[uuid.UUID] = Field(foreign_key="grant_expense.id")
+    expense_id: Optional[uuid.UUID] = Field(index=True)
     status: ApprovalStatus = Field(default="approved")  # approved, rejected
     comments: Optional[str] = Field(default=None)
 
@@ -335,6 +460,7 @@ class GrantApproval(GrantApprovalBase, table=True):
     """Grant Approval Table Model."""
 
     __tablename__ = "grant_approval"
+    __table_args__ = (Index("ix_grant_approval_created_at_id", "created_at", "id"),)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     created_at: datetime = Field(
         default_factory=get_utc_now,
@@ -365,6 +491,14 @@ class GrantExpensePublic(GrantExpenseBase):
     created_by: uuid.UUID
 
 
+class GrantExpenseAllocationPublic(GrantExpenseAllocationBase):
+    id: uuid.UUID
+    expense_id: uuid.UUID
+    amount: float
+    created_at: datetime
+    updated_at: datetime
+
+
 class GrantApprovalPublic(GrantApprovalBase):
     id: uuid.UUID
     created_at: datetime
@@ -374,22 +508,31 @@ class GrantApprovalPublic(GrantApprovalBase):
 # List response models
 class GrantsPublic(SQLModel):
     data: list[GrantPublic]
-    count: int
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
 
 
 class GrantCategoriesPublic(SQLModel):
     data: list[GrantCategoryPublic]
-    count: int
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
 
 
 class GrantExpensesPublic(SQLModel):
     data: list[GrantExpensePublic]
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
+
+
+class GrantExpenseAllocationsPublic(SQLModel):
+    data: list[GrantExpenseAllocationPublic]
     count: int
 
 
 class GrantApprovalsPublic(SQLModel):
     data: list[GrantApprovalPublic]
-    count: int
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
 
 
 class GrantRoleType(str, Enum):
@@ -420,7 +563,7 @@ class GrantRoleBase(SQLModel):
     """Base Grant Role Model."""
 
     grant_id: uuid.UUID = Field(foreign_key="grant.id")
-    user_id: uuid.UUID = Field(foreign_key="user.id")
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True)
     role_type: GrantRoleType = Field()
     permissions: list[GrantPermission] = Field(
         default_factory=list, sa_column=Column(ARRAY(String()))
@@ -483,4 +626,482 @@ class ExpenseProjection(SQLModel):
     grant_current_remaining_funds: float = Field()
 
 
+class ExpenseProjectionsPublic(SQLModel):
+    """Public model for list of expense projections."""
+
+    data: List[ExpenseProjection]
+    count: int
+
+
+class CategoryExpenseProjection(SQLModel):
+    """Model for the expense projection of a single category."""
+
+    category: Optional[str] = None  # None for the grand total
+    approved_amount: float = Field()
+    pending_amount: float = Field()
+    remaining_amount: Optional[float] = None  # Only known for the grand total
+
+
+class CategoryExpenseProjectionsPublic(SQLModel):
+    """Public model for the per category breakdown of a grant."""
+
+    grant_id: uuid.UUID
+    data: List[CategoryExpenseProjection]
+    total: CategoryExpenseProjection
+
+
+class SpendInterval(str, Enum):
+    """Enum for the periods of a spend report, as date_trunc fields."""
+
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    QUARTER = "quarter"
+    YEAR = "year"
+
+
+class PeriodSpend(SQLModel):
+    """Approved and pending expense shares dated in one period."""
+
+    period: datetime  # Start of the period
+    approved_amount: float
+    pending_amount: float
+
+
+class PeriodSpendsPublic(SQLModel):
+    start_date: datetime
+    end_date: datetime
+    interval: SpendInterval
+    data: List[PeriodSpend]
+    count: int
+
+
+class ExpenseAllocationRequest(SQLModel):
+    """Model for a proposed expense to split across grants."""
+
+    amount: float = Field(gt=0)
+    date: datetime
+    category: str
+    # Candidate grants, every grant the user can submit expenses to if empty
+    grant_ids: List[uuid.UUID] = Field(default_factory=list)
+
+
+class GrantAllocation(SQLModel):
+    """Amount of an expense charged to a single grant."""
+
+    grant_id: uuid.UUID
+    amount: float
+
+
+class AllocationExclusion(SQLModel):
+    """Candidate grant that cannot support the expense."""
+
+    grant_id: uuid.UUID
+    reason: str
+
+
+class AllocationPlan(SQLModel):
+    """A split of an expense across grants."""
+
+    strategy: str
+    feasible: bool
+    allocations: List[GrantAllocation]
+    unallocated_amount: float
+
+
+class AllocationPlansPublic(SQLModel):
+    """Public model for the ranked allocation plans of an expense."""
+
+    data: List[AllocationPlan]
+    count: int
+    excluded: List[AllocationExclusion]
+
+
+class GrantForecastBase(SQLModel):
+    """Base Grant Forecast Model."""
+
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", primary_key=True)
+    burn_rate: float = Field()  # Amount spent per day
+    spent_amount: float = Field()
+    projected_end_spend: float = Field()  # Spend at the grant end date
+    exhaustion_date: Optional[datetime] = Field(
+        default=None, sa_column=Column(TIMESTAMP(timezone=True), nullable=True)
+    )
+    exhausts_before_end: bool = Field(default=False)
+    computed_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantForecast(GrantForecastBase, table=True):
+    """
+    Grant Forecast Table Model.
+    Cache of the last forecast batch, see app.forecast.
+    """
+
+    __tablename__ = "grant_forecast"
+
+
+class GrantForecastPublic(GrantForecastBase):
+    pass
+
+
+class GrantForecastsPublic(SQLModel):
+    data: list[GrantForecastPublic]
+    count: int
+
+
+class GrantBalance(SQLModel, table=True):
+    """
+    Grant Balance Table Model.
+    Maintained by database triggers on grant_expense, grant_approval and
+    grant_reservation, see app.ledger.
+    """
+
+    __tablename__ = "grant_balance"
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", primary_key=True)
+    committed_amount: float = Field(default=0)  # approved expenses
+    pending_amount: float = Field(default=0)  # expenses without an approval
+    spent_amount: float = Field(default=0)  # every expense, including rejected
+    reserved_amount: float = Field(
+        default=0, sa_column_kwargs={"server_default": "0"}
+    )  # held reservations
+    expense_count: int = Field(
+        default=0, sa_column_kwargs={"server_default": "0"}
+    )  # expenses owned by the grant
+    version: int = Field(default=1)  # bumped on every change to the grant
+    updated_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantBalanceCarryover(SQLModel, table=True):
+    """
+    Grant Balance Carryover Table Model. The spend of a grant in a year
+    whose expenses were detached into an archive, still counted in its
+    grant_balance. Written by grant_expense_detach_partition, see
+    app.expense_partitions.
+    """
+
+    __tablename__ = "grant_balance_carryover"
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", primary_key=True)
+    year: int = Field(primary_key=True)
+    committed_amount: float = Field(default=0)
+    pending_amount: float = Field(default=0)
+    spent_amount: float = Field(default=0)
+    created_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantBalanceDrift(SQLModel):
+    """Difference between a stored grant balance and its source rows."""
+
+    grant_id: uuid.UUID
+    committed_amount: float
+    expected_committed_amount: float
+    pending_amount: float
+    expected_pending_amount: float
+    spent_amount: float
+    expected_spent_amount: float
+    reserved_amount: float
+    expected_reserved_amount: float
+    expense_count: int
+    expected_expense_count: int
+
+
+class GrantBalanceDriftsPublic(SQLModel):
+    data: list[GrantBalanceDrift]
+    count: int
+
+
+class ReservationStatus(str, Enum):
+    """Enum for Reservation Status."""
+
+    HELD = "held"
+    FINALIZED = "finalized"
+    RELEASED = "released"
+    EXPIRED = "expired"
+
+
+class GrantReservationBase(SQLModel):
+    """Base Grant Reservation Model."""
+
+    grant_id: uuid.UUID = Field(foreign_key="grant.id", index=True)
+    amount: float = Field(gt=0)
+    description: Optional[str] = Field(default=None)
+
+
+class GrantReservationCreate(GrantReservationBase):
+    """
+    Model for placing a new reservation. Without an expiry it expires after
+    RESERVATION_EXPIRE_HOURS.
+    """
+
+    expires_at: Optional[datetime] = None
+
+
+class GrantReservationFinalize(SQLModel):
+    """Expense details given when a reservation is turned into an expense."""
+
+    amount: Optional[float] = Field(default=None, gt=0)  # the held amount if unset
+    date: datetime
+    description: str
+    category: str
+    invoice_number: Optional[str] = None
+
+
+class GrantReservation(GrantReservationBase, table=True):
+    """
+    Grant Reservation Table Model. A held reservation sets money aside on
+    its grant until it is finalized into an expense, released or expires.
+    """
+
+    __tablename__ = "grant_reservation"
+    __table_args__ = (Index("ix_grant_reservation_created_at_id", "created_at", "id"),)
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    status: ReservationStatus = Field(default=ReservationStatus.HELD)
+    expires_at: datetime = Field(
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False)
+    )
+    expense_id: Optional[uuid.UUID] = Field(default=None)
+    created_by: uuid.UUID = Field(foreign_key="user.id")
+    created_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+    updated_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantReservationPublic(GrantReservationBase):
+    id: uuid.UUID
+    status: ReservationStatus
+    expires_at: datetime
+    expense_id: Optional[uuid.UUID]
+    created_by: uuid.UUID
+    created_at: datetime
+    updated_at: datetime
+
+
+class GrantReservationsPublic(SQLModel):
+    data: list[GrantReservationPublic]
+    count: Optional[int]  # None when listed with count=none
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
+
+
+class ExpenseImportFormat(str, Enum):
+    """Enum for the file formats of the bulk expense import."""
+
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class ExpenseExportFormat(str, Enum):
+    """Enum for the file formats of the expense export."""
+
+    CSV = "csv"
+    NDJSON = "ndjson"
+    ARROW = "arrow"  # Arrow IPC stream
+    PARQUET = "parquet"
+
+
+class GrantExpenseStaging(SQLModel, table=True):
+    """
+    Grant Expense Staging Table Model. The bulk import copies every batch
+    into this unlogged table, validates it set-wise and moves the accepted
+    rows into grant_expense. Rows only live for their import's transaction.
+    """
+
+    __tablename__ = "grant_expense_staging"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    batch_id: uuid.UUID = Field(primary_key=True)
+    line: int = Field(primary_key=True)  # line of the row in the imported file
+    amount: float
+    date: datetime = Field(sa_column=Column(TIMESTAMP(timezone=True), nullable=False))
+    description: str
+    category: str
+    invoice_number: Optional[str] = None
+    grant_id: uuid.UUID
+    error: Optional[str] = None
+
+
+class ExpenseImportError(SQLModel):
+    line: int
+    error: str
+
+
+class ExpenseImportReport(SQLModel):
+    imported: int
+    errors: list[ExpenseImportError]
+
+
+class GrantExpenseBatch(SQLModel):
+    """
+    Expenses created together. Atomic batches are only created when every
+    expense is valid, otherwise each valid expense is created on its own.
+    """
+
+    items: List[GrantExpenseBase] = Field(min_length=1)
+    atomic: bool = False
+
+
+class GrantExpenseBatchItem(SQLModel):
+    index: int  # position of the expense in the batch
+    expense: Optional[GrantExpensePublic] = None  # None unless it was created
+    error: Optional[str] = None
+    pg_code: Optional[str] = None  # SQLSTATE of rule violations
+
+
+class GrantExpenseBatchResult(SQLModel):
+    created: int
+    results: list[GrantExpenseBatchItem]
+
+
+class GrantBudgetLineBase(SQLModel):
+    """Base Grant Budget Line Model."""
+
+    category: str = Field(foreign_key="grant_category.code")
+    label: str  # line of the budget, e.g. "Domestic" travel
+    period: int = Field(ge=1)  # budget year, 1 is the year the grant starts
+    amount: float
+
+
+class GrantBudgetLine(GrantBudgetLineBase, table=True):
+    """
+    Grant Budget Line Table Model. The amount budgeted for one line of a
+    grant's budget in one budget year.
+    """
+
+    __tablename__ = "grant_budget_line"
+    __table_args__ = (
+        Index(
+            "ix_grant_budget_line_grant_id_category_period",
+            "grant_id",
+            "category",
+            "period",
+        ),
+    )
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    grant_id: uuid.UUID = Field(foreign_key="grant.id")
+    created_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+    updated_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantBudgetLinePublic(GrantBudgetLineBase):
+    id: uuid.UUID
+    grant_id: uuid.UUID
+    created_at: datetime
+    updated_at: datetime
+
+
+class GrantBudgetLinesPublic(SQLModel):
+    data: list[GrantBudgetLinePublic]
+    count: int
+
+
+class GrantBudgetImport(SQLModel):
+    """Records created by a budget spreadsheet import."""
+
+    grant: GrantPublic
+    lines: list[GrantBudgetLinePublic]
+    rule_ids: list[uuid.UUID]
+
+
+class GrantExpenseSearchHit(GrantExpensePublic):
+    score: float  # trigram similarity to the search, 1 is an exact match
+
+
+class GrantSearchHit(GrantPublic):
+    score: float  # trigram similarity to the search, 1 is an exact match
+
+
+class SearchResults(SQLModel):
+    expenses: list[GrantExpenseSearchHit]
+    grants: list[GrantSearchHit]
+
+
+class GrantExpensePartition(SQLModel):
+    """A partition of the grant_expense table."""
+
+    name: str
+    bound: str  # e.g. FOR VALUES FROM ('2024-01-01') TO ('2025-01-01'), or DEFAULT
+    estimated_rows: int
+
+
+class GrantExpensePartitionsPublic(SQLModel):
+    data: list[GrantExpensePartition]
+    count: int
+
+
+class ChangeEntity(str, Enum):
+    """Enum for the kind of record a change is about."""
+
+    EXPENSE = "expense"
+    APPROVAL = "approval"
+
+
+class ChangeOperation(str, Enum):
+    """Enum for the write that changed a record."""
+
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+
+
+class GrantChangeBase(SQLModel):
+    grant_id: uuid.UUID
+    entity: ChangeEntity
+    entity_id: uuid.UUID
+    operation: ChangeOperation
+
+
+class GrantChange(GrantChangeBase, table=True):
+    """
+    Change log of the expenses and approvals per grant. Rows are written by
+    triggers in the writing transaction (see app/changes.py), so a change is
+    logged exactly when its write commits. Changes are read in the order of
+    the id of their transaction, then of their own id, see read_changes.
+    """
+
+    __tablename__ = "grant_change"
+    __table_args__ = (
+        Index("ix_grant_change_xact_id_id", "xact_id", "id"),
+        Index("ix_grant_change_grant_id_xact_id_id", "grant_id", "xact_id", "id"),
+        brin_index("grant_change", "created_at"),
+    )
+    id: Optional[int] = Field(
+        default=None, sa_column=Column(BigInteger, primary_key=True)
+    )
+    xact_id: int = Field(sa_column=Column(BigInteger, nullable=False))
+    created_at: datetime = Field(
+        default_factory=get_utc_now,
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+class GrantChangePublic(GrantChangeBase):
+    id: int
+    created_at: datetime
+    cursor: str  # pass as `after` to get the changes after this one
+
+
+class GrantChangesPublic(SQLModel):
+    data: list[GrantChangePublic]
+    count: int
+    # Pass as `after` to get the next changes, None without changes
+    last_cursor: Optional[str] = None
+
+
 # END
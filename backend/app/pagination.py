@@ -0,0 +1,135 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Float, Integer, Uuid, tuple_
+from sqlmodel import Session, func, select
+
+
+class CountMode(str, Enum):
+    """How the total count of a list response is computed."""
+
+    EXACT = "exact"
+    ESTIMATE = "estimate"  # planner row estimate or maintained counters
+    NONE = "none"  # no count, for clients that only follow next_cursor
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    payload = json.dumps(
+        [
+            value.isoformat() if isinstance(value, datetime) else str(value)
+            for value in values
+        ]
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence[Any]) -> List[Any]:
+    """Decode a cursor back into values of the given sort key columns."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("Cursor does not match the sort key")
+        decoded = []
+        for key, value in zip(keys, values):
+            if not isinstance(value, str):
+                raise ValueError("Cursor values are strings")
+            if isinstance(key.type, DateTime):
+                decoded.append(datetime.fromisoformat(value))
+            elif isinstance(key.type, Uuid):
+                decoded.append(UUID(value))
+            elif isinstance(key.type, Float):
+                decoded.append(float(value))
+            elif isinstance(key.type, Integer):
+                decoded.append(int(value))
+            else:
+                decoded.append(value)
+        return decoded
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(
+    statement: Any,
+    keys: Sequence[Any],
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+) -> Any:
+    """
+    Order a select by a unique sort key and restrict it to one page.
+
+    With a cursor the page starts right after the row the cursor was taken
+    from (keyset pagination), so every page costs the same as the first as
+    long as an index covers the key. Without a cursor `skip` is applied as
+    an offset. One row more than the limit is selected to tell whether
+    another page follows, see `page`.
+    """
+    if descending:
+        statement = statement.order_by(*[key.desc() for key in keys])
+    else:
+        statement = statement.order_by(*keys)
+    if cursor is not None:
+        values = decode_cursor(cursor, keys)
+        if descending:
+            statement = statement.where(tuple_(*keys) < tuple_(*values))
+        else:
+            statement = statement.where(tuple_(*keys) > tuple_(*values))
+    elif skip:
+        statement = statement.offset(skip)
+    return statement.limit(limit + 1)
+
+
+def page(
+    rows: Sequence[Any], keys: Sequence[Any], limit: int
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Split the rows selected by `paginate` into the page and the cursor of
+    the next page, None on the last page.
+    """
+    if len(rows) <= limit:
+        return list(rows), None
+    rows = list(rows[:limit])
+    return rows, encode_cursor([getattr(rows[-1], key.key) for key in keys])
+
+
+def _planner_estimate(session: Session, statement: Any) -> int:
+    """Return the number of rows the planner expects a select to return."""
+    compiled = statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={"render_postcompile": True},
+    )
+    plan = (
+        session.connection()
+        .exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        .scalar()
+    )
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_rows(
+    session: Session,
+    statement: Any,
+    mode: CountMode,
+    estimate_statement: Optional[Any] = None,
+) -> Optional[int]:
+    """
+    Count the rows of an unpaginated list select in the requested mode.
+    An estimate uses `estimate_statement` when given, e.g. a sum over
+    maintained counters, otherwise the planner's row estimate.
+    """
+    if mode == CountMode.NONE:
+        return None
+    if mode == CountMode.ESTIMATE:
+        if estimate_statement is not None:
+            return int(session.exec(estimate_statement).one() or 0)
+        return _planner_estimate(session, statement)
+    return session.exec(select(func.count()).select_from(statement.subquery())).one()
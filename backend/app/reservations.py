@@ -0,0 +1,151 @@
+import logging
+from datetime import timedelta, timezone
+from typing import List, Optional
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlmodel import Session, func, update
+
+from app.categories import category_registry
+from app.core.config import settings
+from app.core.db import engine
+from app.ledger import DRIFT_TOLERANCE, available_balance, lock_grants
+from app.models import (
+    GrantExpense,
+    GrantReservation,
+    GrantReservationCreate,
+    GrantReservationFinalize,
+    ReservationStatus,
+)
+from app.utils import get_utc_now
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def expire_reservations(
+    session: Session, grant_ids: Optional[List[UUID]] = None
+) -> int:
+    """
+    Release every held reservation (of the given grants) past its expiry.
+    Returns the number of reservations expired, the caller commits.
+    """
+    statement = (
+        update(GrantReservation)
+        .where(GrantReservation.status == ReservationStatus.HELD)
+        .where(GrantReservation.expires_at <= func.now())
+        .values(status=ReservationStatus.EXPIRED, updated_at=func.now())
+    )
+    if grant_ids is not None:
+        statement = statement.where(GrantReservation.grant_id.in_(grant_ids))
+    return session.exec(statement).rowcount
+
+
+def place_reservation(
+    session: Session, reservation_in: GrantReservationCreate, user_id: UUID
+) -> GrantReservation:
+    """
+    Hold funds on a grant. The grant's advisory lock is taken before its
+    balance is read, so two reservations can never both claim the same
+    money. The caller commits, which releases the lock.
+    """
+    now = get_utc_now()
+    expires_at = reservation_in.expires_at or now + timedelta(
+        hours=settings.RESERVATION_EXPIRE_HOURS
+    )
+    # An expiry without a time zone is taken as UTC
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= now:
+        raise HTTPException(status_code=400, detail="Expiry must be in the future")
+
+    lock_grants(session, [reservation_in.grant_id])
+    expire_reservations(session, [reservation_in.grant_id])
+    available = available_balance(session, reservation_in.grant_id)
+    if available is None:
+        raise HTTPException(status_code=404, detail="Grant not found")
+    if reservation_in.amount > available + DRIFT_TOLERANCE:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Insufficient funds, {available:.2f} available",
+        )
+
+    reservation = GrantReservation(
+        **reservation_in.model_dump(exclude={"expires_at"}),
+        expires_at=expires_at,
+        created_by=user_id,
+    )
+    session.add(reservation)
+    return reservation
+
+
+def _lock_held(session: Session, reservation: GrantReservation) -> None:
+    """Lock the reservation's grant and make sure it is still held."""
+    lock_grants(session, [reservation.grant_id])
+    # Another writer may have finalized or released it while we waited
+    session.refresh(reservation)
+    if (
+        reservation.status != ReservationStatus.HELD
+        or reservation.expires_at <= get_utc_now()
+    ):
+        raise HTTPException(status_code=409, detail="Reservation is not held")
+
+
+def finalize_reservation(
+    session: Session,
+    reservation: GrantReservation,
+    finalize_in: GrantReservationFinalize,
+    user_id: UUID,
+) -> GrantExpense:
+    """
+    Turn a held reservation into an expense. An expense above the held
+    amount needs the difference to be available on the grant. The caller
+    commits.
+    """
+    _lock_held(session, reservation)
+    amount = finalize_in.amount or reservation.amount
+    if amount > reservation.amount:
+        available = available_balance(session, reservation.grant_id) or 0.0
+        if amount - reservation.amount > available + DRIFT_TOLERANCE:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Insufficient funds, {available:.2f} available",
+            )
+
+    category = category_registry.get(session, finalize_in.category)
+    if not category:
+        raise HTTPException(status_code=400, detail="Invalid expense category")
+
+    expense = GrantExpense(
+        **finalize_in.model_dump(exclude={"amount"}),
+        amount=amount,
+        grant_id=reservation.grant_id,
+        created_by=user_id,
+    )
+    session.add(expense)
+    session.flush()
+    reservation.status = ReservationStatus.FINALIZED
+    reservation.expense_id = expense.id
+    reservation.updated_at = get_utc_now()
+    session.add(reservation)
+    return expense
+
+
+def release_reservation(session: Session, reservation: GrantReservation) -> None:
+    """Give the funds held by a reservation back to its grant."""
+    _lock_held(session, reservation)
+    reservation.status = ReservationStatus.RELEASED
+    reservation.updated_at = get_utc_now()
+    session.add(reservation)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Expiring grant reservations")
+    with Session(engine) as session:
+        count = expire_reservations(session)
+        session.commit()
+    logger.info(f"Expired {count} grant reservations")
+
+
+if __name__ == "__main__":
+    main()
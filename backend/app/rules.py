@@ -1,11 +1,12 @@
 import re
 from logging import getLogger
-from typing import List
+from typing import List, Tuple
 from uuid import UUID
 
 from fastapi import HTTPException
 from sqlmodel import Session, select, text
 
+from app.ledger import GRANT_LOCK_CLASS
 from app.models import (
     Grant,
     Rule,
@@ -57,6 +58,22 @@ def _generate_function_name(rule_id: Rule) -> str:
     return f"rule_function_{clean(rule_id.name)}_{clean(str(rule_id.id)[:8])}"
 
 
+def _grant_value(value: str) -> str:
+    """Map grant.<field> references to the variables of the trigger function."""
+    if value.startswith("grant."):
+        grant_field = value.split(".")[1]
+        return f"grant_{grant_field}"
+    return value
+
+
+def _expense_value(field: str) -> str:
+    """
+    SQL value of an expense field in an EXPENSE rule trigger. The amount is
+    the share charged to the rule's grant.
+    """
+    return "share" if field == "amount" else f"NEW.{field}"
+
+
 def _generate_trigger_function(
     rule: Rule, filters: List[RuleFilter], conditions: List[RuleCondition]
 ) -> str:
@@ -74,7 +91,22 @@ def _generate_trigger_function(
         grant_end_date TIMESTAMP;
         grant_total_amount DECIMAL;
         error_message TEXT;
+        total DOUBLE PRECISION;
+        share DOUBLE PRECISION;
     BEGIN
+        -- Only expenses charged to the rule's grant are checked. A grant
+        -- that only carries an allocation is checked against its share.
+        IF NEW.grant_id = '{rule.grant_id}' THEN
+            share := NEW.amount;
+        ELSE
+            SELECT SUM(amount) INTO share
+            FROM grant_expense_share
+            WHERE expense_id = NEW.id AND grant_id = '{rule.grant_id}';
+            IF share IS NULL THEN
+                RETURN NEW;
+            END IF;
+        END IF;
+
         -- Get grant information
         SELECT start_date, end_date, total_amount
         INTO grant_start_date, grant_end_date, grant_total_amount
@@ -91,16 +123,9 @@ def _generate_trigger_function(
     for filter in filters:
         field = filter.field
         operator = filter.operator
-        value = filter.value
-        # logger.info(f"Filter: {field} {operator} {value}")
-
-        # Handle grant field references
-        if value.startswith("grant."):
-            grant_field = value.split(".")[1]
-            value = f"grant_{grant_field}"
-
+        value = _grant_value(filter.value)
         sql += f"""
-        IF NOT (NEW.{field} {operator.value} {value}) THEN
+        IF NOT ({_expense_value(field)} {operator.value} {value}) THEN
             RETURN NEW;
         END IF;
         """
@@ -110,57 +135,42 @@ def _generate_trigger_function(
         for condition in conditions:
             field = condition.field
             operator = condition.operator.value
-            value = condition.value
-            # Handle grant field references
-            if value.startswith("grant."):
-                grant_field = value.split(".")[1]
-                value = f"grant_{grant_field}"
-
+            value = _grant_value(condition.value)
             sql += f"""
-            IF NOT (NEW.{field} {operator} {value}) THEN
+            IF NOT ({_expense_value(field)} {operator} {value}) THEN
                 RAISE EXCEPTION '{rule.error_message}';
             END IF;
             """
     else:  # BUDGET type rule
-        # For budget rules, we need to aggregate existing expenses
+        # Budget rules run after the row is written, so the aggregate includes
+        # it. Writers to the same grant are serialized by the grant's advisory
+        # lock (already held when the ledger triggers took it for this row): a
+        # concurrent expense waits until this transaction ends, then its
+        # aggregate sees the committed row and cannot overspend.
         sql += f"""
-        IF EXISTS (
-            SELECT 1
-            FROM (
-                SELECT {rule.aggregator}({field}) as total
-                FROM grant_expense
-                WHERE grant_id = '{rule.grant_id}'
+        PERFORM pg_advisory_xact_lock({GRANT_LOCK_CLASS}, hashtext('{rule.grant_id}'));
         """
-
-        # Add filter conditions to the aggregation query
+        # The aggregate covers the expense shares, so split expenses count
+        # towards every grant they are allocated to
+        where = f"grant_id = '{rule.grant_id}'"
         for filter in filters:
-            field = filter.field
-            operator = filter.operator.value
-            value = filter.value
-
-            if value.startswith("grant."):
-                grant_field = value.split(".")[1]
-                value = f"grant_{grant_field}"
-
-            sql += f" AND {field} {operator} {value}"
-
-        sql += ") as agg"
-
-        # Add condition checks for the aggregated value
+            where += (
+                f" AND {filter.field} {filter.operator.value}"
+                f" {_grant_value(filter.value)}"
+            )
         for condition in conditions:
             field = condition.field
             operator = condition.operator.value
-            value = condition.value
-
-            if value.startswith("grant."):
-                grant_field = value.split(".")[1]
-                value = f"grant_{grant_field}"
-
-            sql += f" WHERE agg.total {operator} {value}"
-
-        sql += ") THEN"
-        sql += f" RAISE EXCEPTION '{rule.error_message}';"
-        sql += " END IF;"
+            value = _grant_value(condition.value)
+            sql += f"""
+            SELECT COALESCE({rule.aggregator.value}({field}), 0)
+            INTO total
+            FROM grant_expense_share
+            WHERE {where};
+            IF NOT (total {operator} {value}) THEN
+                RAISE EXCEPTION '{rule.error_message}';
+            END IF;
+            """
 
     # End the function
     sql += """
@@ -172,42 +182,80 @@ def _generate_trigger_function(
     return sql
 
 
-def create_trigger(
+def _install_trigger(
     session: Session,
     rule: Rule,
     filters: List[RuleFilter],
     conditions: List[RuleCondition],
 ) -> None:
     """
-    Create a PostgreSQL trigger for a rule.
+    Create or replace the PostgreSQL function and trigger of a rule.
+    Expense rules check the row before it is written, budget rules check
+    the aggregate after it is written.
     """
-    # Generate function and trigger names
     function_name = _generate_function_name(rule)
     trigger_name = _generate_trigger_name(rule)
-
-    # Generate the trigger function
-    function_sql = _generate_trigger_function(rule, filters, conditions)
+    timing = "BEFORE" if rule.rule_type == RuleType.EXPENSE else "AFTER"
 
     # Create the trigger function
-    session.exec(text(function_sql))
+    session.exec(text(_generate_trigger_function(rule, filters, conditions)))
 
     # Create the trigger
     trigger_sql = f"""
     DROP TRIGGER IF EXISTS {trigger_name} ON grant_expense;
     CREATE TRIGGER {trigger_name}
-        BEFORE INSERT OR UPDATE
+        {timing} INSERT OR UPDATE
         ON grant_expense
         FOR EACH ROW
         EXECUTE FUNCTION {function_name}();
     """
     session.exec(text(trigger_sql))
 
+
+def create_trigger(
+    session: Session,
+    rule: Rule,
+    filters: List[RuleFilter],
+    conditions: List[RuleCondition],
+) -> None:
+    """
+    Create a PostgreSQL trigger for a rule.
+    """
+    _install_trigger(session, rule, filters, conditions)
+
     # Create the trigger record
-    trigger = RuleTrigger(
-        rule_id=rule.id, trigger_name=trigger_name, function_name=function_name
-    )
-    session.add(trigger)
+    trigger = session.exec(
+        select(RuleTrigger).where(RuleTrigger.rule_id == rule.id)
+    ).first()
+    if not trigger:
+        trigger = RuleTrigger(
+            rule_id=rule.id,
+            trigger_name=_generate_trigger_name(rule),
+            function_name=_generate_function_name(rule),
+        )
+        session.add(trigger)
+    session.commit()
+
+
+def rebuild_triggers(session: Session) -> int:
+    """
+    Regenerate the functions and triggers of every active rule, so rules
+    created by an older version pick up changes to the generated SQL.
+    Returns the number of rules rebuilt.
+    """
+    rules = session.exec(select(Rule).where(Rule.is_active)).all()
+    for rule in rules:
+        filters = session.exec(
+            select(RuleFilter).where(RuleFilter.rule_id == rule.id)
+        ).all()
+        conditions = session.exec(
+            select(RuleCondition)
+            .where(RuleCondition.rule_id == rule.id)
+            .order_by(RuleCondition.order)
+        ).all()
+        _install_trigger(session, rule, filters, conditions)
     session.commit()
+    return len(rules)
 
 
 def _remove_trigger(session: Session, rule_id: UUID) -> None:
@@ -258,15 +306,16 @@ async def validate_rule(
     return True
 
 
-async def create_rule_from_template(
+def add_rule_from_template(
     session: Session,
     template_name: str,
     grant_id: UUID,
-    user_id: UUID,
     kwargs: dict = {},
-) -> RulePublic:
+) -> Tuple[Rule, List[RuleFilter], List[RuleCondition]]:
     """
-    Create a new rule from a template and set up its PostgreSQL trigger.
+    Add a rule from a template with its filters, conditions and trigger to
+    the session without committing, so it can be created together with
+    other records.
     """
     if template_name not in RULE_TEMPLATES:
         raise ValueError(f"Unknown rule template: {template_name}")
@@ -284,40 +333,60 @@ async def create_rule_from_template(
         error_message=kwargs.get("error_message", template["error_message"]),
         is_active=True,
     )
-
     session.add(rule)
-    session.commit()
-    session.refresh(rule)
+    session.flush()
 
     # Create filters
-    filters = []
-    for filter_data in template.get("filters", []):
-        filter = RuleFilter(
+    filters = [
+        RuleFilter(
             rule_id=rule.id,
             field=filter_data["field"],
             operator=filter_data["operator"],
             value=filter_data["value"],
         )
-        session.add(filter)
-        filters.append(filter)
-    session.commit()
+        for filter_data in template.get("filters", [])
+    ]
 
     # Create conditions
-    conditions = []
-    for condition_data in template.get("conditions", []):
-        condition = RuleCondition(
+    conditions = [
+        RuleCondition(
             rule_id=rule.id,
             field=condition_data["field"],
             operator=condition_data["operator"],
             value=condition_data["value"],
             order=condition_data["order"],
         )
-        session.add(condition)
-        conditions.append(condition)
-    session.commit()
+        for condition_data in template.get("conditions", [])
+    ]
+    session.add_all(filters + conditions)
+    session.flush()
+
+    # Create the PostgreSQL trigger and its record
+    _install_trigger(session, rule, filters, conditions)
+    session.add(
+        RuleTrigger(
+            rule_id=rule.id,
+            trigger_name=_generate_trigger_name(rule),
+            function_name=_generate_function_name(rule),
+        )
+    )
+    return rule, filters, conditions
+
 
-    # Create the PostgreSQL trigger
-    create_trigger(session, rule, filters, conditions)
+async def create_rule_from_template(
+    session: Session,
+    template_name: str,
+    grant_id: UUID,
+    user_id: UUID,
+    kwargs: dict = {},
+) -> RulePublic:
+    """
+    Create a new rule from a template and set up its PostgreSQL trigger.
+    """
+    rule, filters, conditions = add_rule_from_template(
+        session, template_name, grant_id, kwargs
+    )
+    session.commit()
     session.refresh(rule)
 
     return RulePublic(
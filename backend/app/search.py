@@ -0,0 +1,84 @@
+from typing import Any, List
+
+from sqlmodel import Session, func, or_, select
+
+from app.models import (
+    Grant,
+    GrantExpense,
+    GrantExpenseSearchHit,
+    GrantSearchHit,
+    User,
+)
+from app.permissions import GrantPermission, GrantRole
+
+
+def _contains(column: Any, query: str) -> Any:
+    """ILIKE '%query%' with the wildcards of the query escaped."""
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.ilike(f"%{escaped}%", escape="\\")
+
+
+def _matches(columns: List[Any], query: str) -> Any:
+    """
+    Match the query as a substring or a fuzzy word of any of the columns.
+    Both operators are served by the columns' trigram indexes.
+    """
+    return or_(
+        *[_contains(column, query) for column in columns],
+        *[column.op("%>")(query) for column in columns],
+    )
+
+
+def _score(columns: List[Any], query: str) -> Any:
+    """Best word similarity of the query to any of the columns."""
+    return func.greatest(
+        *[func.word_similarity(query, func.coalesce(column, "")) for column in columns]
+    )
+
+
+def search_expenses(
+    session: Session, user: User, query: str, limit: int
+) -> List[GrantExpenseSearchHit]:
+    """
+    Find the expenses whose description or invoice number matches the query,
+    best match first. Regular users only find expenses of the grants they
+    have the GrantPermission.VIEW_EXPENSES on.
+    """
+    columns = [GrantExpense.description, GrantExpense.invoice_number]
+    score = _score(columns, query).label("score")
+    statement = select(GrantExpense, score).where(_matches(columns, query))
+    if not user.is_superuser:
+        subquery = (
+            select(GrantRole.grant_id)
+            .where(GrantRole.user_id == user.id)
+            .where(GrantRole.permissions.any(GrantPermission.VIEW_EXPENSES.value))
+        )
+        statement = statement.where(GrantExpense.grant_id.in_(subquery))
+    statement = statement.order_by(score.desc(), GrantExpense.id).limit(limit)
+    return [
+        GrantExpenseSearchHit(**expense.model_dump(), score=value)
+        for expense, value in session.exec(statement).all()
+    ]
+
+
+def search_grants(
+    session: Session, user: User, query: str, limit: int
+) -> List[GrantSearchHit]:
+    """
+    Find the grants whose title or funding agency matches the query, best
+    match first. Regular users only find the grants they own or have a role
+    on.
+    """
+    columns = [Grant.title, Grant.funding_agency]
+    score = _score(columns, query).label("score")
+    statement = select(Grant, score).where(_matches(columns, query))
+    if not user.is_superuser:
+        roles = select(GrantRole.grant_id).where(GrantRole.user_id == user.id)
+        statement = statement.where(
+            (Grant.owner_id == user.id) | Grant.id.in_(roles)
+        )
+    statement = statement.order_by(score.desc(), Grant.id).limit(limit)
+    return [
+        GrantSearchHit(**grant.model_dump(), score=value)
+        for grant, value in session.exec(statement).all()
+    ]
@@ -7,7 +7,7 @@ from app import crud
 from app.api.deps import get_db
 from app.core.config import settings
 from app.main import app
-from app.models import GrantPublic, User, UserCreate
+from app.models import GrantCategory, GrantPublic, User, UserCreate
 from fastapi.testclient import TestClient
 from sqlalchemy.engine import Engine
 from sqlmodel import Session, SQLModel, create_engine, select
@@ -145,3 +145,16 @@ def make_grant(user_login, client: TestClient):
     resp_grant = GrantPublic(**data)
 
     yield resp_grant
+
+
+@pytest.fixture(name="category")
+def make_category(session: Session, client: TestClient) -> str:
+    """Expense category code shared by the tests, created on first use."""
+    code = "TRV"
+    # Posting an existing code fails the shared session's commit
+    existing = session.exec(select(GrantCategory).where(GrantCategory.code == code))
+    if existing.first() is None:
+        category_data = {"name": f"Test {code}", "code": code}
+        response = client.post("/api/v1/grant-categories/", json=category_data)
+        assert response.status_code == 200
+    return code
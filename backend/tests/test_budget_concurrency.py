@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from app.ledger import lock_grants
+from app.models import GrantBalance, GrantExpense, GrantPublic
+from fastapi.testclient import TestClient
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, create_engine, func, select, text
+
+if TYPE_CHECKING:
+    from tests.conftest import UserData  # noqa: F401
+
+# Every writer holds its own connection, below Postgres' default limit of 100
+WRITERS = 50
+# The writers ask for more than twice the grant amount
+EXPENSE_AMOUNT = 5000.0
+
+
+def _expense(grant: GrantPublic, user: "UserData", category: str) -> GrantExpense:
+    return GrantExpense(
+        amount=EXPENSE_AMOUNT,
+        date=datetime(2024, 6, 1, tzinfo=timezone.utc),
+        description="Concurrent expense",
+        category=category,
+        grant_id=grant.id,
+        created_by=user.id,
+    )
+
+
+def test_budget_rule_holds_under_concurrent_writers(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    test_user: "UserData",
+    engine: Engine,
+    category: str,
+):
+    """Parallel expenses on one grant never overspend its budget rule."""
+    r = client.post(
+        f"/api/v1/rules/grant/{grant_data.id}/template/max_grant_funding",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    writers_engine = create_engine(engine.url, pool_size=WRITERS, max_overflow=0)
+
+    def write(_: int) -> bool:
+        with Session(writers_engine) as session:
+            session.add(_expense(grant_data, test_user, category))
+            try:
+                session.commit()
+            except DBAPIError:
+                session.rollback()
+                return False
+            return True
+
+    with ThreadPoolExecutor(max_workers=WRITERS) as executor:
+        results = list(executor.map(write, range(WRITERS)))
+    writers_engine.dispose()
+
+    with Session(engine) as session:
+        spent = session.exec(
+            select(func.sum(GrantExpense.amount)).where(
+                GrantExpense.grant_id == grant_data.id
+            )
+        ).one()
+        balance = session.get(GrantBalance, grant_data.id)
+    # The rule keeps the total strictly below the grant amount, the writers
+    # fill it up to the last expense that fits
+    cap = (grant_data.total_amount // EXPENSE_AMOUNT - 1) * EXPENSE_AMOUNT
+    assert sum(results) == cap // EXPENSE_AMOUNT
+    assert spent == cap
+    assert balance.spent_amount == cap
+
+
+def test_grant_lock_does_not_block_other_grants(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    test_user: "UserData",
+    engine: Engine,
+    category: str,
+):
+    """Holding one grant's lock leaves writers on other grants unaffected."""
+    other_grant_data = {
+        "title": "Unrelated Grant",
+        "funding_agency": "Test Agency",
+        "start_date": "2024-01-01T00:00:00Z",
+        "end_date": "2024-12-31T00:00:00Z",
+        "total_amount": 1000.0,
+    }
+    r = client.post("/api/v1/grants/", json=other_grant_data, headers=user_login)
+    assert r.status_code == 200
+    other_grant = GrantPublic(**r.json())
+
+    with Session(engine) as holder, Session(engine) as writer:
+        lock_grants(holder, [grant_data.id])
+        # Fails instead of waiting if the write needs the held lock
+        writer.exec(text("SET LOCAL lock_timeout = '2s'"))
+        writer.add(_expense(other_grant, test_user, category))
+        writer.commit()
+        holder.rollback()
@@ -0,0 +1,101 @@
+import io
+
+from fastapi.testclient import TestClient
+from openpyxl import Workbook, load_workbook
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _budget_workbook(title: str = "Imported Grant") -> bytes:
+    """A budget laid out like docs/UI-Budget-Template.xlsx."""
+    workbook = Workbook()
+    sheet = workbook.active
+    rows = [
+        ["Title:", title],
+        ["Funding source:", "Test Agency"],
+        ["PI", "CoPIs: "],
+        ["Project Start and End Dates:", "01/01/2024-12/31/2025"],
+        [None, None, "Hourly rate at start date", "Y1", "Y2", "Total"],
+        ["Personnel Compensation", "Y1 Hours"],
+        ["PI", 100, 50, 5000, 5000, 10000],
+        ["Travel"],
+        ["Domestic", None, None, 500, 0, 500],
+        ["Total Direct Cost", None, None, 5500, 5000, 10500],
+        ["Back out capital EQ", None, None, 0, 0, 0],
+        ["Indirect Costs", None, 0.5, 2750, 2500, 5250],
+        ["Total Project Cost", None, None, 8250, 7500, 15750],
+    ]
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _import(client: TestClient, auth: dict, content: bytes, query: str = ""):
+    return client.post(
+        f"/api/v1/grant-budgets/import{query}",
+        files={"file": ("budget.xlsx", content, XLSX)},
+        headers=auth,
+    )
+
+
+def test_import_budget(user_login: dict, client: TestClient):
+    """A budget sheet creates the grant, its budget lines and its rules."""
+    r = _import(client, user_login, _budget_workbook())
+    assert r.status_code == 200
+    result = r.json()
+    grant = result["grant"]
+    assert grant["title"] == "Imported Grant"
+    assert grant["total_amount"] == 15750
+    assert len(result["rule_ids"]) == 1
+    lines = {
+        (line["category"], line["label"], line["period"]): line["amount"]
+        for line in result["lines"]
+    }
+    assert lines == {
+        ("SAL", "PI", 1): 5000,
+        ("SAL", "PI", 2): 5000,
+        ("TRV", "Domestic", 1): 500,
+        ("IDC", "Indirect Costs", 1): 2750,
+        ("IDC", "Indirect Costs", 2): 2500,
+    }
+
+    r = client.get(f"/api/v1/grant-budgets/{grant['id']}", headers=user_login)
+    assert r.status_code == 200
+    assert r.json()["count"] == 5
+
+    r = client.get(f"/api/v1/rules/grant/{grant['id']}", headers=user_login)
+    assert r.status_code == 200
+
+
+def test_import_invalid_budget(user_login: dict, client: TestClient):
+    """Files that are not budget sheets create nothing."""
+    r = _import(client, user_login, b"not a workbook")
+    assert r.status_code == 400
+
+    r = _import(client, user_login, _budget_workbook(), "?templates=nope")
+    assert r.status_code == 400
+
+
+def test_export_budget(user_login: dict, client: TestClient):
+    """The budget report sets the actual expenses against the budget."""
+    grant = _import(client, user_login, _budget_workbook()).json()["grant"]
+    expense_data = {
+        "amount": 120.0,
+        "date": "2024-03-01T00:00:00Z",
+        "description": "Conference travel",
+        "category": "TRV",
+        "grant_id": grant["id"],
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+
+    r = client.get(f"/api/v1/grant-budgets/{grant['id']}/export", headers=user_login)
+    assert r.status_code == 200
+    rows = list(load_workbook(io.BytesIO(r.content)).active.iter_rows(values_only=True))
+    header = rows[4]
+    assert header[:4] == ("Category", "Code", "Y1 Budget", "Y1 Actual")
+    travel = next(row for row in rows if row[1] == "TRV")
+    assert travel[2:4] == (500, 120)
+    assert rows[-1][0] == "Total"
@@ -0,0 +1,97 @@
+import time
+
+from app.categories import CategoryListener, CategoryRegistry, category_registry
+from app.models import GrantCategory, GrantPublic
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+
+def test_list_categories_from_registry(client: TestClient):
+    """Created categories are listed without waiting for a notification."""
+    category_registry.invalidate()
+    r = client.get("/api/v1/grant-categories/?limit=1000")
+    assert r.status_code == 200
+    before = r.json()["count"]
+
+    r = client.post(
+        "/api/v1/grant-categories/", json={"name": "Registry A", "code": "REGA"}
+    )
+    assert r.status_code == 200
+    r = client.get("/api/v1/grant-categories/?limit=1000")
+    codes = [category["code"] for category in r.json()["data"]]
+    assert r.json()["count"] == before + 1
+    assert "REGA" in codes
+    assert codes == sorted(codes)
+
+    r = client.get("/api/v1/grant-categories/?limit=1")
+    cursor = r.json()["next_cursor"]
+    r = client.get(f"/api/v1/grant-categories/?limit=1000&cursor={cursor}")
+    assert [category["code"] for category in r.json()["data"]] == codes[1:]
+
+
+def test_unknown_code_reloads_registry(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, engine: Engine
+):
+    """A category created behind the registry's back is still accepted."""
+    with Session(engine) as session:
+        category_registry.all(session)
+        session.add(GrantCategory(name="Registry B", code="REGB"))
+        session.commit()
+
+    expense_data = {
+        "amount": 10.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Test expense",
+        "category": "REGB",
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+
+
+def test_unknown_code_is_remembered(engine: Engine):
+    """An unknown code reads its row once, until the categories change."""
+    registry = CategoryRegistry()
+    queries = []
+
+    def count(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    with Session(engine) as session:
+        registry.load(session)
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            assert registry.get(session, "REGD") is None
+            assert registry.get(session, "REGD") is None
+            assert len(queries) == 1
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        session.add(GrantCategory(name="Registry D", code="REGD"))
+        session.commit()
+        # As the listener does on the change notification
+        registry.invalidate()
+        assert registry.get(session, "REGD") is not None
+
+
+def test_listener_invalidates_registry(engine: Engine):
+    """Changes committed anywhere reach the registry through NOTIFY."""
+    registry = CategoryRegistry()
+    with Session(engine) as session:
+        registry.load(session)
+    listener = CategoryListener(registry, poll_seconds=0.1)
+    listener.start()
+    try:
+        time.sleep(0.5)
+        with Session(engine) as session:
+            registry.load(session)
+            session.add(GrantCategory(name="Registry C", code="REGC"))
+            session.commit()
+        deadline = time.monotonic() + 5
+        while not registry.stale:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        listener.stop()
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import uuid
+
+from app.changes import ChangeBroker, read_changes
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+
+def test_read_grant_changes(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Expense and approval writes are logged as changes of their grant."""
+    r = client.get(
+        f"/api/v1/grant-changes/?grant_id={grant_data.id}", headers=user_login
+    )
+    assert r.status_code == 200
+    assert r.json()["last_cursor"] is None
+
+    expense_data = {
+        "amount": 10.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Changed expense",
+        "category": category,
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense = r.json()
+    r = client.post(
+        "/api/v1/grant-approvals/",
+        json={"expense_id": expense["id"], "status": "approved"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    approval = r.json()
+
+    r = client.get(
+        f"/api/v1/grant-changes/?grant_id={grant_data.id}", headers=user_login
+    )
+    assert r.status_code == 200
+    changes = r.json()
+    events = [
+        (change["entity"], change["entity_id"], change["operation"])
+        for change in changes["data"]
+    ]
+    assert ("expense", expense["id"], "insert") in events
+    assert ("approval", approval["id"], "insert") in events
+    assert changes["last_cursor"] == changes["data"][-1]["cursor"]
+
+    r = client.get(
+        "/api/v1/grant-changes/",
+        params={"grant_id": str(grant_data.id), "after": changes["last_cursor"]},
+        headers=user_login,
+    )
+    assert r.json()["count"] == 0
+
+    r = client.get(
+        f"/api/v1/grant-changes/?grant_id={uuid.uuid4()}", headers=user_login
+    )
+    assert r.status_code == 403
+
+
+def test_broker_publishes_changes(engine: Engine, grant_data: GrantPublic):
+    """Committed changes reach the subscribed streams through NOTIFY."""
+    broker = ChangeBroker(poll_seconds=0.1)
+    broker.start()
+
+    async def receive():
+        subscription = broker.subscribe({grant_data.id})
+        try:
+            await asyncio.sleep(0.5)
+            with Session(engine) as session:
+                session.exec(
+                    text(
+                        "SELECT grant_change_record("
+                        ":grant_id, 'EXPENSE', :entity_id, 'UPDATE')"
+                    ),
+                    params={"grant_id": grant_data.id, "entity_id": uuid.uuid4()},
+                )
+                session.commit()
+            return await asyncio.wait_for(subscription.queue.get(), 5)
+        finally:
+            broker.unsubscribe(subscription)
+
+    try:
+        time.sleep(0.5)
+        change = asyncio.run(receive())
+    finally:
+        broker.stop()
+    assert change.grant_id == grant_data.id
+
+
+def test_split_expense_changes(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """A split expense is logged as a change of every grant it is charged to."""
+    other_grant_data = {
+        "title": "Shared Grant",
+        "funding_agency": "Test Agency",
+        "start_date": "2024-01-01T00:00:00Z",
+        "end_date": "2025-12-31T00:00:00Z",
+        "total_amount": 10000.0,
+    }
+    r = client.post("/api/v1/grants/", json=other_grant_data, headers=user_login)
+    assert r.status_code == 200
+    other_grant = GrantPublic(**r.json())
+
+    expense_data = {
+        "amount": 100.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Shared purchase",
+        "category": category,
+        "grant_id": str(grant_data.id),
+        "allocations": [{"grant_id": str(other_grant.id), "percentage": 40}],
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense = r.json()
+    r = client.post(
+        "/api/v1/grant-approvals/",
+        json={"expense_id": expense["id"], "status": "approved"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    r = client.get(
+        f"/api/v1/grant-changes/?grant_id={other_grant.id}", headers=user_login
+    )
+    assert r.status_code == 200
+    events = {(change["entity"], change["operation"]) for change in r.json()["data"]}
+    assert ("expense", "insert") in events
+    assert ("approval", "insert") in events
+
+
+def test_changes_follow_commit_order(engine: Engine, grant_data: GrantPublic):
+    """A change is held back while an older transaction can still log one."""
+
+    def record(session: Session) -> None:
+        session.exec(
+            text(
+                "SELECT grant_change_record(:grant_id, 'EXPENSE', :entity_id, 'UPDATE')"
+            ),
+            params={"grant_id": grant_data.id, "entity_id": uuid.uuid4()},
+        )
+
+    with Session(engine) as reader:
+        latest = read_changes(reader, None, {grant_data.id}, 1000)
+        after = latest[-1].cursor if latest else None
+        with Session(engine) as older, Session(engine) as newer:
+            record(older)
+            record(newer)
+            newer.commit()
+            assert read_changes(reader, after, {grant_data.id}, 10) == []
+            reader.rollback()
+            older.commit()
+        changes = read_changes(reader, after, {grant_data.id}, 10)
+    assert len(changes) == 2
+    assert changes[0].id < changes[1].id
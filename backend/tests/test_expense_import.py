@@ -0,0 +1,177 @@
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+
+
+def test_import_csv(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, category: str
+):
+    """Valid rows are imported, the others are reported by line."""
+    content = "\n".join(
+        [
+            "amount,date,description,category,invoice_number,grant_id",
+            f"100.0,2024-06-01T00:00:00Z,Flight,{category},INV-1,{grant_data.id}",
+            f"50.0,2024-06-02T00:00:00Z,Hotel,NOPE,,{grant_data.id}",
+            f"lots,2024-06-03T00:00:00Z,Taxi,{category},,{grant_data.id}",
+            f"25.0,2024-06-04T00:00:00Z,Meals,{category},,{grant_data.id}",
+        ]
+    )
+    r = client.post(
+        "/api/v1/grant-expenses/import",
+        files={"file": ("expenses.csv", content, "text/csv")},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    report = r.json()
+    assert report["imported"] == 2
+    assert [error["line"] for error in report["errors"]] == [3, 4]
+    assert report["errors"][0]["error"] == "Invalid expense category"
+
+    r = client.get(
+        f"/api/v1/grant-expenses/?grant_id={grant_data.id}", headers=user_login
+    )
+    assert sorted(expense["amount"] for expense in r.json()["data"]) == [25.0, 100.0]
+
+
+def test_import_ndjson_rule_violation(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Rows breaking a rule are rejected without losing the rest of the batch."""
+    r = client.post(
+        f"/api/v1/rules/grant/{grant_data.id}/template/max_grant_funding",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    amounts = [40000.0, grant_data.total_amount, 30000.0]
+    content = "\n".join(
+        json.dumps(
+            {
+                "amount": amount,
+                "date": "2024-06-01T00:00:00Z",
+                "description": "Equipment",
+                "category": category,
+                "grant_id": str(grant_data.id),
+            }
+        )
+        for amount in amounts
+    )
+    r = client.post(
+        "/api/v1/grant-expenses/import?format=ndjson",
+        files={"file": ("expenses.ndjson", content, "application/x-ndjson")},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    report = r.json()
+    assert report["imported"] == 2
+    assert [error["line"] for error in report["errors"]] == [2]
+
+
+def _batch_item(grant: GrantPublic, amount: float, category: str) -> dict:
+    return {
+        "amount": amount,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Batch expense",
+        "category": category,
+        "grant_id": str(grant.id),
+    }
+
+
+def test_batch_create(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, category: str
+):
+    """Each batch item is created or rejected on its own."""
+    r = client.post(
+        f"/api/v1/rules/grant/{grant_data.id}/template/max_grant_funding",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    items = [
+        _batch_item(grant_data, 100.0, category),
+        _batch_item(grant_data, 100.0, "NOPE"),
+        _batch_item(grant_data, grant_data.total_amount, category),
+    ]
+    r = client.post(
+        "/api/v1/grant-expenses/batch", json={"items": items}, headers=user_login
+    )
+    assert r.status_code == 200
+    result = r.json()
+    assert result["created"] == 1
+    assert result["results"][0]["expense"]["amount"] == 100.0
+    assert result["results"][1]["error"] == "Invalid expense category"
+    assert result["results"][2]["pg_code"] is not None
+
+    r = client.post(
+        "/api/v1/grant-expenses/batch",
+        json={"items": items, "atomic": True},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    assert r.json()["created"] == 0
+    r = client.get(
+        f"/api/v1/grant-expenses/?grant_id={grant_data.id}", headers=user_login
+    )
+    assert r.json()["count"] == 1
+
+
+def test_export(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, category: str
+):
+    """Exported expenses round-trip through the CSV and NDJSON formats."""
+    items = [_batch_item(grant_data, amount, category) for amount in [10.0, 20.0]]
+    r = client.post(
+        "/api/v1/grant-expenses/batch", json={"items": items}, headers=user_login
+    )
+    assert r.json()["created"] == 2
+
+    url = f"/api/v1/grant-expenses/export?grant_id={grant_data.id}"
+    r = client.get(url, headers=user_login)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/csv")
+    lines = r.text.splitlines()
+    assert lines[0].startswith("id,grant_id,date,amount")
+    assert len(lines) == 3
+
+    r = client.get(f"{url}&format=ndjson", headers=user_login)
+    assert r.status_code == 200
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["amount"] for row in rows] == [10.0, 20.0]
+    assert all(row["grant_id"] == str(grant_data.id) for row in rows)
+
+
+def test_columnar_export(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Arrow and Parquet exports carry the approval status of every expense."""
+    items = [_batch_item(grant_data, amount, category) for amount in [10.0, 20.0]]
+    r = client.post(
+        "/api/v1/grant-expenses/batch", json={"items": items}, headers=user_login
+    )
+    approved = r.json()["results"][0]["expense"]
+    r = client.post(
+        "/api/v1/grant-approvals/",
+        json={"expense_id": approved["id"], "status": "approved"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    url = f"/api/v1/grant-expenses/export?grant_id={grant_data.id}"
+    r = client.get(f"{url}&format=parquet", headers=user_login)
+    assert r.status_code == 200
+    table = pq.read_table(io.BytesIO(r.content))
+    assert table.column("amount").to_pylist() == [10.0, 20.0]
+    assert table.column("approval_status").to_pylist() == ["approved", "pending"]
+
+    r = client.get(f"{url}&format=arrow", headers=user_login)
+    assert r.status_code == 200
+    table = pa.ipc.open_stream(r.content).read_all()
+    assert table.column("category_name").to_pylist() == [f"Test {category}"] * 2
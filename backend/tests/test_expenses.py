@@ -0,0 +1,45 @@
+import uuid
+
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+
+
+def test_create_expense_checks(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """A rejected expense is reported by the check it failed."""
+    expense_data = {
+        "amount": 10.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Checked expense",
+        "category": category,
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post(
+        "/api/v1/grant-expenses/",
+        json={**expense_data, "grant_id": str(uuid.uuid4())},
+        headers=user_login,
+    )
+    assert r.status_code == 404
+    assert r.json()["detail"] == "Grant not found"
+
+    r = client.post(
+        "/api/v1/grant-expenses/",
+        json={**expense_data, "category": "NOPE"},
+        headers=user_login,
+    )
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Invalid expense category"
+
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense = r.json()
+    assert expense["description"] == "Checked expense"
+    assert expense["grant_id"] == str(grant_data.id)
+
+    r = client.get(f"/api/v1/grant-expenses/{expense['id']}", headers=user_login)
+    assert r.status_code == 200
+    assert r.json()["amount"] == 10.0
@@ -177,5 +177,64 @@ def test_grant_pagination(user_login: dict, client: TestClient) -> None:
     assert len(data["data"]) == 2
 
 
+@pytest.mark.username("testUser")
+def test_grant_cursor_pagination(user_login: dict, client: TestClient) -> None:
+    """Following next_cursor visits every grant exactly once."""
+    for _ in range(5):
+        _create_grant(client, user_login)
+    response = client.get("/api/v1/grants/?limit=1000", headers=user_login)
+    expected = [grant["id"] for grant in response.json()["data"]]
+
+    seen = []
+    url = "/api/v1/grants/?limit=2"
+    while True:
+        response = client.get(url, headers=user_login)
+        assert response.status_code == 200
+        data = response.json()
+        seen += [grant["id"] for grant in data["data"]]
+        if data["next_cursor"] is None:
+            break
+        url = f"/api/v1/grants/?limit=2&cursor={data['next_cursor']}"
+    assert seen == expected
+
+    response = client.get("/api/v1/grants/?cursor=not-a-cursor", headers=user_login)
+    assert response.status_code == 400
+
+
+@pytest.mark.username("testUser")
+def test_grant_count_modes(user_login: dict, client: TestClient) -> None:
+    """Counting can be skipped or estimated."""
+    for _ in range(2):
+        _create_grant(client, user_login)
+    response = client.get("/api/v1/grants/?count=none", headers=user_login)
+    assert response.status_code == 200
+    assert response.json()["count"] is None
+
+    response = client.get("/api/v1/grants/?count=estimate", headers=user_login)
+    assert response.status_code == 200
+    estimate = response.json()["count"]
+    assert isinstance(estimate, int)
+    assert estimate >= 0
+
+    response = client.get("/api/v1/grants/?count=exact", headers=user_login)
+    assert response.json()["count"] >= 2
+
+    # Skipping the count still pages with next_cursor
+    response = client.get("/api/v1/grants/?count=none&limit=1", headers=user_login)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] is None
+    assert len(data["data"]) == 1
+    assert data["next_cursor"] is not None
+    response = client.get(
+        f"/api/v1/grants/?count=none&limit=1&cursor={data['next_cursor']}",
+        headers=user_login,
+    )
+    assert response.status_code == 200
+    assert response.json()["count"] is None
+    assert len(response.json()["data"]) == 1
+    assert response.json()["data"][0]["id"] != data["data"][0]["id"]
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,94 @@
+from typing import TYPE_CHECKING
+
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+
+if TYPE_CHECKING:
+    from tests.conftest import UserData  # noqa: F401
+
+
+def _get_login_headers(client: TestClient, username, password):
+    login_data = {"username": username, "password": password}
+    response = client.post("/api/v1/login/access-token", data=login_data)
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_expense_partitions(
+    test_superuser,  # type: UserData
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Expenses keep working while their year is partitioned and detached."""
+    auth = _get_login_headers(client, test_superuser.email, test_superuser.password)
+    expense_data = {
+        "amount": 10.0,
+        "date": "1999-03-01T00:00:00Z",
+        "description": "Archived expense",
+        "category": category,
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense = r.json()
+    r = client.post(
+        "/api/v1/grant-approvals/",
+        json={"expense_id": expense["id"], "status": "approved"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    # The expense moves from the default partition into its year's
+    r = client.post("/api/v1/grant-expenses/partitions/maintain", headers=auth)
+    assert r.status_code == 200
+    names = [partition["name"] for partition in r.json()["data"]]
+    assert "grant_expense_y1999" in names
+    assert "grant_expense_default" in names
+    r = client.get(f"/api/v1/grant-expenses/{expense['id']}", headers=user_login)
+    assert r.status_code == 200
+
+    # Changing the date moves the approved expense to another partition
+    r = client.put(
+        f"/api/v1/grant-expenses/{expense['id']}",
+        json={**expense_data, "date": "2000-03-01T00:00:00Z"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    r = client.get("/api/v1/grant-projection/ledger/drift", headers=auth)
+    assert r.json()["count"] == 0
+
+    r = client.post("/api/v1/grant-expenses/partitions/1999/detach", headers=auth)
+    assert r.status_code == 200
+    r = client.post("/api/v1/grant-expenses/partitions/1999/detach", headers=auth)
+    assert r.status_code == 404
+    r = client.get("/api/v1/grant-expenses/partitions", headers=user_login)
+    assert r.status_code in [401, 403]
+
+    # A year counting towards a budget rule stays attached
+    r = client.post("/api/v1/grant-expenses/partitions/maintain", headers=auth)
+    names = [partition["name"] for partition in r.json()["data"]]
+    assert "grant_expense_y2000" in names
+    r = client.post(
+        f"/api/v1/rules/grant/{grant_data.id}/template/max_grant_funding",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    rule = r.json()
+    r = client.post("/api/v1/grant-expenses/partitions/2000/detach", headers=auth)
+    assert r.status_code == 409
+    r = client.put(
+        f"/api/v1/rules/{rule['id']}",
+        json={**rule, "is_active": False},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    # The detached spend is carried over, the ledger does not drift
+    r = client.post("/api/v1/grant-expenses/partitions/2000/detach", headers=auth)
+    assert r.status_code == 200
+    r = client.get(f"/api/v1/grant-expenses/{expense['id']}", headers=user_login)
+    assert r.status_code == 404
+    r = client.get("/api/v1/grant-projection/ledger/drift", headers=auth)
+    assert r.json()["count"] == 0
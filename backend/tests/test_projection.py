@@ -0,0 +1,496 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+from app.forecast import fit_burn_rates
+from app.models import (
+    GrantPublic,
+    Rule,
+    RuleAggregator,
+    RuleCondition,
+    RuleFilter,
+    RuleOperator,
+    RuleType,
+)
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+if TYPE_CHECKING:
+    from tests.conftest import UserData  # noqa: F401
+
+
+def _create_expense(
+    client: TestClient,
+    auth: dict,
+    grant: GrantPublic,
+    amount: float,
+    category: str,
+) -> dict:
+    expense_data = {
+        "amount": amount,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Test expense",
+        "category": category,
+        "grant_id": str(grant.id),
+    }
+    response = client.post("/api/v1/grant-expenses/", json=expense_data, headers=auth)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_projection_empty_grant(
+    user_login: dict, client: TestClient, grant_data: GrantPublic
+):
+    """A grant without expenses projects its full amount as remaining."""
+    r = client.get(f"/api/v1/grant-projection/{grant_data.id}", headers=user_login)
+    assert r.status_code == 200
+    projection = r.json()
+    assert projection["existing_expense_amount"] == 0
+    assert projection["projected_expense_amount"] == 0
+    assert projection["grant_current_remaining_funds"] == grant_data.total_amount
+
+
+def test_projection_approved_and_pending(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Approved expenses are committed, unreviewed ones are pending."""
+    approved = _create_expense(client, user_login, grant_data, 100.0, category)
+    _create_expense(client, user_login, grant_data, 50.0, category)
+    rejected = _create_expense(client, user_login, grant_data, 25.0, category)
+    for expense, status in [(approved, "approved"), (rejected, "rejected")]:
+        r = client.post(
+            "/api/v1/grant-approvals/",
+            json={"expense_id": expense["id"], "status": status},
+            headers=user_login,
+        )
+        assert r.status_code == 200
+
+    r = client.get(f"/api/v1/grant-projection/{grant_data.id}", headers=user_login)
+    assert r.status_code == 200
+    projection = r.json()
+    assert projection["existing_expense_amount"] == 100.0
+    assert projection["projected_expense_amount"] == 50.0
+    assert projection["grant_current_remaining_funds"] == grant_data.total_amount - 100
+    assert (
+        projection["grant_projected_remaining_funds"] == grant_data.total_amount - 150
+    )
+
+
+def _get_login_headers(client: TestClient, username, password):
+    login_data = {"username": username, "password": password}
+
+    response = client.post("/api/v1/login/access-token", data=login_data)
+    assert response.status_code == 200
+    data = response.json()
+    assert "access_token" in data
+    return {"Authorization": f"Bearer {data['access_token']}"}
+
+
+def test_ledger_has_no_drift(
+    test_superuser,  # type: UserData
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """The trigger maintained ledger matches a recomputation from source."""
+    _create_expense(client, user_login, grant_data, 10.0, category)
+    auth = _get_login_headers(client, test_superuser.email, test_superuser.password)
+
+    r = client.get("/api/v1/grant-projection/ledger/drift", headers=auth)
+    assert r.status_code == 200
+    assert r.json()["count"] == 0
+
+
+def test_portfolio_projection(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """The portfolio lists a projection for every grant the user can view."""
+    _create_expense(client, user_login, grant_data, 10.0, category)
+    r = client.get("/api/v1/grant-projection/", headers=user_login)
+    assert r.status_code == 200
+    payload = r.json()
+    assert payload["count"] == len(payload["data"])
+    projections = {p["grant_id"]: p for p in payload["data"]}
+    assert str(grant_data.id) in projections
+    assert projections[str(grant_data.id)]["projected_expense_amount"] == 10.0
+
+    r = client.get(
+        "/api/v1/grant-projection/",
+        params={"funding_agency": "No Such Agency"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    assert r.json()["count"] == 0
+
+
+def test_category_projection(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """The per category breakdown rolls up into the grand total."""
+    _create_expense(client, user_login, grant_data, 30.0, category)
+    _create_expense(client, user_login, grant_data, 20.0, category)
+    r = client.get(
+        f"/api/v1/grant-projection/{grant_data.id}/by-category", headers=user_login
+    )
+    assert r.status_code == 200
+    payload = r.json()
+    assert [c["category"] for c in payload["data"]] == [category]
+    assert payload["data"][0]["pending_amount"] == 50.0
+    assert payload["total"]["pending_amount"] == 50.0
+    assert payload["total"]["remaining_amount"] == grant_data.total_amount - 50
+
+    r = client.get(
+        f"/api/v1/grant-projection/{grant_data.id}/by-category",
+        params={"start_date": "2025-01-01T00:00:00Z"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    assert r.json()["data"] == []
+
+
+def test_fit_burn_rates():
+    """Burn rates are fitted per grant, grants without spend burn nothing."""
+    group = np.array([0, 0, 0, 1, 2])
+    days = np.array([10.0, 20.0, 30.0, 0.0, 5.0])
+    amounts = np.array([10.0, 10.0, 10.0, 0.0, 50.0])
+    rate, spent = fit_burn_rates(group, days, amounts, 3)
+    assert np.allclose(rate, [1.0, 0.0, 10.0])
+    assert np.allclose(spent, [30.0, 0.0, 50.0])
+
+
+def test_grant_forecast(
+    test_superuser,  # type: UserData
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """The forecast batch caches a forecast for every grant."""
+    _create_expense(client, user_login, grant_data, 60000.0, category)
+    auth = _get_login_headers(client, test_superuser.email, test_superuser.password)
+    r = client.post("/api/v1/grant-projection/forecast/refresh", headers=auth)
+    assert r.status_code == 200
+
+    r = client.get(
+        f"/api/v1/grant-projection/{grant_data.id}/forecast", headers=user_login
+    )
+    assert r.status_code == 200
+    forecast = r.json()
+    assert forecast["spent_amount"] == 60000.0
+    assert forecast["exhausts_before_end"] is True
+
+
+def test_projection_cache_follows_grant_version(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """A cached projection is replaced as soon as the grant changes."""
+    url = f"/api/v1/grant-projection/{grant_data.id}"
+    r = client.get(url, headers=user_login)
+    assert r.json()["projected_expense_amount"] == 0
+    _create_expense(client, user_login, grant_data, 5.0, category)
+    r = client.get(url, headers=user_login)
+    assert r.json()["projected_expense_amount"] == 5.0
+
+    r = client.patch(
+        f"/api/v1/grants/{grant_data.id}",
+        json={"total_amount": 200000.0},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    r = client.get(url, headers=user_login)
+    assert r.json()["grant_total_funds"] == 200000.0
+
+
+def test_expense_allocation(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """An expense larger than one grant is split across two grants."""
+    other_grant_data = {
+        "title": "Other Grant",
+        "funding_agency": "Test Agency",
+        "start_date": "2024-01-01T00:00:00Z",
+        "end_date": "2025-12-31T00:00:00Z",
+        "total_amount": 100000.0,
+    }
+    r = client.post("/api/v1/grants/", json=other_grant_data, headers=user_login)
+    assert r.status_code == 200
+    other_grant = GrantPublic(**r.json())
+
+    request = {
+        "amount": 150000.0,
+        "date": "2024-06-01T00:00:00Z",
+        "category": category,
+        "grant_ids": [str(grant_data.id), str(other_grant.id)],
+    }
+    r = client.post(
+        "/api/v1/grant-projection/allocation", json=request, headers=user_login
+    )
+    assert r.status_code == 200
+    best = r.json()["data"][0]
+    assert best["feasible"] is True
+    allocations = {a["grant_id"]: a["amount"] for a in best["allocations"]}
+    # The grant expiring first is used up first
+    assert allocations[str(grant_data.id)] == 100000.0
+    assert allocations[str(other_grant.id)] == 50000.0
+
+
+def test_expense_allocation_filtered_rule(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    session: Session,
+    category: str,
+):
+    """A rule filtered to one category only caps the expenses of it."""
+    rule = Rule(
+        grant_id=grant_data.id,
+        name="Equipment limit",
+        rule_type=RuleType.EXPENSE,
+        error_message="Equipment is limited to 5000",
+    )
+    session.add(rule)
+    session.add(
+        RuleFilter(
+            rule_id=rule.id,
+            field="category",
+            operator=RuleOperator.EQUALS,
+            value="'EQP'",
+        )
+    )
+    session.add(
+        RuleCondition(
+            rule_id=rule.id,
+            field="amount",
+            operator=RuleOperator.LESS_THAN_EQUALS,
+            value="5000",
+            order=1,
+        )
+    )
+    session.commit()
+
+    def best_plan(category: str) -> dict:
+        request = {
+            "amount": 10000.0,
+            "date": "2024-06-01T00:00:00Z",
+            "category": category,
+            "grant_ids": [str(grant_data.id)],
+        }
+        r = client.post(
+            "/api/v1/grant-projection/allocation", json=request, headers=user_login
+        )
+        assert r.status_code == 200
+        return r.json()["data"][0]
+
+    plan = best_plan("TRV")
+    assert plan["feasible"] is True
+    assert plan["allocations"][0]["amount"] == 10000.0
+
+    plan = best_plan("EQP")
+    assert plan["feasible"] is False
+    assert plan["allocations"][0]["amount"] == 5000.0
+    assert plan["unallocated_amount"] == 5000.0
+
+
+def test_expense_allocation_budget_rule(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    session: Session,
+    category: str,
+):
+    """A budget rule caps a grant at the headroom its expenses leave."""
+    rule = Rule(
+        grant_id=grant_data.id,
+        name="Travel budget",
+        rule_type=RuleType.BUDGET,
+        aggregator=RuleAggregator.SUM,
+        error_message="Travel is limited to 20000",
+    )
+    session.add(rule)
+    session.add(
+        RuleFilter(
+            rule_id=rule.id,
+            field="category",
+            operator=RuleOperator.EQUALS,
+            value="'TRV'",
+        )
+    )
+    session.add(
+        RuleCondition(
+            rule_id=rule.id,
+            field="amount",
+            operator=RuleOperator.LESS_THAN_EQUALS,
+            value="20000",
+            order=1,
+        )
+    )
+    session.commit()
+    _create_expense(client, user_login, grant_data, 5000.0, "TRV")
+
+    def best_plan(category: str) -> dict:
+        request = {
+            "amount": 30000.0,
+            "date": "2024-06-01T00:00:00Z",
+            "category": category,
+            "grant_ids": [str(grant_data.id)],
+        }
+        r = client.post(
+            "/api/v1/grant-projection/allocation", json=request, headers=user_login
+        )
+        assert r.status_code == 200
+        return r.json()["data"][0]
+
+    plan = best_plan("TRV")
+    assert plan["feasible"] is False
+    assert plan["allocations"][0]["amount"] == 15000.0
+    assert plan["unallocated_amount"] == 15000.0
+
+    plan = best_plan("EQP")
+    assert plan["feasible"] is True
+    assert plan["allocations"][0]["amount"] == 30000.0
+
+
+def test_split_expense_projection(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """A split expense is charged to each grant by its allocation."""
+    other_grant_data = {
+        "title": "Shared Grant",
+        "funding_agency": "Test Agency",
+        "start_date": "2024-01-01T00:00:00Z",
+        "end_date": "2025-12-31T00:00:00Z",
+        "total_amount": 10000.0,
+    }
+    r = client.post("/api/v1/grants/", json=other_grant_data, headers=user_login)
+    assert r.status_code == 200
+    other_grant = GrantPublic(**r.json())
+
+    expense_data = {
+        "amount": 1000.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Shared purchase",
+        "category": category,
+        "grant_id": str(grant_data.id),
+        "allocations": [{"grant_id": str(other_grant.id), "percentage": 40}],
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense = r.json()
+
+    r = client.get(f"/api/v1/grant-projection/{other_grant.id}", headers=user_login)
+    assert r.json()["projected_expense_amount"] == 400.0
+    r = client.get(f"/api/v1/grant-projection/{grant_data.id}", headers=user_login)
+    assert r.json()["projected_expense_amount"] == 600.0
+
+    # Percentage allocations follow the expense amount
+    r = client.put(
+        f"/api/v1/grant-expenses/{expense['id']}",
+        json={**expense_data, "amount": 2000.0},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    r = client.get(
+        f"/api/v1/grant-expenses/{expense['id']}/allocations", headers=user_login
+    )
+    assert r.json()["data"][0]["amount"] == 800.0
+    r = client.get(f"/api/v1/grant-projection/{grant_data.id}", headers=user_login)
+    assert r.json()["projected_expense_amount"] == 1200.0
+
+    r = client.put(
+        f"/api/v1/grant-expenses/{expense['id']}/allocations",
+        json=[{"grant_id": str(other_grant.id), "amount": 5000.0}],
+        headers=user_login,
+    )
+    assert r.status_code == 400
+
+
+def test_expense_filters_and_sort(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Expenses can be filtered by status and amount and sorted by amount."""
+    approved = _create_expense(client, user_login, grant_data, 300.0, category)
+    _create_expense(client, user_login, grant_data, 100.0, category)
+    _create_expense(client, user_login, grant_data, 200.0, category)
+    r = client.post(
+        "/api/v1/grant-approvals/",
+        json={"expense_id": approved["id"], "status": "approved"},
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    url = f"/api/v1/grant-expenses/?grant_id={grant_data.id}"
+    r = client.get(f"{url}&status=approved", headers=user_login)
+    assert [expense["id"] for expense in r.json()["data"]] == [approved["id"]]
+
+    r = client.get(f"{url}&status=pending&amount_min=150", headers=user_login)
+    assert [expense["amount"] for expense in r.json()["data"]] == [200.0]
+
+    amounts = []
+    page_url = f"{url}&sort=amount&descending=true&limit=2"
+    while page_url:
+        data = client.get(page_url, headers=user_login).json()
+        amounts += [expense["amount"] for expense in data["data"]]
+        cursor = data["next_cursor"]
+        page_url = cursor and f"{url}&sort=amount&descending=true&cursor={cursor}"
+    assert amounts == [300.0, 200.0, 100.0]
+
+    r = client.get(f"{url}&sort=description", headers=user_login)
+    assert r.status_code == 422
+
+
+def test_period_spend(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, category: str
+):
+    """Spend is summed per period of the dated window only."""
+    dated = [("2022-02-14", 30.0), ("2022-02-15", 20.0), ("2022-04-01", 5.0)]
+    for date, amount in dated:
+        expense_data = {
+            "amount": amount,
+            "date": f"{date}T12:00:00Z",
+            "description": "Windowed expense",
+            "category": category,
+            "grant_id": str(grant_data.id),
+        }
+        r = client.post(
+            "/api/v1/grant-expenses/", json=expense_data, headers=user_login
+        )
+        assert r.status_code == 200
+
+    r = client.get(
+        "/api/v1/grant-projection/spend?start_date=2022-02-01T00:00:00Z"
+        "&end_date=2022-03-01T00:00:00Z&interval=month",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    spend = r.json()
+    assert spend["count"] == 1
+    assert spend["data"][0]["pending_amount"] == 50.0
+    assert spend["data"][0]["approved_amount"] == 0
+
+    r = client.get(
+        "/api/v1/grant-projection/spend?start_date=2022-03-01T00:00:00Z"
+        "&end_date=2022-02-01T00:00:00Z",
+        headers=user_login,
+    )
+    assert r.status_code == 400
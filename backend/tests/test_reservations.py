@@ -0,0 +1,121 @@
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+
+
+def _reserve(client: TestClient, auth: dict, grant: GrantPublic, amount: float):
+    reservation_data = {
+        "grant_id": str(grant.id),
+        "amount": amount,
+        "description": "Conference travel",
+    }
+    return client.post(
+        "/api/v1/grant-reservations/", json=reservation_data, headers=auth
+    )
+
+
+def test_reservation_holds_funds(
+    user_login: dict, client: TestClient, grant_data: GrantPublic
+):
+    """A reservation cannot claim money another reservation holds."""
+    r = _reserve(client, user_login, grant_data, 60000.0)
+    assert r.status_code == 200
+    assert r.json()["status"] == "held"
+
+    r = _reserve(client, user_login, grant_data, 50000.0)
+    assert r.status_code == 409
+
+    r = _reserve(client, user_login, grant_data, 40000.0)
+    assert r.status_code == 200
+
+
+def test_reservation_finalize(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Finalizing a reservation turns its hold into a pending expense."""
+    reservation = _reserve(client, user_login, grant_data, 1000.0).json()
+    finalize_data = {
+        "amount": 900.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Conference travel",
+        "category": category,
+    }
+    r = client.post(
+        f"/api/v1/grant-reservations/{reservation['id']}/finalize",
+        json=finalize_data,
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    expense = r.json()
+    assert expense["amount"] == 900.0
+
+    r = client.get(
+        f"/api/v1/grant-reservations/{reservation['id']}", headers=user_login
+    )
+    assert r.json()["status"] == "finalized"
+    assert r.json()["expense_id"] == expense["id"]
+
+    r = client.get(f"/api/v1/grant-projection/{grant_data.id}", headers=user_login)
+    assert r.json()["projected_expense_amount"] == 900.0
+
+    # A finalized reservation cannot be used again
+    r = client.post(
+        f"/api/v1/grant-reservations/{reservation['id']}/finalize",
+        json=finalize_data,
+        headers=user_login,
+    )
+    assert r.status_code == 409
+
+
+def test_reservation_release(
+    user_login: dict, client: TestClient, grant_data: GrantPublic
+):
+    """Released funds can be reserved again."""
+    reservation = _reserve(client, user_login, grant_data, 100000.0).json()
+    assert _reserve(client, user_login, grant_data, 1.0).status_code == 409
+
+    r = client.post(
+        f"/api/v1/grant-reservations/{reservation['id']}/release",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+    assert r.json()["status"] == "released"
+    assert _reserve(client, user_login, grant_data, 1.0).status_code == 200
+
+
+def test_reservation_blocks_expenses(
+    user_login: dict,
+    client: TestClient,
+    grant_data: GrantPublic,
+    category: str,
+):
+    """Expenses created directly cannot spend money a reservation holds."""
+    r = client.post(
+        "/api/v1/grant-reservations/",
+        json={
+            "grant_id": str(grant_data.id),
+            "amount": grant_data.total_amount - 50.0,
+            # Taken as UTC
+            "expires_at": "2099-01-01T00:00:00",
+        },
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    expense_data = {
+        "amount": 100.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Unreserved purchase",
+        "category": category,
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 409
+    r = client.post(
+        "/api/v1/grant-expenses/",
+        json={**expense_data, "amount": 50.0},
+        headers=user_login,
+    )
+    assert r.status_code == 200
@@ -1,5 +1,6 @@
 import pytest
 from app.models import (
+    GrantPublic,
     RulePublic,
 )
 from fastapi.testclient import TestClient
@@ -85,3 +86,39 @@ def test_delete_rule(user_login: dict, client: TestClient, created_rule, grant_d
     r2 = client.get(f"/api/v1/rules/grant/{grant_data.id}", headers=user_login)
     assert r2.status_code == 200
     assert r2.json()["count"] == 0
+
+
+def test_expense_rule_checks_allocated_share(
+    user_login: dict, client: TestClient, grant_data, category: str
+):
+    """An expense rule of a grant carrying an allocation checks its share."""
+    other_grant_data = {
+        "title": "Limited Grant",
+        "funding_agency": "Test Agency",
+        "start_date": "2024-01-01T00:00:00Z",
+        "end_date": "2025-12-31T00:00:00Z",
+        "total_amount": 10000.0,
+    }
+    r = client.post("/api/v1/grants/", json=other_grant_data, headers=user_login)
+    assert r.status_code == 200
+    other_grant = GrantPublic(**r.json())
+    r = client.post(
+        f"/api/v1/rules/grant/{other_grant.id}/template/max_expense_amount",
+        headers=user_login,
+    )
+    assert r.status_code == 200
+
+    expense_data = {
+        "amount": 3000.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Shared purchase",
+        "category": category,
+        "grant_id": str(grant_data.id),
+        "allocations": [{"grant_id": str(other_grant.id), "amount": 800.0}],
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+
+    expense_data["allocations"] = [{"grant_id": str(other_grant.id), "amount": 1200.0}]
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 409
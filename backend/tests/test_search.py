@@ -0,0 +1,34 @@
+from app.models import GrantPublic
+from fastapi.testclient import TestClient
+
+
+def test_search(
+    user_login: dict, client: TestClient, grant_data: GrantPublic, category: str
+):
+    """Expenses and grants are found by substring and by misspelled words."""
+    expense_data = {
+        "amount": 10.0,
+        "date": "2024-06-01T00:00:00Z",
+        "description": "Conference registration fee",
+        "category": category,
+        "invoice_number": "INV-SRCH-42",
+        "grant_id": str(grant_data.id),
+    }
+    r = client.post("/api/v1/grant-expenses/", json=expense_data, headers=user_login)
+    assert r.status_code == 200
+    expense_id = r.json()["id"]
+
+    r = client.get("/api/v1/search/?q=regstration", headers=user_login)
+    assert r.status_code == 200
+    hits = r.json()["expenses"]
+    assert expense_id in [hit["id"] for hit in hits]
+    assert all(hit["score"] <= hits[0]["score"] for hit in hits)
+
+    r = client.get("/api/v1/search/?q=SRCH-42", headers=user_login)
+    assert [hit["id"] for hit in r.json()["expenses"]] == [expense_id]
+
+    r = client.get("/api/v1/search/?q=Test Agency", headers=user_login)
+    assert str(grant_data.id) in [hit["id"] for hit in r.json()["grants"]]
+
+    r = client.get("/api/v1/search/?q=ab", headers=user_login)
+    assert r.status_code == 422